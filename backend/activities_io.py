@@ -0,0 +1,105 @@
+"""
+Bulk import and export of activities as NDJSON (one JSON object per line).
+
+Used by POST /api/activities/bulk, GET /api/activities/export and
+migrate.py. Imports stream through a single transaction: records are
+validated as they are read and inserted with executemany, and a title
+that already exists is skipped by an index lookup inside SQLite.
+"""
+import json
+import datetime
+import itertools
+
+STATUSES = ('Pending', 'Active', 'Completed')
+# Statuses used by the old tasks.json board
+LEGACY_STATUSES = {
+    "ToDo": "Pending",
+    "In Progress": "Active",
+    "Done": "Completed",
+}
+EXPORT_COLUMNS = ('id', 'title', 'description', 'status', 'last_updated')
+BATCH_SIZE = 1000
+
+INSERT_SQL = '''
+    INSERT INTO activities (title, description, status, last_updated)
+    VALUES (?, ?, ?, ?)
+'''
+INSERT_NEW_SQL = '''
+    INSERT INTO activities (title, description, status, last_updated)
+    SELECT ?1, ?2, ?3, ?4
+    WHERE NOT EXISTS (SELECT 1 FROM activities WHERE title = ?1)
+'''
+
+
+class InvalidRecord(ValueError):
+    """A record that cannot be imported; `line` is 1-based."""
+
+    def __init__(self, line, message):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+def _now():
+    return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def parse_ndjson(lines):
+    """Yields (line_number, object) from an iterable of str/bytes lines, skipping blank ones."""
+    for number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line)
+        except json.JSONDecodeError as e:
+            raise InvalidRecord(number, f"invalid JSON ({e.msg})")
+
+
+def to_row(number, record, now):
+    """Validates one record and returns the INSERT parameters."""
+    if not isinstance(record, dict):
+        raise InvalidRecord(number, "expected a JSON object")
+    title = record.get('title')
+    if not isinstance(title, str) or not title.strip():
+        raise InvalidRecord(number, "title is required")
+    status = record.get('status') or 'Pending'
+    status = LEGACY_STATUSES.get(status, status)
+    if status not in STATUSES:
+        raise InvalidRecord(number, f"invalid status {status!r}")
+    return (title, record.get('description') or '', status, record.get('last_updated') or now)
+
+
+def import_activities(conn, records, skip_existing=True, batch_size=BATCH_SIZE):
+    """
+    Inserts (line_number, dict) records in batches on `conn`; the caller
+    owns the transaction. Raises InvalidRecord on the first bad record.
+    Returns {"inserted": n, "skipped": n}.
+    """
+    sql = INSERT_NEW_SQL if skip_existing else INSERT_SQL
+    now = _now()
+    rows = (to_row(number, record, now) for number, record in records)
+    inserted = total = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        total += len(batch)
+        inserted += conn.executemany(sql, batch).rowcount
+    return {"inserted": inserted, "skipped": total - inserted}
+
+
+def export_activities(conn, status=None, batch_size=BATCH_SIZE):
+    """Yields activities as NDJSON lines in id order, fetching `batch_size` rows at a time."""
+    query = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM activities"
+    params = ()
+    if status:
+        query += " WHERE status = ?"
+        params = (status,)
+    cursor = conn.execute(query + " ORDER BY id", params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows)
@@ -0,0 +1,71 @@
+"""
+Search and filtered listing of activities, for GET /api/activities/search.
+
+Text queries go through the activities_fts index (see db.SEARCH_SCHEMA)
+and are ranked by bm25; filters on status and last_updated use
+idx_activities_status_updated. Every word of the query must match, and
+the last one also matches as a prefix, so results follow the user's
+typing. Without FTS5 the text match falls back to LIKE scans.
+"""
+import re
+import db
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+_fts_available = None
+
+
+def fts_query(text):
+    """'fix deploy scr' -> '"fix" "deploy" "scr"*'; None when there are no words."""
+    words = WORD.findall(text or '')
+    if not words:
+        return None
+    # Quoted, so FTS5 operators and column filters in user input are taken literally
+    return ' '.join(f'"{word}"' for word in words) + '*'
+
+
+def _like_pattern(word):
+    return '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _filters(status, updated_after, prefix=''):
+    clauses, params = [], []
+    if status:
+        clauses.append(f'{prefix}status = ?')
+        params.append(status)
+    if updated_after:
+        clauses.append(f'{prefix}last_updated > ?')
+        params.append(updated_after)
+    return clauses, params
+
+
+def search_activities(conn, q=None, status=None, updated_after=None, limit=50):
+    """Matching activities as dicts: best match first for text queries, else newest first."""
+    global _fts_available
+    if _fts_available is None:
+        _fts_available = db.has_search_index(conn)
+
+    match = fts_query(q)
+    if match and _fts_available:
+        clauses, params = _filters(status, updated_after, prefix='a.')
+        where = ''.join(f' AND {clause}' for clause in clauses)
+        rows = conn.execute(f'''
+            SELECT a.* FROM activities_fts
+            JOIN activities a ON a.id = activities_fts.rowid
+            WHERE activities_fts MATCH ?{where}
+            ORDER BY activities_fts.rank, a.last_updated DESC
+            LIMIT ?
+        ''', [match, *params, limit]).fetchall()
+        return [dict(row) for row in rows]
+
+    clauses, params = _filters(status, updated_after)
+    for word in WORD.findall(q or ''):
+        clauses.append("(title LIKE ? ESCAPE '\\' OR description LIKE ? ESCAPE '\\')")
+        params += [_like_pattern(word)] * 2
+    where = ' WHERE ' + ' AND '.join(clauses) if clauses else ''
+    rows = conn.execute(f'''
+        SELECT * FROM activities{where}
+        ORDER BY last_updated DESC, id DESC
+        LIMIT ?
+    ''', [*params, limit]).fetchall()
+    return [dict(row) for row in rows]
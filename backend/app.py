@@ -1,95 +1,231 @@
-import json
-import psutil
+import time
+# Taken before the other imports so the recorded import phase covers them
+_import_started = time.perf_counter()
+import io
 import os
-import sqlite3
 import datetime
-import time
-import subprocess
-import re
 import random
-import caldav
-from caldav.elements import dav
-from flask import Flask, jsonify, send_from_directory, request
+import threading
+from flask import Flask, jsonify, request, Response, g
 from flask_cors import CORS
-import gemini_service
+import db
+import activities_io
+import activities_search
+import metrics
+import token_monitor
+import token_rollups
+import token_retention
+import shared_state
+import static_assets
+from calendar_cache import CalendarCache
+from event_bus import bus, format_sse
+from schedule_cache import ScheduleCache
+from git_watcher import GitWatcher
+from stats_sampler import StatsSampler
+from process_sampler import ProcessSampler
 
 app = Flask(__name__, static_folder='../frontend/dist')
-CORS(app)
+CORS(app, expose_headers=['ETag', 'X-Activities-Version', 'X-Calendar-Error'])
+
+@app.before_request
+def _ensure_started():
+    # Servers that import `app` directly (flask run, gunicorn) never call create_app()
+    if not _started:
+        create_app()
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_latency(response):
+    # Streaming responses are timed up to the first byte, not for the life of the stream
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(route, request.method, response.status_code,
+                                time.perf_counter() - started)
+    return response
 
-DB_PATH = os.path.join(os.path.dirname(__file__), 'bmo_dashboard.db')
 AUTH_PATH = os.path.join(os.path.dirname(__file__), 'calendar_auth.json')
-REPO_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def init_db():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS activities (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        description TEXT,
-        status TEXT CHECK(status IN ('Pending', 'Active', 'Completed')) NOT NULL DEFAULT 'Pending',
-        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS token_usage (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-        model_name TEXT NOT NULL,
-        prompt_tokens INTEGER,
-        completion_tokens INTEGER,
-        total_tokens INTEGER,
-        api_call_count INTEGER DEFAULT 1,
-        success BOOLEAN,
-        error_message TEXT
-    )
-    ''')
-    conn.commit()
-    conn.close()
-
-def check_git_automation():
-    """Checks git log for #complete <id> and updates database."""
+# Repository watched for #complete markers (overridable for benchmarks)
+REPO_PATH = os.environ.get('BMO_REPO_PATH', os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# Seconds between checks of .git refs for new commits
+GIT_POLL_INTERVAL = float(os.environ.get('BMO_GIT_POLL_INTERVAL', 5))
+# Host stats sampling; default keeps 24h of history at 5s resolution
+STATS_INTERVAL = float(os.environ.get('BMO_STATS_INTERVAL', 5))
+STATS_RETENTION = float(os.environ.get('BMO_STATS_RETENTION', 86400))
+# Per-process sampling for /api/processes: top N by CPU and by RSS, and how
+# many samples of history each of them keeps
+PROCESS_INTERVAL = float(os.environ.get('BMO_PROCESS_INTERVAL', 5))
+PROCESS_TOP = int(os.environ.get('BMO_PROCESS_TOP', 10))
+PROCESS_HISTORY = int(os.environ.get('BMO_PROCESS_HISTORY', 60))
+# Calendar events are re-synced in the background once older than this
+CALENDAR_TTL = float(os.environ.get('BMO_CALENDAR_TTL', 300))
+# OpenClaw cron listing; the command can be swapped for a stand-in script
+SCHEDULE_COMMAND = os.environ.get('BMO_SCHEDULE_COMMAND', 'openclaw cron list --json')
+SCHEDULE_TIMEOUT = float(os.environ.get('BMO_SCHEDULE_TIMEOUT', 10))
+SCHEDULE_INTERVAL = float(os.environ.get('BMO_SCHEDULE_INTERVAL', 60))
+# all: a single process does everything. In multi-worker mode one process runs
+# as 'collector' (background jobs, publishes shared_state) and the HTTP
+# workers as 'worker' (serve requests from that snapshot).
+ROLE = os.environ.get('BMO_ROLE', 'all')
+# Completed activities older than this drop out of the default listing
+ACTIVITY_ARCHIVE_DAYS = int(os.environ.get('BMO_ACTIVITY_ARCHIVE_DAYS', 14))
+
+def _archive_cutoff():
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=ACTIVITY_ARCHIVE_DAYS)
+    return cutoff.strftime('%Y-%m-%d 00:00:00')
+
+def _activities_version():
+    with db.connection() as conn:
+        return db.table_version(conn, 'activities')
+
+def publish_activities(*_):
+    """Tells stream subscribers the activity list changed; they fetch the delta."""
+    if not bus.subscriber_count():
+        return
     try:
-        # Get last 10 commits
-        output = subprocess.check_output(
-            ['git', 'log', '-n', '10', '--pretty=format:%s'],
-            cwd=REPO_PATH,
-            stderr=subprocess.STDOUT
-        ).decode('utf-8')
-        
-        matches = re.findall(r'#complete\s+(\d+)', output, re.IGNORECASE)
-        if matches:
-            conn = get_db_connection()
-            for activity_id in matches:
-                conn.execute('''
-                    UPDATE activities 
-                    SET status = "Completed", last_updated = ?
-                    WHERE id = ? AND status != "Completed"
-                ''', (datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), activity_id))
-            conn.commit()
-            conn.close()
+        bus.publish('activities', {"version": _activities_version()})
     except Exception as e:
-        print(f"Git automation error: {e}")
-
-init_db()
-check_git_automation()
+        print(f"Activity publish error: {e}")
+
+git_watcher = GitWatcher(REPO_PATH, db.connection, interval=GIT_POLL_INTERVAL,
+                         on_complete=publish_activities)
+
+def publish_schedule(cache):
+    if bus.subscriber_count():
+        bus.publish('schedule', cache.get())
+
+if ROLE == 'worker':
+    # The collector owns the database setup and every background job
+    snapshot = shared_state.SnapshotReader()
+    stats_sampler = shared_state.StatsView(snapshot)
+    process_sampler = shared_state.ProcessView(snapshot)
+    calendar_cache = shared_state.CalendarView(snapshot)
+    schedule_cache = shared_state.ScheduleView(snapshot)
+    token_monitor.budget = shared_state.BudgetView(snapshot)
+    snapshot_watcher = shared_state.SnapshotWatcher(snapshot, bus)
+else:
+    retention_job = token_retention.RetentionJob()
+    stats_sampler = StatsSampler(interval=STATS_INTERVAL, retention=STATS_RETENTION)
+    process_sampler = ProcessSampler(interval=PROCESS_INTERVAL, top=PROCESS_TOP, history=PROCESS_HISTORY)
+    calendar_cache = CalendarCache(AUTH_PATH, ttl=CALENDAR_TTL)
+    schedule_cache = ScheduleCache(SCHEDULE_COMMAND, timeout=SCHEDULE_TIMEOUT,
+                                   interval=SCHEDULE_INTERVAL, on_refresh=publish_schedule)
+    stats_sampler.add_listener(lambda stats: bus.publish('stats', stats))
+
+_started = False
+_start_lock = threading.Lock()
+
+def _build_static_index():
+    try:
+        with metrics.startup_phase('static_index'):
+            static_index.ensure_built()
+    except Exception as e:
+        print(f"Static index error: {e}")
+
+def create_app(start_loops=True):
+    """
+    Does the startup work that importing this module leaves out: database
+    setup and budget load, the background jobs and the static index (built
+    on a thread; the first request for a file builds it if that has not
+    finished). Runs once per process and returns the Flask app.
+
+    start_loops=False leaves the git watcher and schedule refresh to the
+    caller; asgi.py runs them as asyncio tasks instead of threads.
+    """
+    global _started, snapshot_writer, snapshot_publisher
+    if _started:
+        return app
+    with _start_lock:
+        if _started:
+            return app
+        with metrics.startup_phase('create_app'):
+            if ROLE == 'worker':
+                # The collector owns the database setup and every background job
+                snapshot_watcher.start()
+            else:
+                with metrics.startup_phase('init_db'):
+                    db.init_db()
+                    with db.connection() as conn:
+                        token_rollups.backfill_if_empty(conn)
+                        token_monitor.budget.load(conn)
+                retention_job.start()
+                if start_loops:
+                    # The watcher's first poll catches up on commits made while we were down
+                    git_watcher.start()
+                    schedule_cache.start()
+                if ROLE == 'collector':
+                    snapshot_writer = shared_state.SnapshotWriter(
+                        history_size=len(stats_sampler.history.to_bytes()))
+                    snapshot_publisher = shared_state.SnapshotPublisher(
+                        snapshot_writer, stats_sampler, schedule_cache, calendar_cache,
+                        token_monitor.budget, process_sampler=process_sampler)
+                    snapshot_publisher.start()
+                stats_sampler.start()
+                process_sampler.start()
+            threading.Thread(target=_build_static_index, name='static-index', daemon=True).start()
+        _started = True
+    return app
+
+@app.errorhandler(shared_state.SnapshotUnavailable)
+def snapshot_unavailable(e):
+    return jsonify({"status": "error", "message": str(e)}), 503
 
 @app.route('/api/tasks', methods=['GET'])
 @app.route('/api/activities', methods=['GET'])
 def get_activities():
-    check_git_automation()
+    """
+    Default: current activities (Completed ones older than the archive cutoff
+    are left out), with an ETag so unchanged polls get a 304.
+    ?since=<version>: only rows changed after that version, plus the archive
+    cutoff, since rows also leave the listing by aging past it unchanged.
+    ?archived=1&limit=&offset=: page through archived Completed activities.
+    """
     try:
-        conn = get_db_connection()
-        activities = conn.execute('SELECT * FROM activities').fetchall()
-        conn.close()
-        return jsonify([dict(row) for row in activities])
+        cutoff = _archive_cutoff()
+
+        if request.args.get('archived'):
+            limit = min(request.args.get('limit', 50, type=int), 500)
+            offset = request.args.get('offset', 0, type=int)
+            with db.connection() as conn:
+                rows = conn.execute('''
+                    SELECT * FROM activities
+                    WHERE status = 'Completed' AND last_updated < ?
+                    ORDER BY last_updated DESC, id DESC
+                    LIMIT ? OFFSET ?
+                ''', (cutoff, limit, offset)).fetchall()
+            return jsonify([dict(row) for row in rows])
+
+        since = request.args.get('since', type=int)
+        if since is not None:
+            with db.connection() as conn:
+                version = db.table_version(conn, 'activities')
+                rows = conn.execute('''
+                    SELECT * FROM activities WHERE row_version > ? ORDER BY row_version
+                ''', (since,)).fetchall() if since < version else []
+            return jsonify({"version": version, "cutoff": cutoff, "activities": [dict(row) for row in rows]})
+
+        with db.connection() as conn:
+            version = db.table_version(conn, 'activities')
+            # The cutoff moves daily, so it is part of the validator too
+            etag = f"activities-{version}-{cutoff[:10]}"
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                # Spelled out per status so both branches use idx_activities_status_updated
+                rows = conn.execute('''
+                    SELECT * FROM activities
+                    WHERE status IN ('Pending', 'Active')
+                       OR (status = 'Completed' AND last_updated >= ?)
+                ''', (cutoff,)).fetchall()
+                response = jsonify([dict(row) for row in rows])
+
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Activities-Version'] = str(version)
+        return response
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
@@ -104,20 +240,77 @@ def add_activity():
         if not title:
             return jsonify({"status": "error", "message": "Title is required"}), 400
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO activities (title, description, status, last_updated)
-            VALUES (?, ?, ?, ?)
-        ''', (title, description, status, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        conn.commit()
-        new_id = cursor.lastrowid
-        conn.close()
+        with db.connection() as conn:
+            cursor = conn.execute('''
+                INSERT INTO activities (title, description, status, last_updated)
+                VALUES (?, ?, ?, ?)
+            ''', (title, description, status, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            new_id = cursor.lastrowid
+        publish_activities()
         
         return jsonify({"status": "success", "id": new_id}), 201
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+@app.route('/api/activities/bulk', methods=['POST'])
+def bulk_import_activities():
+    """
+    NDJSON body, one activity per line, inserted in one transaction.
+    Titles that already exist are skipped unless ?skip_existing=0.
+    """
+    skip_existing = request.args.get('skip_existing', '1') != '0'
+    try:
+        # Read the whole upload first so a slow client never holds the write lock
+        # (buffered: the raw WSGI stream's readline() goes byte by byte)
+        records = list(activities_io.parse_ndjson(io.BufferedReader(request.stream, 64 * 1024)))
+        with db.connection() as conn:
+            result = activities_io.import_activities(conn, records, skip_existing=skip_existing)
+    except activities_io.InvalidRecord as e:
+        return jsonify({"status": "error", "message": str(e), "line": e.line}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    if result["inserted"]:
+        publish_activities()
+    return jsonify({"status": "success", **result})
+
+@app.route('/api/activities/export', methods=['GET'])
+def export_activities():
+    """Streams every activity (optionally ?status=) as NDJSON, in id order."""
+    status = request.args.get('status')
+
+    def generate():
+        with db.connection() as conn:
+            yield from activities_io.export_activities(conn, status=status)
+
+    return Response(generate(), mimetype='application/x-ndjson', headers={
+        'Content-Disposition': 'attachment; filename="activities.ndjson"'
+    })
+
+@app.route('/api/activities/search', methods=['GET'])
+def search_activities():
+    """
+    ?q=: words matched against title and description, best match first.
+    ?status=, ?updated_after=<YYYY-MM-DD[ HH:MM:SS]>: filters; without q
+    the results are the newest matching activities. ?limit= caps at 500.
+    """
+    status = request.args.get('status')
+    if status and status not in activities_io.STATUSES:
+        return jsonify({"status": "error", "message": "Invalid status"}), 400
+    updated_after = request.args.get('updated_after')
+    if updated_after:
+        try:
+            updated_after = datetime.datetime.fromisoformat(updated_after).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            return jsonify({"status": "error", "message": "Invalid updated_after"}), 400
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    try:
+        with db.connection() as conn:
+            results = activities_search.search_activities(
+                conn, request.args.get('q'), status, updated_after, limit)
+        return jsonify(results)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
 @app.route('/api/activities/<int:id>/status', methods=['PATCH'])
 def update_activity_status(id):
     try:
@@ -126,62 +319,65 @@ def update_activity_status(id):
         if status not in ('Pending', 'Active', 'Completed'):
             return jsonify({"status": "error", "message": "Invalid status"}), 400
 
-        conn = get_db_connection()
-        conn.execute('''
-            UPDATE activities 
-            SET status = ?, last_updated = ?
-            WHERE id = ?
-        ''', (status, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), id))
-        conn.commit()
-        conn.close()
+        with db.connection() as conn:
+            conn.execute('''
+                UPDATE activities 
+                SET status = ?, last_updated = ?
+                WHERE id = ?
+            ''', (status, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'), id))
+        publish_activities()
         return jsonify({"status": "success"})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
-    # Uptime
-    uptime_seconds = time.time() - psutil.boot_time()
-    uptime_string = str(datetime.timedelta(seconds=int(uptime_seconds)))
-
-    # Network
-    net_io = psutil.net_io_counters(pernic=True)
-    # Check for common VPN/Tunnel interfaces
-    vpn_ifaces = ['tun0', 'wg0', 'wireguard']
-    vpn_stats = {}
-    for iface in vpn_ifaces:
-        if iface in net_io:
-            vpn_stats[iface] = {
-                "bytes_sent": net_io[iface].bytes_sent,
-                "bytes_recv": net_io[iface].bytes_recv
-            }
+    return jsonify(stats_sampler.latest())
+
+@app.route('/api/stats/history', methods=['GET'])
+def get_stats_history():
+    try:
+        window = float(request.args.get('window', 3600))
+        step = float(request.args.get('step', 60))
+        if window <= 0 or step <= 0:
+            raise ValueError
+    except ValueError:
+        return jsonify({"status": "error", "message": "window and step must be positive numbers of seconds"}), 400
 
     return jsonify({
-        "cpu": psutil.cpu_percent(interval=None),
-        "ram": psutil.virtual_memory().percent,
-        "disk": psutil.disk_usage('/').percent,
-        "uptime": uptime_string,
-        "vpn": vpn_stats
+        "window": window,
+        "step": max(step, stats_sampler.interval),
+        "fields": stats_sampler.fields,
+        "points": stats_sampler.series(window, step)
     })
 
-@app.route('/api/bmo-says', methods=['GET'])
-def bmo_says():
-    # Logic based on uptime and active tasks
-    uptime_hours = (time.time() - psutil.boot_time()) / 3600
-    
-    conn = get_db_connection()
-    active_count = conn.execute('SELECT COUNT(*) FROM activities WHERE status = "Active"').fetchone()[0]
-    conn.close()
-
-    # Try Gemini if key exists
-    if os.environ.get('GEMINI_API_KEY'):
-        prompt = f"You are BMO from Adventure Time, a helpful robot assistant. The system uptime is {int(uptime_hours)} hours. There are {active_count} active tasks. Generate a very short (max 1 sentence), cute, encouraging message for your user 'Vítku'."
-        try:
-            message = gemini_service.call_gemini(prompt)
-            return jsonify({"message": message})
-        except Exception as e:
-            print(f"Gemini fallback: {e}")
-
+@app.route('/api/processes', methods=['GET'])
+def get_processes():
+    """
+    Top processes by CPU and by RSS from the latest sample, the recent
+    history of each, and what the sample cost. ?limit= shortens both lists;
+    ?history=0 leaves the history out.
+    """
+    data = process_sampler.latest()
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        data = dict(data, top_cpu=data['top_cpu'][:max(limit, 0)], top_rss=data['top_rss'][:max(limit, 0)])
+    if request.args.get('history') == '0':
+        data = dict(data, history={})
+    elif limit is not None:
+        listed = {str(row['pid']) for row in data['top_cpu'] + data['top_rss']}
+        data = dict(data, history={pid: h for pid, h in data['history'].items() if pid in listed})
+    return jsonify(data)
+
+def _active_count():
+    with db.connection() as conn:
+        # Single-quoted: "Active" would be looked up as a column first
+        return conn.execute("SELECT COUNT(*) FROM activities WHERE status = 'Active'").fetchone()[0]
+
+def _bmo_prompt(uptime_hours, active_count):
+    return f"You are BMO from Adventure Time, a helpful robot assistant. The system uptime is {int(uptime_hours)} hours. There are {active_count} active tasks. Generate a very short (max 1 sentence), cute, encouraging message for your user 'Vítku'."
+
+def _canned_bmo_message(uptime_hours, active_count):
     messages = [
         "Vítku, system is running smoothly. Phase 3: Intelligence is here! 🤖✨",
         "BMO is observing your progress. Keep going!",
@@ -197,75 +393,77 @@ def bmo_says():
     if uptime_hours > 24:
         messages.append(f"Server has been running for {int(uptime_hours)} hours. Rock solid! 💪")
 
+    return random.choice(messages)
+
+@app.route('/api/bmo-says', methods=['GET'])
+def bmo_says():
+    # Imported on first use: requests and the model clients are most of the import time
+    import gemini_service
+    # Logic based on uptime and active tasks
+    uptime_hours = stats_sampler.uptime_seconds() / 3600
+    active_count = _active_count()
+
+    # Local Ollama or Gemini, whichever the router expects to answer best
+    if gemini_service.router.available():
+        try:
+            message = gemini_service.call_model(_bmo_prompt(uptime_hours, active_count))
+            return jsonify({"message": message})
+        except Exception as e:
+            print(f"Gemini fallback: {e}")
+
     return jsonify({
-        "message": random.choice(messages)
+        "message": _canned_bmo_message(uptime_hours, active_count)
     })
 
-@app.route('/api/calendar', methods=['GET'])
-def get_calendar():
+def _bmo_says_events(pieces, uptime_hours, active_count):
+    """
+    Wraps streamed message pieces as 'chunk' events and ends with a 'done'
+    event carrying the whole message. Falls back to the canned message if
+    nothing came through.
+    """
+    received = []
     try:
-        with open(AUTH_PATH, 'r') as f:
-            auth = json.load(f)
-        
-        username = auth.get('email')
-        password = auth.get('password')
-        url = "https://caldav.icloud.com"
-
-        client = caldav.DAVClient(url, username=username, password=password)
-        principal = client.principal()
-        calendars = principal.calendars()
-        
-        if not calendars:
-            return jsonify([])
-
-        now = datetime.datetime.now()
-        end = now + datetime.timedelta(days=7)
-        
-        all_events = []
-        for calendar in calendars:
-            cal_name = calendar.name
-            events = calendar.date_search(start=now, end=end, expand=True)
-            for event in events:
-                vobj = event.vobject_instance.vevent
-                
-                summary = vobj.summary.value if hasattr(vobj, 'summary') else 'No Title'
-                
-                # Handle start time
-                start_dt = vobj.dtstart.value
-                is_all_day = not isinstance(start_dt, datetime.datetime)
-                
-                if isinstance(start_dt, datetime.datetime):
-                    # Localize if it's naive (iCloud usually sends TZ aware, but just in case)
-                    start_time = start_dt.strftime('%H:%M')
-                    sort_key = start_dt.timestamp()
-                else:
-                    # Date object (all day)
-                    start_time = "Celý den"
-                    # Sort all day events at the beginning of the day
-                    sort_key = datetime.datetime.combine(start_dt, datetime.time.min).timestamp()
-
-                all_events.append({
-                    "title": summary,
-                    "time": start_time,
-                    "allDay": is_all_day,
-                    "calendar": cal_name,
-                    "sort_key": sort_key
-                })
-
-        # Sort by time and take top 10 (Frontend will slice to 3-4)
-        all_events.sort(key=lambda x: x['sort_key'])
-        
-        # Remove duplicates
-        seen = set()
-        unique_events = []
-        for e in all_events:
-            identifier = f"{e['title']}-{e['time']}"
-            if identifier not in seen:
-                seen.add(identifier)
-                unique_events.append(e)
+        for text in pieces:
+            received.append(text)
+            yield format_sse('chunk', {"text": text})
+    except Exception as e:
+        print(f"Gemini fallback: {e}")
+    if not received:
+        received.append(_canned_bmo_message(uptime_hours, active_count))
+        yield format_sse('chunk', {"text": received[0]})
+    yield format_sse('done', {"message": ''.join(received)})
+
+@app.route('/api/bmo-says/stream', methods=['GET'])
+def bmo_says_stream():
+    """/api/bmo-says as server-sent events, so the message can be shown as Gemini writes it."""
+    import gemini_service
+    uptime_hours = stats_sampler.uptime_seconds() / 3600
+    active_count = _active_count()
+    pieces = ()
+    if gemini_service.router.available():
+        pieces = gemini_service.stream_model(_bmo_prompt(uptime_hours, active_count))
+    return Response(_bmo_says_events(pieces, uptime_hours, active_count),
+                    mimetype='text/event-stream', headers=STREAM_HEADERS)
+
+@app.route('/api/gemini/stats', methods=['GET'])
+def get_gemini_stats():
+    import gemini_service
+    return jsonify({
+        "cache": gemini_service.cache_stats(),
+        "circuit": gemini_service.breaker.stats(),
+        "router": gemini_service.router.stats()
+    })
 
-        return jsonify(unique_events[:10])
+def _calendar_headers():
+    """X-Calendar-Error while the events are missing or stale because a sync failed."""
+    error = calendar_cache.error()
+    # Header values are latin-1
+    return {'X-Calendar-Error': error.encode('latin-1', 'replace').decode('latin-1')} if error else {}
 
+@app.route('/api/calendar', methods=['GET'])
+def get_calendar():
+    try:
+        return jsonify(calendar_cache.get_events()), _calendar_headers()
     except Exception as e:
         print(f"Calendar error: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -273,71 +471,54 @@ def get_calendar():
 @app.route('/api/schedule', methods=['GET'])
 def get_schedule():
     try:
-        # Get cron jobs from OpenClaw
-        output = subprocess.check_output(
-            ['openclaw', 'cron', 'list', '--json'],
-            stderr=subprocess.STDOUT
-        ).decode('utf-8')
-        
-        data = json.loads(output)
-        jobs = data.get('jobs', [])
-        
-        schedule = []
-        now_ms = time.time() * 1000
-        
-        for job in jobs:
-            next_run_ms = job.get('state', {}).get('nextRunAtMs')
-            if not next_run_ms:
-                continue
-            
-            # Calculate relative time or format absolute time
-            diff_ms = next_run_ms - now_ms
-            
-            if diff_ms < 0:
-                time_str = "soon"
-            elif diff_ms < 3600000: # < 1h
-                time_str = f"in {int(diff_ms / 60000)}m"
-            elif diff_ms < 86400000: # < 24h
-                time_str = f"in {int(diff_ms / 3600000)}h"
-            else:
-                dt = datetime.datetime.fromtimestamp(next_run_ms / 1000)
-                time_str = dt.strftime('%a %H:%M')
-
-            schedule.append({
-                "name": job.get('name', 'Unnamed Job'),
-                "time": time_str,
-                "status": "Enabled" if job.get('enabled') else "Disabled",
-                "next_run_ms": next_run_ms
-            })
-        
-        # Sort by next run
-        schedule.sort(key=lambda x: x['next_run_ms'])
-        
-        return jsonify(schedule)
+        return jsonify(schedule_cache.get())
     except Exception as e:
         print(f"Schedule error: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def _publish_token_usage(batch):
+    """Pushes per-model token deltas from a flushed writer batch."""
+    if not bus.subscriber_count():
+        return
+    models = {}
+    for record in batch:
+        model = models.setdefault(record[1], {"tokens": 0, "calls": 0})
+        model["tokens"] += record[4]
+        model["calls"] += record[5]
+    bus.publish('token-usage', {"models": models})
+
+if ROLE != 'worker':
+    # Workers get these from the snapshot, covering every worker's calls
+    token_monitor.writer.add_listener(_publish_token_usage)
+
+def _month_tokens(conn, month):
+    row = conn.execute('''
+        SELECT SUM(total_tokens) as tokens
+        FROM token_usage_monthly
+        WHERE month = ?
+    ''', (month,)).fetchone()
+    return row['tokens'] or 0
+
 @app.route('/api/token-usage/daily', methods=['GET'])
 def get_token_usage_daily():
     try:
-        conn = get_db_connection()
         # Last 7 days
+        today = datetime.datetime.now()
+        days = [(today - datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(6, -1, -1)]
         query = '''
-            SELECT date(timestamp) as date, SUM(total_tokens) as tokens
-            FROM token_usage
-            WHERE timestamp >= date('now', '-6 days')
-            GROUP BY date(timestamp)
-            ORDER BY date(timestamp)
+            SELECT day as date, SUM(total_tokens) as tokens
+            FROM token_usage_daily
+            WHERE day >= ?
+            GROUP BY day
+            ORDER BY day
         '''
-        rows = conn.execute(query).fetchall()
-        conn.close()
+        with db.connection() as conn:
+            rows = conn.execute(query, (days[0],)).fetchall()
         
         # Fill in missing dates
         data = {row['date']: row['tokens'] for row in rows}
         result = []
-        for i in range(6, -1, -1):
-            d = (datetime.datetime.now() - datetime.timedelta(days=i)).strftime('%Y-%m-%d')
+        for d in days:
             result.append({
                 "date": d,
                 "tokens": data.get(d, 0)
@@ -350,72 +531,91 @@ def get_token_usage_daily():
 @app.route('/api/token-usage/monthly', methods=['GET'])
 def get_token_usage_monthly():
     try:
-        conn = get_db_connection()
         # Current month
-        query = '''
-            SELECT SUM(total_tokens) as tokens
-            FROM token_usage
-            WHERE strftime('%Y-%m', timestamp) = strftime('%Y-%m', 'now')
-        '''
-        row = conn.execute(query).fetchone()
-        conn.close()
-        return jsonify({"month": datetime.datetime.now().strftime('%Y-%m'), "tokens": row['tokens'] or 0})
+        month = datetime.datetime.now().strftime('%Y-%m')
+        with db.connection() as conn:
+            tokens = _month_tokens(conn, month)
+        return jsonify({"month": month, "tokens": tokens})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/api/token-usage/models', methods=['GET'])
 def get_token_usage_models():
     try:
-        conn = get_db_connection()
         query = '''
             SELECT model_name, SUM(total_tokens) as tokens
-            FROM token_usage
+            FROM token_usage_monthly
             GROUP BY model_name
             ORDER BY tokens DESC
         '''
-        rows = conn.execute(query).fetchall()
-        conn.close()
+        with db.connection() as conn:
+            rows = conn.execute(query).fetchall()
         return jsonify([dict(row) for row in rows])
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/api/token-usage/status', methods=['GET'])
 def get_token_usage_status():
+    """Monthly budget status from the in-memory counters, plus every window and model."""
+    budget = token_monitor.budget.status()
+    month = budget["windows"]["month"]
+    used, limit = month["used"], month["limit"]
+
+    status = "OK"
+    if limit and used > limit:
+        status = "Limit Exceeded"
+    elif limit and used > limit * token_monitor.WARN_RATIO:
+        status = "Approaching Limit"
+
+    return jsonify({
+        "status": status,
+        "used": used,
+        "limit": limit,
+        "percentage": round((used / limit) * 100, 2) if limit else 0,
+        "windows": budget["windows"],
+        "models": budget["models"]
+    })
+
+def _initial_stream_events():
+    initial = []
+    stats = bus.last('stats')
+    if stats:
+        initial.append(('stats', stats))
     try:
-        limit = 1000000 # Configurable limit
-        conn = get_db_connection()
-        query = '''
-            SELECT SUM(total_tokens) as tokens
-            FROM token_usage
-            WHERE strftime('%Y-%m', timestamp) = strftime('%Y-%m', 'now')
-        '''
-        row = conn.execute(query).fetchone()
-        conn.close()
-        
-        used = row['tokens'] or 0
-        status = "OK"
-        if used > limit:
-            status = "Limit Exceeded"
-        elif used > limit * 0.8:
-            status = "Approaching Limit"
-            
-        return jsonify({
-            "status": status,
-            "used": used,
-            "limit": limit,
-            "percentage": round((used / limit) * 100, 2)
-        })
+        initial.append(('activities', {"version": _activities_version()}))
     except Exception as e:
-        return jsonify({"status": "error", "message": str(e)}), 500
+        print(f"Activity publish error: {e}")
+    if schedule_cache.age() is not None:
+        initial.append(('schedule', schedule_cache.get()))
+    return initial
+
+STREAM_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+}
+
+@app.route('/api/stream', methods=['GET'])
+def stream():
+    """Server-sent events: stats, activities, schedule and token-usage updates."""
+    return Response(bus.stream(_initial_stream_events()), mimetype='text/event-stream',
+                    headers=STREAM_HEADERS)
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Latency histograms: Prometheus text by default, ?format=json for the dashboard panel."""
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.snapshot())
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 # Serve Frontend
+static_index = static_assets.StaticIndex(app.static_folder)
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    if path != "" and os.path.exists(os.path.join(app.static_folder, path)):
-        return send_from_directory(app.static_folder, path)
-    else:
-        return send_from_directory(app.static_folder, 'index.html')
+    return static_index.response(path, request)
+
+metrics.record_startup('import', time.perf_counter() - _import_started)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5001)
+    create_app().run(host='0.0.0.0', port=5001)
@@ -0,0 +1,176 @@
+"""
+ASGI entry point: the same routes as app.py, on an asyncio server.
+
+Endpoints that wait on slow I/O (Gemini, CalDAV, the event stream) are
+native async handlers here; everything else is the Flask app mounted
+through a WSGI adapter. The git watcher and schedule refresh run as
+asyncio tasks instead of threads.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5001
+"""
+import sys
+import time
+import asyncio
+import contextlib
+import functools
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from a2wsgi import WSGIMiddleware
+import app as flask_app
+import metrics
+import shared_state
+from event_bus import bus, format_sse
+
+
+def timed(route):
+    """Records handler latency like app.py's after_request hook does for Flask routes."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(request):
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+                return response
+            finally:
+                metrics.observe_request(route, request.method, status, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def _error(e, status=500):
+    return JSONResponse({"status": "error", "message": str(e)}, status_code=status)
+
+
+@timed('/api/bmo-says')
+async def bmo_says(request):
+    import gemini_service
+    loop = asyncio.get_running_loop()
+    uptime_hours = flask_app.stats_sampler.uptime_seconds() / 3600
+    active_count = await loop.run_in_executor(None, flask_app._active_count)
+
+    if gemini_service.router.available():
+        try:
+            message = await gemini_service.call_model_async(
+                flask_app._bmo_prompt(uptime_hours, active_count))
+            return JSONResponse({"message": message})
+        except Exception as e:
+            print(f"Gemini fallback: {e}")
+
+    return JSONResponse({"message": flask_app._canned_bmo_message(uptime_hours, active_count)})
+
+
+async def _bmo_says_events(pieces, uptime_hours, active_count):
+    """app._bmo_says_events for an async iterator of pieces."""
+    received = []
+    try:
+        async for text in pieces:
+            received.append(text)
+            yield format_sse('chunk', {"text": text})
+    except Exception as e:
+        print(f"Gemini fallback: {e}")
+    if not received:
+        received.append(flask_app._canned_bmo_message(uptime_hours, active_count))
+        yield format_sse('chunk', {"text": received[0]})
+    yield format_sse('done', {"message": ''.join(received)})
+
+
+async def _no_pieces():
+    return
+    yield
+
+
+@timed('/api/bmo-says/stream')
+async def bmo_says_stream(request):
+    import gemini_service
+    loop = asyncio.get_running_loop()
+    uptime_hours = flask_app.stats_sampler.uptime_seconds() / 3600
+    active_count = await loop.run_in_executor(None, flask_app._active_count)
+    pieces = _no_pieces()
+    if gemini_service.router.available():
+        pieces = gemini_service.stream_model_async(flask_app._bmo_prompt(uptime_hours, active_count))
+    return StreamingResponse(_bmo_says_events(pieces, uptime_hours, active_count),
+                             media_type='text/event-stream', headers=flask_app.STREAM_HEADERS)
+
+
+@timed('/api/calendar')
+async def get_calendar(request):
+    loop = asyncio.get_running_loop()
+    try:
+        events = await loop.run_in_executor(None, flask_app.calendar_cache.get_events)
+        return JSONResponse(events, headers=flask_app._calendar_headers())
+    except Exception as e:
+        print(f"Calendar error: {e}")
+        return _error(e)
+
+
+@timed('/api/stream')
+async def stream(request):
+    loop = asyncio.get_running_loop()
+    initial = await loop.run_in_executor(None, flask_app._initial_stream_events)
+    return StreamingResponse(bus.stream_async(initial), media_type='text/event-stream',
+                             headers=flask_app.STREAM_HEADERS)
+
+
+async def snapshot_unavailable(request, exc):
+    return _error(exc, status=503)
+
+
+async def _close_model_clients():
+    # Only loaded if a request needed it
+    gemini_service = sys.modules.get('gemini_service')
+    if gemini_service is not None:
+        await gemini_service.close_async_clients()
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_):
+    loop = asyncio.get_running_loop()
+    if flask_app.ROLE == 'worker':
+        # The collector process runs the background jobs
+        await loop.run_in_executor(None, flask_app.create_app)
+        yield
+        await _close_model_clients()
+        return
+    # The git watcher and schedule refresh run on the event loop rather than as threads
+    await loop.run_in_executor(None, functools.partial(flask_app.create_app, start_loops=False))
+    # If a WSGI request got to create_app() first, the threaded loops are running; stop them
+    await loop.run_in_executor(None, flask_app.schedule_cache.stop)
+    await loop.run_in_executor(None, flask_app.git_watcher.stop)
+    tasks = [
+        asyncio.create_task(flask_app.schedule_cache.run_async(), name='schedule-refresh'),
+        asyncio.create_task(flask_app.git_watcher.run_async(), name='git-watcher'),
+    ]
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await _close_model_clients()
+
+
+app = Starlette(
+    routes=[
+        Route('/api/bmo-says', bmo_says, methods=['GET']),
+        Route('/api/bmo-says/stream', bmo_says_stream, methods=['GET']),
+        Route('/api/calendar', get_calendar, methods=['GET']),
+        Route('/api/stream', stream, methods=['GET']),
+        # Everything else, including the built frontend, is still served by Flask
+        Mount('/', app=WSGIMiddleware(flask_app.app)),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'],
+                   expose_headers=['ETag', 'X-Activities-Version', 'X-Calendar-Error']),
+    ],
+    exception_handlers={shared_state.SnapshotUnavailable: snapshot_unavailable},
+    lifespan=lifespan,
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5001)
@@ -0,0 +1,260 @@
+"""
+Local stand-ins for everything the dashboard talks to outside the process:
+the Gemini HTTP API, the openclaw and git CLIs, and the CalDAV server.
+Each one answers with fixed, plausible data after an optional delay.
+"""
+import os
+import sys
+import json
+import time
+import stat
+import datetime
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_HEAD_SHA = 'f' * 40
+
+
+class FakeGemini:
+    """
+    generateContent and streamGenerateContent endpoints on 127.0.0.1; use
+    `base_url` as GEMINI_API_BASE. A streamed answer is sent as one SSE
+    event per word, `chunk_delay` seconds apart, after `latency`.
+    """
+
+    TEXT = "BMO says hi from the benchmark!"
+    USAGE = {"promptTokenCount": 48, "candidatesTokenCount": 12, "totalTokenCount": 60}
+
+    def __init__(self, latency=0.05, chunk_delay=0.05):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+        self._server = None
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                fake.calls += 1
+                time.sleep(fake.latency)
+                if ':streamGenerateContent' in self.path:
+                    self._stream()
+                    return
+                body = json.dumps({
+                    "candidates": [{"content": {"parts": [{"text": fake.TEXT}]}}],
+                    "usageMetadata": fake.USAGE
+                }).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _stream(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                words = fake.TEXT.split(' ')
+                for i, word in enumerate(words):
+                    if i:
+                        time.sleep(fake.chunk_delay)
+                    last = i == len(words) - 1
+                    chunk = {"candidates": [{"content": {"parts": [{"text": word + ('' if last else ' ')}]}}]}
+                    if last:
+                        chunk["usageMetadata"] = fake.USAGE
+                    try:
+                        self.wfile.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode())
+                        self.wfile.flush()
+                    except (BrokenPipeError, ConnectionResetError):
+                        break  # the client stopped reading
+                self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='fake-gemini', daemon=True).start()
+        return self
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+class FakeOllama:
+    """
+    Ollama's /api/generate on 127.0.0.1; use `base_url` as BMO_OLLAMA_URL.
+    Streams one NDJSON object per word, `chunk_delay` seconds apart.
+    """
+
+    TEXT = "BMO runs locally today!"
+
+    def __init__(self, latency=0.02, chunk_delay=0.02):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+        self._server = None
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                fake.calls += 1
+                time.sleep(fake.latency)
+                final = {"model": request["model"], "done": True, "prompt_eval_count": 40, "eval_count": 9}
+                if not request.get("stream", True):
+                    body = json.dumps(dict(final, response=fake.TEXT)).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+                words = fake.TEXT.split(' ')
+                try:
+                    for i, word in enumerate(words):
+                        if i:
+                            time.sleep(fake.chunk_delay)
+                        chunk = {"model": request["model"], "response": word + ' ', "done": False}
+                        self.wfile.write(json.dumps(chunk).encode() + b'\n')
+                        self.wfile.flush()
+                    self.wfile.write(json.dumps(dict(final, response='')).encode() + b'\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='fake-ollama', daemon=True).start()
+        return self
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def _write_script(path, source):
+    with open(path, 'w') as f:
+        f.write(f"#!{sys.executable}\n{source}")
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+def write_fake_openclaw(directory, jobs=8, latency=0.05):
+    """Script printing `openclaw cron list --json` output; returns its path."""
+    return _write_script(os.path.join(directory, 'openclaw'), f'''
+import json, time
+time.sleep({latency!r})
+now = int(time.time() * 1000)
+print(json.dumps({{"jobs": [
+    {{"name": f"job-{{i}}", "enabled": i % 3 != 0, "state": {{"nextRunAtMs": now + i * 900000}}}}
+    for i in range(1, {jobs} + 1)
+]}}))
+''')
+
+
+def write_fake_git(bin_dir, commits=10, latency=0.01):
+    """`git` executable answering `git log` with canned messages, NUL-separated."""
+    return _write_script(os.path.join(bin_dir, 'git'), f'''
+import sys, time
+time.sleep({latency!r})
+if 'log' in sys.argv:
+    sys.stdout.write(''.join(f"Benchmark commit {{i}} #complete {{i}}\\n\\x00" for i in range(1, {commits} + 1)))
+''')
+
+
+def make_fake_repo(directory):
+    """Minimal .git layout that GitWatcher.resolve_head() can read without git."""
+    heads = os.path.join(directory, '.git', 'refs', 'heads')
+    os.makedirs(heads, exist_ok=True)
+    with open(os.path.join(directory, '.git', 'HEAD'), 'w') as f:
+        f.write('ref: refs/heads/main\n')
+    with open(os.path.join(heads, 'main'), 'w') as f:
+        f.write(FAKE_HEAD_SHA + '\n')
+    return directory
+
+
+class _FakeCalendar:
+    """
+    One calendar. Tests can change `ctag` (or set `sync_token` and clear
+    `ctag`), set `error` to make fetches fail, or clear `gate` to hold
+    fetches until it is set again. `fetches` counts date_search calls.
+    """
+
+    def __init__(self, index, events, latency):
+        self.url = f"https://caldav.invalid/calendars/{index}/"
+        self.name = f"Calendar {index}"
+        self.events = events
+        self.ctag = "ctag-1"
+        self.sync_token = None
+        self.error = None
+        self.fetches = 0
+        self.gate = threading.Event()
+        self.gate.set()
+        self._latency = latency
+
+    def get_properties(self, props):
+        time.sleep(self._latency)
+        result = {}
+        if self.ctag is not None:
+            result["{http://calendarserver.org/ns/}getctag"] = self.ctag
+        if self.sync_token is not None:
+            result["{DAV:}sync-token"] = self.sync_token
+        return result
+
+    def date_search(self, start, end, expand=True):
+        self.fetches += 1
+        self.gate.wait()
+        time.sleep(self._latency)
+        if self.error:
+            raise self.error
+        results = []
+        for k in range(self.events):
+            begin = start + datetime.timedelta(hours=6 * k + 1)
+            if begin >= end:
+                break
+            vevent = SimpleNamespace(
+                summary=SimpleNamespace(value=f"{self.name} event {k}"),
+                dtstart=SimpleNamespace(value=begin),
+                dtend=SimpleNamespace(value=begin + datetime.timedelta(hours=1))
+            )
+            results.append(SimpleNamespace(vobject_instance=SimpleNamespace(vevent=vevent)))
+        return results
+
+
+class FakeDAVClient:
+    """Drop-in for caldav.DAVClient as a CalendarCache client_factory."""
+
+    def __init__(self, calendars=3, events=20, latency=0.02):
+        self.calendars = [_FakeCalendar(i, events, latency) for i in range(calendars)]
+
+    def principal(self):
+        return SimpleNamespace(calendars=lambda: list(self.calendars))
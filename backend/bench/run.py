@@ -0,0 +1,473 @@
+"""
+Benchmark and load test for the dashboard API.
+
+    cd backend
+    python -m bench.run [--scales 1k,100k,10m] [--modes client,server,asgi]
+                        [--clients 8] [--requests 200] [--output report.json]
+                        [--baseline old-report.json --threshold 1.5]
+
+For every scale a seeded database is built once (cached in --data-dir) and
+copied for the run. The app is then imported in a fresh subprocess, with
+git, openclaw, CalDAV and Gemini replaced by the fakes in bench/fakes.py.
+Every route gets hit by concurrent clients through:
+
+    client  Flask's test client (handler cost only, no sockets)
+    server  the threaded Werkzeug server that start_server.sh runs
+    asgi    asgi.py under uvicorn (needs requirements-asgi.txt)
+
+The JSON report has throughput and p50/p90/p99 per route, plus the
+dependency timings from metrics.py. With --baseline, any route whose p99
+grew by more than --threshold (or whose throughput fell by as much) is
+listed as a regression and the exit code is 1.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import random
+import platform
+import argparse
+import tempfile
+import threading
+import subprocess
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from bench import fakes
+from bench.seed import SEED_VERSION, parse_scale
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+# Stream requests hold a server thread until the next keep-alive, so fewer of them
+STREAM_REQUESTS = 20
+# Ignore p99 changes smaller than this when comparing against a baseline
+MIN_REGRESSION_MS = 2.0
+
+
+class Route:
+    def __init__(self, name, method, path, body=None, headers=None, stream=False):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+        self.headers = headers
+        self.stream = stream
+
+    def resolve(self, ctx, rng):
+        path = self.path(ctx, rng) if callable(self.path) else self.path
+        body = self.body(ctx, rng) if callable(self.body) else self.body
+        headers = self.headers(ctx, rng) if callable(self.headers) else self.headers
+        return path, body, headers
+
+
+ROUTES = [
+    Route('activities', 'GET', '/api/activities'),
+    Route('activities_not_modified', 'GET', '/api/activities',
+          headers=lambda ctx, rng: {'If-None-Match': ctx['etag']}),
+    Route('activities_delta', 'GET', lambda ctx, rng: f"/api/activities?since={max(ctx['version'] - 50, 0)}"),
+    Route('activities_archived', 'GET',
+          lambda ctx, rng: f"/api/activities?archived=1&limit=50&offset={rng.randrange(0, 1000, 50)}"),
+    Route('activities_search', 'GET',
+          lambda ctx, rng: f"/api/activities/search?q=task+{rng.randint(1, 999)}&limit=20"),
+    Route('activities_filter', 'GET', '/api/activities/search?status=Active&limit=50'),
+    Route('tasks', 'GET', '/api/tasks'),
+    Route('activity_create', 'POST', '/api/activities',
+          body=lambda ctx, rng: {"title": f"Bench {rng.random():.6f}", "description": "load test"}),
+    Route('activity_status', 'PATCH',
+          lambda ctx, rng: f"/api/activities/{rng.randint(1, ctx['rows'])}/status",
+          body=lambda ctx, rng: {"status": rng.choice(['Pending', 'Active', 'Completed'])}),
+    Route('activities_bulk', 'POST', '/api/activities/bulk',
+          body=lambda ctx, rng: ''.join(
+              json.dumps({"title": f"Bulk {rng.random():.9f}"}) + '\n' for _ in range(100)).encode()),
+    Route('activities_export', 'GET', '/api/activities/export'),
+    Route('stats', 'GET', '/api/stats'),
+    Route('stats_history', 'GET', '/api/stats/history?window=3600&step=60'),
+    Route('processes', 'GET', '/api/processes'),
+    Route('bmo_says', 'GET', '/api/bmo-says'),
+    Route('bmo_says_stream_first_chunk', 'GET', '/api/bmo-says/stream', stream=True),
+    Route('gemini_stats', 'GET', '/api/gemini/stats'),
+    Route('calendar', 'GET', '/api/calendar'),
+    Route('schedule', 'GET', '/api/schedule'),
+    Route('token_usage_daily', 'GET', '/api/token-usage/daily'),
+    Route('token_usage_monthly', 'GET', '/api/token-usage/monthly'),
+    Route('token_usage_models', 'GET', '/api/token-usage/models'),
+    Route('token_usage_status', 'GET', '/api/token-usage/status'),
+    Route('metrics', 'GET', '/api/metrics'),
+    Route('metrics_json', 'GET', '/api/metrics?format=json'),
+    Route('stream_first_event', 'GET', '/api/stream', stream=True),
+    Route('frontend', 'GET', '/'),
+]
+
+
+# --- transports ----------------------------------------------------------
+
+def _body_kwargs(body):
+    """Raw bytes (NDJSON uploads) go as the body, anything else as JSON."""
+    if isinstance(body, bytes):
+        return {"data": body}
+    return {"json": body}
+
+
+class TestClientTransport:
+    """Flask test client, one per thread."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self._local = threading.local()
+
+    def request(self, method, path, body, headers, stream):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.flask_app.test_client()
+        response = client.open(path, method=method, headers=headers, buffered=not stream,
+                               **_body_kwargs(body))
+        if stream:
+            next(iter(response.response))
+        status = response.status_code
+        response.close()
+        return status
+
+
+class HTTPTransport:
+    """Real sockets through a requests.Session per thread."""
+
+    def __init__(self, base_url):
+        import requests
+        self._requests = requests
+        self.base_url = base_url
+        self._local = threading.local()
+
+    def request(self, method, path, body, headers, stream):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.request(method, self.base_url + path, headers=headers,
+                                   stream=stream, timeout=30, **_body_kwargs(body))
+        if stream:
+            next(response.iter_content(64))
+        status = response.status_code
+        response.close()
+        return status
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _start_werkzeug(flask_app):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-werkzeug', daemon=True).start()
+    return HTTPTransport(f"http://127.0.0.1:{server.server_port}"), server.shutdown
+
+
+def _start_uvicorn():
+    import uvicorn
+    import asgi
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(asgi.app, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, name='bench-uvicorn', daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn failed to start")
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join(timeout=10)
+    return HTTPTransport(f"http://127.0.0.1:{port}"), stop
+
+
+# --- measurement ---------------------------------------------------------
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(int(round(q * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def _summarize(latencies, statuses, errors, wall):
+    latencies.sort()
+    ms = lambda v: None if v is None else round(v * 1000, 3)
+    codes = {}
+    for status in statuses:
+        codes[str(status)] = codes.get(str(status), 0) + 1
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "status_codes": codes,
+        "throughput_rps": round(len(latencies) / wall, 1) if wall else None,
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(_percentile(latencies, 0.50)),
+        "p90_ms": ms(_percentile(latencies, 0.90)),
+        "p99_ms": ms(_percentile(latencies, 0.99)),
+        "max_ms": ms(latencies[-1]) if latencies else None,
+    }
+
+
+def bench_route(transport, route, ctx, clients, count, warmup, seed):
+    rng = random.Random(seed)
+    calls = [route.resolve(ctx, rng) for _ in range(warmup + count)]
+    latencies, statuses = [], []
+    errors = 0
+
+    def one(call):
+        path, body, headers = call
+        started = time.perf_counter()
+        try:
+            status = transport.request(route.method, path, body, headers, route.stream)
+        except Exception:
+            status = None
+        elapsed = time.perf_counter() - started
+        return status, elapsed
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(one, calls[:warmup]))
+        wall_start = time.perf_counter()
+        for status, elapsed in pool.map(one, calls[warmup:]):
+            latencies.append(elapsed)
+            statuses.append(status)
+            if status is None or status >= 500:
+                errors += 1
+        wall = time.perf_counter() - wall_start
+    return _summarize(latencies, statuses, errors, wall)
+
+
+def _context(flask_app, rows):
+    client = flask_app.test_client()
+    response = client.get('/api/activities')
+    return {
+        "rows": rows,
+        "etag": response.headers.get('ETag', ''),
+        "version": int(response.headers.get('X-Activities-Version', 0)),
+    }
+
+
+def run_worker(args):
+    """Runs inside the per-scale subprocess; environment already points at the fakes."""
+    gemini = fakes.FakeGemini(latency=args.gemini_latency).start()
+    os.environ['GEMINI_API_BASE'] = gemini.base_url
+
+    import app as app_module
+    import metrics
+    app_module.calendar_cache.client_factory = lambda: fakes.FakeDAVClient(latency=args.caldav_latency)
+    app_module.create_app()
+
+    routes = [r for r in ROUTES if not args.routes or r.name in args.routes]
+    result = {"modes": {}}
+    for mode in args.modes:
+        if mode == 'client':
+            transport, stop = TestClientTransport(app_module.app), None
+        elif mode == 'server':
+            transport, stop = _start_werkzeug(app_module.app)
+        elif mode == 'asgi':
+            transport, stop = _start_uvicorn()
+        else:
+            raise ValueError(f"unknown mode {mode}")
+
+        metrics.registry.reset()
+        ctx = _context(app_module.app, args.rows)
+        routes_result = {}
+        try:
+            for route in routes:
+                count = min(args.requests, STREAM_REQUESTS) if route.stream else args.requests
+                routes_result[route.name] = bench_route(
+                    transport, route, ctx, args.clients, count, args.warmup, seed=len(routes_result))
+                print(f"  [{mode}] {route.name}: {routes_result[route.name]['p99_ms']} ms p99",
+                      file=sys.stderr)
+        finally:
+            if stop:
+                stop()
+        result["modes"][mode] = {
+            "routes": routes_result,
+            "dependencies": metrics.snapshot()["dependencies"],
+        }
+    result["fake_gemini_calls"] = gemini.calls
+    gemini.stop()
+
+    with open(args.result, 'w') as f:
+        json.dump(result, f)
+    # Background threads (sampler, writer, watcher) are daemons; skip their shutdown
+    sys.stdout.flush()
+    os._exit(0)
+
+
+# --- orchestration -------------------------------------------------------
+
+def _ensure_seed(data_dir, scale, rows, reseed):
+    path = os.path.join(data_dir, f"seed-{scale}-v{SEED_VERSION}.db")
+    seed_seconds = None
+    if reseed or not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'bench.seed', '--scale', str(rows), '--out', path],
+                       cwd=BACKEND_DIR, check=True)
+        seed_seconds = round(time.perf_counter() - started, 2)
+    return path, seed_seconds
+
+
+def _fake_environment(workdir, args):
+    bin_dir = os.path.join(workdir, 'bin')
+    os.makedirs(bin_dir)
+    fakes.write_fake_git(bin_dir)
+    openclaw = fakes.write_fake_openclaw(bin_dir, latency=args.cli_latency)
+    repo = fakes.make_fake_repo(os.path.join(workdir, 'repo'))
+    env = dict(os.environ)
+    env.update({
+        'PATH': bin_dir + os.pathsep + env.get('PATH', ''),
+        'BMO_DB_PATH': os.path.join(workdir, 'bench.db'),
+        'BMO_REPO_PATH': repo,
+        'BMO_SCHEDULE_COMMAND': openclaw,
+        'GEMINI_API_KEY': 'benchmark',
+        # Keep the seeded 90 days intact instead of pruning them mid-run
+        'BMO_TOKEN_RETENTION_DAYS': '0',
+        # The seeded history is far over the default monthly budget
+        'BMO_TOKEN_LIMIT_MONTH': '0',
+        'PYTHONUNBUFFERED': '1',
+    })
+    return env
+
+
+def run_scale(scale, args):
+    rows = parse_scale(scale)
+    seed_path, seed_seconds = _ensure_seed(args.data_dir, scale, rows, args.reseed)
+    with tempfile.TemporaryDirectory(prefix='bmo-bench-') as workdir:
+        env = _fake_environment(workdir, args)
+        shutil.copyfile(seed_path, env['BMO_DB_PATH'])
+        result_path = os.path.join(workdir, 'result.json')
+        cmd = [sys.executable, '-m', 'bench.run', '--worker', '--result', result_path,
+               '--rows', str(rows), '--modes', ','.join(args.modes),
+               '--clients', str(args.clients), '--requests', str(args.requests),
+               '--warmup', str(args.warmup), '--gemini-latency', str(args.gemini_latency),
+               '--caldav-latency', str(args.caldav_latency)]
+        if args.routes:
+            cmd += ['--routes', ','.join(args.routes)]
+        subprocess.run(cmd, cwd=BACKEND_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+        with open(result_path) as f:
+            result = json.load(f)
+    result.update({
+        "rows": rows,
+        "db_bytes": os.path.getsize(seed_path),
+        "seed_seconds": seed_seconds,
+    })
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(report, baseline, threshold):
+    """Routes slower (p99) or slower-throughput than the baseline by more than `threshold`x."""
+    regressions = []
+    for scale, scale_result in report["scales"].items():
+        base_scale = baseline.get("scales", {}).get(scale)
+        if not base_scale:
+            continue
+        for mode, mode_result in scale_result["modes"].items():
+            base_routes = base_scale["modes"].get(mode, {}).get("routes", {})
+            for name, current in mode_result["routes"].items():
+                base = base_routes.get(name)
+                if not base or not base.get("p99_ms") or not current.get("p99_ms"):
+                    continue
+                slower = current["p99_ms"] > base["p99_ms"] * threshold and \
+                    current["p99_ms"] - base["p99_ms"] > MIN_REGRESSION_MS
+                throttled = base.get("throughput_rps") and current.get("throughput_rps") and \
+                    current["throughput_rps"] * threshold < base["throughput_rps"]
+                if slower or throttled:
+                    regressions.append({
+                        "scale": scale, "mode": mode, "route": name,
+                        "p99_ms": current["p99_ms"], "baseline_p99_ms": base["p99_ms"],
+                        "throughput_rps": current["throughput_rps"],
+                        "baseline_throughput_rps": base.get("throughput_rps"),
+                    })
+    return regressions
+
+
+def _print_table(report):
+    for scale, scale_result in report["scales"].items():
+        for mode, mode_result in scale_result["modes"].items():
+            print(f"\n{scale} rows / {mode}")
+            print(f"  {'route':<26}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}  codes")
+            for name, r in mode_result["routes"].items():
+                print(f"  {name:<26}{r['throughput_rps'] or 0:>10}{r['p50_ms'] or 0:>10}"
+                      f"{r['p99_ms'] or 0:>10}  {r['status_codes']}")
+
+
+def _csv(value):
+    return [item for item in value.split(',') if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard API.")
+    parser.add_argument('--scales', type=_csv, default=['1k', '100k'],
+                        help="Comma-separated row counts, e.g. 1k,100k,10m (10m takes minutes to seed)")
+    parser.add_argument('--modes', type=_csv, default=['client', 'server'],
+                        help="Any of client, server, asgi")
+    parser.add_argument('--routes', type=_csv, default=None, help="Only these route names")
+    parser.add_argument('--clients', type=int, default=8, help="Concurrent clients")
+    parser.add_argument('--requests', type=int, default=200, help="Measured requests per route")
+    parser.add_argument('--warmup', type=int, default=10, help="Unmeasured requests per route")
+    parser.add_argument('--gemini-latency', type=float, default=0.05)
+    parser.add_argument('--caldav-latency', type=float, default=0.02)
+    parser.add_argument('--cli-latency', type=float, default=0.05)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help="Where seeded databases are cached")
+    parser.add_argument('--reseed', action='store_true', help="Rebuild cached seed databases")
+    parser.add_argument('--output', default='bench-report.json')
+    parser.add_argument('--baseline', help="Earlier report to compare against")
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help="Allowed slowdown factor before a route counts as a regression")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    parser.add_argument('--rows', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        return run_worker(args)
+
+    report = {
+        "generated_at": datetime.datetime.now().isoformat(timespec='seconds'),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            "clients": args.clients, "requests": args.requests, "warmup": args.warmup,
+            "modes": args.modes, "gemini_latency": args.gemini_latency,
+            "caldav_latency": args.caldav_latency, "cli_latency": args.cli_latency,
+        },
+        "scales": {},
+    }
+    for scale in args.scales:
+        print(f"Benchmarking {scale}...", file=sys.stderr)
+        report["scales"][scale] = run_scale(scale, args)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(report, json.load(f), args.threshold)
+        if report["regressions"]:
+            status = 1
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    _print_table(report)
+    for r in report.get("regressions", []):
+        print(f"REGRESSION {r['scale']}/{r['mode']}/{r['route']}: p99 {r['baseline_p99_ms']} -> "
+              f"{r['p99_ms']} ms, {r['baseline_throughput_rps']} -> {r['throughput_rps']} rps")
+    print(f"\nReport written to {args.output}")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
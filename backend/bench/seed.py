@@ -0,0 +1,123 @@
+"""
+Builds a synthetic bmo_dashboard.db for benchmarks:
+
+    python -m bench.seed --scale 100k --out /tmp/bmo-100k.db
+
+`--scale` rows go into both activities and token_usage. Most activities
+are archived Completed ones; a fixed handful are current, like a real
+board. Token usage is spread evenly over the last 90 days. The same
+scale and seed always produce the same data.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+
+MODELS = [('gemini-1.5-flash', 70), ('gemini-1.5-pro', 20), ('llama3', 10)]
+STATUSES_CURRENT = ['Pending'] * 3 + ['Active'] + ['Completed'] * 4
+# Activities that stay on the default (non-archived) listing
+CURRENT_ACTIVITIES = 200
+TOKEN_USAGE_DAYS = 90
+SEED_VERSION = 2
+
+
+def parse_scale(value):
+    """'1k' -> 1000, '10M' -> 10000000, '2500' -> 2500."""
+    value = value.strip().lower()
+    factor = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    if factor != 1:
+        value = value[:-1]
+    return int(float(value) * factor)
+
+
+def _fmt(dt):
+    return dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _activities(n, now, rng):
+    current = min(CURRENT_ACTIVITIES, n)
+    archived = n - current
+    oldest = now - datetime.timedelta(days=365)
+    span = (now - datetime.timedelta(days=15) - oldest).total_seconds()
+    for i in range(archived):
+        # Ascending, so ids and last_updated roughly agree as in real data
+        updated = oldest + datetime.timedelta(seconds=span * i / max(archived, 1))
+        yield (f"Archived task {i}", f"Synthetic completed activity #{i} for benchmarks",
+               'Completed', _fmt(updated), i + 1)
+    for k in range(current):
+        updated = now - datetime.timedelta(minutes=rng.randint(1, 60 * 24 * 10))
+        yield (f"Current task {k}", f"Synthetic activity #{k} on the board",
+               rng.choice(STATUSES_CURRENT), _fmt(updated), archived + k + 1)
+
+
+def _token_usage(n, now, rng):
+    start = now - datetime.timedelta(days=TOKEN_USAGE_DAYS)
+    step = TOKEN_USAGE_DAYS * 86400 / max(n, 1)
+    names = [name for name, _ in MODELS]
+    weights = [weight for _, weight in MODELS]
+    for i in range(n):
+        prompt = rng.randint(20, 800)
+        completion = rng.randint(5, 300)
+        success = rng.random() > 0.03
+        yield (_fmt(start + datetime.timedelta(seconds=i * step)), rng.choices(names, weights)[0],
+               prompt, completion, prompt + completion, 1, success,
+               None if success else 'Synthetic failure')
+
+
+def seed(path, rows, seed_value=42):
+    """Creates `path` from scratch with `rows` activities and token_usage rows."""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    # db reads BMO_DB_PATH at import time
+    os.environ['BMO_DB_PATH'] = path
+    import db
+    import token_rollups
+
+    rng = random.Random(seed_value)
+    now = datetime.datetime.now().replace(microsecond=0)
+    db.init_db()
+    with db.connection() as conn:
+        conn.execute('PRAGMA synchronous = OFF')
+        # Per-row triggers would dominate; versions and rollups are set in bulk below
+        conn.execute('DROP TRIGGER IF EXISTS activities_version_insert')
+        conn.execute('DROP TRIGGER IF EXISTS token_usage_rollup')
+        conn.execute('DROP TRIGGER IF EXISTS activities_fts_insert')
+        conn.executemany('''
+            INSERT INTO activities (title, description, status, last_updated, row_version)
+            VALUES (?, ?, ?, ?, ?)
+        ''', _activities(rows, now, rng))
+        conn.execute("UPDATE table_versions SET version = ? WHERE name = 'activities'", (rows,))
+        conn.executemany('''
+            INSERT INTO token_usage (timestamp, model_name, prompt_tokens, completion_tokens,
+                                     total_tokens, api_call_count, success, error_message)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', _token_usage(rows, now, rng))
+        token_rollups.backfill(conn)
+        if db.has_search_index(conn):
+            db.rebuild_search_index(conn)
+    db.init_db()  # puts the triggers back
+    with db.connection() as conn:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('ANALYZE')
+    db.get_pool().close_all()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seed a synthetic dashboard database.")
+    parser.add_argument('--scale', required=True, help="Rows per table, e.g. 1k, 100k, 10M")
+    parser.add_argument('--out', required=True, help="Database file to create (overwritten)")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    rows = parse_scale(args.scale)
+    started = time.perf_counter()
+    seed(args.out, rows, args.seed)
+    print(f"Seeded {rows} rows per table into {args.out} in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Measures how long the backend takes to start:
+
+    cd backend
+    python -m bench.startup [--runs 5] [--top 15] [--output startup.json]
+
+Every run is a fresh interpreter against an empty database, with git and
+openclaw replaced by the fakes in bench/fakes.py. Each one reports the
+time to import app.py, to run create_app(), and to answer the first
+request, plus the phases metrics.py recorded (also exported on
+/api/metrics as bmo_startup_seconds). One more run under -X importtime
+lists the modules app.py imports, slowest first. The report gives the
+median of every timing; compare it between commits to catch modules that
+slipped back onto the import path.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import datetime
+import statistics
+import subprocess
+
+from bench import fakes
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child; prints one JSON line
+CHILD = '''
+import os, sys, json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+response = app.app.test_client().get('/api/activities')
+answered = time.perf_counter()
+import metrics
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (answered - created) * 1000,
+    "first_request_status": response.status_code,
+    "phases_ms": {phase: seconds * 1000 for phase, seconds in metrics.startup.items()},
+    "modules": len(sys.modules),
+}))
+sys.stdout.flush()
+os._exit(0)
+'''
+
+
+def _environment(workdir, run):
+    bin_dir = os.path.join(workdir, 'bin')
+    if not os.path.isdir(bin_dir):
+        os.makedirs(bin_dir)
+        fakes.write_fake_git(bin_dir)
+        fakes.write_fake_openclaw(bin_dir)
+        fakes.make_fake_repo(os.path.join(workdir, 'repo'))
+    env = dict(os.environ)
+    env.update({
+        'PATH': bin_dir + os.pathsep + env.get('PATH', ''),
+        'BMO_DB_PATH': os.path.join(workdir, f'startup-{run}.db'),
+        'BMO_REPO_PATH': os.path.join(workdir, 'repo'),
+        'BMO_SCHEDULE_COMMAND': os.path.join(bin_dir, 'openclaw'),
+        'BMO_ROLE': 'all',
+    })
+    return env
+
+
+def measure_once(workdir, run):
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-c', CHILD], cwd=BACKEND_DIR, env=_environment(workdir, run),
+                          capture_output=True, text=True, check=True)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    # Includes interpreter start and shutdown, which the in-process timings cannot see
+    result["process_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us, depth)] from -X importtime output."""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def import_profile(workdir, top):
+    """app.py's direct imports by cumulative time, and the slowest modules overall by self time."""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=BACKEND_DIR,
+                          env=_environment(workdir, 'importtime'), capture_output=True, text=True, check=True)
+    entries = parse_importtime(proc.stderr)
+    # -X importtime prints children before their parent; app's children are the depth-1
+    # entries just before it
+    direct, children = [], []
+    for name, self_us, cumulative_us, depth in entries:
+        if depth == 1:
+            children.append((name, cumulative_us))
+        elif depth == 0:
+            if name == 'app':
+                direct = children
+            children = []
+    direct.sort(key=lambda entry: entry[1], reverse=True)
+    slowest = sorted(entries, key=lambda entry: entry[1], reverse=True)[:top]
+    return {
+        "app_imports": [{"module": name, "cumulative_ms": round(us / 1000, 1)} for name, us in direct[:top]],
+        "slowest_modules": [{"module": name, "self_ms": round(us / 1000, 1)} for name, us, _, _ in slowest],
+    }
+
+
+def _median(values):
+    return round(statistics.median(values), 1) if values else None
+
+
+def summarize(runs):
+    summary = {key: _median([r[key] for r in runs])
+               for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'process_ms')}
+    phases = sorted({phase for r in runs for phase in r["phases_ms"]})
+    summary["phases_ms"] = {phase: _median([r["phases_ms"][phase] for r in runs if phase in r["phases_ms"]])
+                            for phase in phases}
+    summary["modules"] = runs[-1]["modules"]
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure backend import and startup time.")
+    parser.add_argument('--runs', type=int, default=5, help="Fresh processes to time")
+    parser.add_argument('--top', type=int, default=15, help="Modules to list in the import profile")
+    parser.add_argument('--output', help="Also write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='bmo-startup-') as workdir:
+        runs = [measure_once(workdir, run) for run in range(args.runs)]
+        profile = import_profile(workdir, args.top)
+
+    report = {
+        "generated_at": datetime.datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "runs": args.runs,
+        "median": summarize(runs),
+        "import_profile": profile,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
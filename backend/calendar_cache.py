@@ -0,0 +1,241 @@
+import json
+import time
+import datetime
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+ICLOUD_URL = "https://caldav.icloud.com"
+GETCTAG = "{http://calendarserver.org/ns/}getctag"
+
+
+@functools.lru_cache(maxsize=None)
+def _ctag_element():
+    """
+    CalendarServer collection tag; changes whenever anything in the calendar does.
+    caldav (and lxml) are only imported once a refresh actually talks to a server.
+    """
+    from caldav.elements.base import ValuedBaseElement
+
+    class GetCTag(ValuedBaseElement):
+        tag = GETCTAG
+
+    return GetCTag
+
+
+def _parse_event(event, cal_name):
+    vobj = event.vobject_instance.vevent
+
+    summary = vobj.summary.value if hasattr(vobj, 'summary') else 'No Title'
+
+    # Handle start time
+    start_dt = vobj.dtstart.value
+    is_all_day = not isinstance(start_dt, datetime.datetime)
+
+    if isinstance(start_dt, datetime.datetime):
+        # Localize if it's naive (iCloud usually sends TZ aware, but just in case)
+        start_time = start_dt.strftime('%H:%M')
+        sort_key = start_dt.timestamp()
+    else:
+        # Date object (all day)
+        start_time = "Celý den"
+        # Sort all day events at the beginning of the day
+        sort_key = datetime.datetime.combine(start_dt, datetime.time.min).timestamp()
+
+    # End is only used to drop finished events from the cached window
+    end_key = sort_key
+    if hasattr(vobj, 'dtend'):
+        end_dt = vobj.dtend.value
+        if isinstance(end_dt, datetime.datetime):
+            end_key = end_dt.timestamp()
+        else:
+            end_key = datetime.datetime.combine(end_dt, datetime.time.min).timestamp()
+    elif is_all_day:
+        end_key = sort_key + 86400
+
+    return {
+        "title": summary,
+        "time": start_time,
+        "allDay": is_all_day,
+        "calendar": cal_name,
+        "sort_key": sort_key,
+        "end_key": end_key
+    }
+
+
+def upcoming(events, days, limit, now=None):
+    """Events not yet over and starting within `days`, sorted and de-duplicated."""
+    now_ts = time.time() if now is None else now
+    end_ts = now_ts + days * 86400
+    events = [e for e in events if e['end_key'] >= now_ts and e['sort_key'] < end_ts]
+
+    # Sort by time and take top 10 (Frontend will slice to 3-4)
+    events.sort(key=lambda x: x['sort_key'])
+
+    # Remove duplicates
+    seen = set()
+    unique_events = []
+    for e in events:
+        identifier = f"{e['title']}-{e['time']}"
+        if identifier not in seen:
+            seen.add(identifier)
+            unique_events.append({k: v for k, v in e.items() if k != 'end_key'})
+
+    return unique_events[:limit]
+
+
+class CalendarCache:
+    """
+    Keeps upcoming CalDAV events in memory.
+
+    One DAVClient (and its keep-alive HTTP session) lives for the life of
+    the process. A refresh asks every calendar for its ctag / sync-token
+    concurrently and only re-downloads events for calendars whose tag
+    changed, or whose cached date range no longer covers the window.
+    Reads are served from memory; once the data is older than `ttl` the
+    caller still gets it immediately while a background refresh runs.
+    Only one refresh runs at a time; a failed first sync is retried in the
+    background every `retry_interval` seconds rather than by each caller.
+    """
+
+    def __init__(self, auth_path, url=ICLOUD_URL, ttl=300, days=7, max_workers=4,
+                 client_factory=None, retry_interval=60):
+        self.auth_path = auth_path
+        self.url = url
+        self.ttl = ttl
+        self.days = days
+        self.retry_interval = retry_interval
+        self.client_factory = client_factory or self._default_client
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='caldav')
+        self._client = None
+        self._calendars = None
+        # calendar url -> {"tag", "horizon", "events"}
+        self._per_calendar = {}
+        self._events = None
+        self._updated_at = 0.0
+        self._error = None
+        self._refresh_lock = threading.Lock()
+        # Signalled, under _refresh_lock, when a guarded refresh ends
+        self._refreshed = threading.Condition(self._refresh_lock)
+        self._refreshing = False
+        self._attempted_at = 0.0
+
+    def _default_client(self):
+        with open(self.auth_path, 'r') as f:
+            auth = json.load(f)
+        import caldav
+        return caldav.DAVClient(self.url, username=auth.get('email'), password=auth.get('password'))
+
+    def _get_calendars(self):
+        if self._calendars is None:
+            if self._client is None:
+                self._client = self.client_factory()
+            self._calendars = self._client.principal().calendars()
+        return self._calendars
+
+    def _calendar_tag(self, calendar):
+        from caldav.elements import dav
+        try:
+            props = calendar.get_properties([_ctag_element()(), dav.SyncToken()])
+        except Exception:
+            return None
+        return props.get(GETCTAG) or props.get(dav.SyncToken.tag)
+
+    def _sync_calendar(self, calendar, now):
+        key = str(calendar.url)
+        window_end = now + datetime.timedelta(days=self.days)
+        tag = self._calendar_tag(calendar)
+        cached = self._per_calendar.get(key)
+        if cached and tag is not None and cached['tag'] == tag and cached['horizon'] >= window_end:
+            return key, cached
+
+        # Fetch one extra day so the cache stays valid while the window slides
+        horizon = window_end + datetime.timedelta(days=1)
+        cal_name = calendar.name
+        events = calendar.date_search(start=now, end=horizon, expand=True)
+        return key, {
+            "tag": tag,
+            "horizon": horizon,
+            "events": [_parse_event(event, cal_name) for event in events]
+        }
+
+    def refresh(self):
+        """Synchronously re-syncs all calendars. Returns the new event list."""
+        now = datetime.datetime.now()
+        try:
+            with metrics.track('caldav', 'refresh'):
+                calendars = self._get_calendars()
+                results = list(self._executor.map(lambda c: self._sync_calendar(c, now), calendars))
+        except Exception:
+            # Drop the client so the next attempt reconnects and rediscovers calendars
+            self._client = None
+            self._calendars = None
+            raise
+
+        self._per_calendar = dict(results)
+        all_events = []
+        for _, entry in results:
+            all_events.extend(entry['events'])
+        self._events = all_events
+        self._updated_at = time.time()
+        self._error = None
+        return all_events
+
+    def _claim_refresh(self):
+        """True if the caller should run the refresh; False if one is already running."""
+        with self._refresh_lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+            self._attempted_at = time.time()
+            return True
+
+    def _run_refresh(self):
+        """refresh() for a caller that claimed it; records the error instead of raising."""
+        try:
+            self.refresh()
+        except Exception as e:
+            self._error = str(e)
+            print(f"Calendar error: {e}")
+        finally:
+            with self._refreshed:
+                self._refreshing = False
+                self._refreshed.notify_all()
+
+    def _refresh_in_background(self):
+        if self._claim_refresh():
+            threading.Thread(target=self._run_refresh, name='calendar-refresh', daemon=True).start()
+
+    def age(self):
+        return time.time() - self._updated_at if self._updated_at else None
+
+    def error(self):
+        """Why the last refresh failed, on one line; None after a successful one."""
+        return ' '.join(self._error.split()) if self._error else None
+
+    def get_events(self, limit=10):
+        """
+        Upcoming events in the window, sorted and de-duplicated.
+        Blocks only until the first sync: one caller runs it and concurrent
+        callers wait for its result. If it failed, callers get an empty list
+        (see error()) while the background refresh retries.
+        """
+        if self._events is None:
+            if self._error is None:
+                if self._claim_refresh():
+                    self._run_refresh()
+                else:
+                    with self._refreshed:
+                        self._refreshed.wait_for(lambda: not self._refreshing)
+            elif time.time() - self._attempted_at >= self.retry_interval:
+                self._refresh_in_background()
+            if self._events is None:
+                return []
+        elif self.age() > self.ttl:
+            self._refresh_in_background()
+        return upcoming(self._events, self.days, limit)
+
+    def state(self):
+        """Raw cached events (with end_key), for publishing to other processes."""
+        return {"events": self._events, "updated_at": self._updated_at or None, "error": self._error}
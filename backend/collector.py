@@ -0,0 +1,37 @@
+"""
+Background process for the multi-worker server.
+
+Runs the stats and process samplers, schedule refresh, calendar sync,
+git watcher and token retention, and publishes their state to the shared
+snapshot that the HTTP workers (BMO_ROLE=worker) read. Serves no HTTP
+itself.
+
+    python collector.py
+"""
+import os
+import signal
+import threading
+
+os.environ['BMO_ROLE'] = 'collector'
+
+
+def main():
+    stopped = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopped.set())
+
+    import app
+    app.create_app()
+    print(f"Collector publishing to {app.snapshot_writer.path} (pid {os.getpid()})")
+    stopped.wait()
+    app.snapshot_publisher.stop()
+    app.stats_sampler.stop()
+    app.process_sampler.stop()
+    app.schedule_cache.stop()
+    app.git_watcher.stop()
+    app.retention_job.stop()
+    app.snapshot_writer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+import os
+import queue
+import sqlite3
+import threading
+import contextlib
+import metrics
+
+DB_PATH = os.environ.get('BMO_DB_PATH', os.path.join(os.path.dirname(__file__), 'bmo_dashboard.db'))
+
+# Idle connections kept around for reuse; extra ones are closed on release
+POOL_SIZE = int(os.environ.get('BMO_DB_POOL_SIZE', 8))
+# Per-connection prepared statement cache (sqlite3 keys it by SQL text)
+CACHED_STATEMENTS = 256
+
+PRAGMAS = [
+    # Only takes effect on a new file, or on the next VACUUM of an existing one;
+    # must come before journal_mode (see token_retention.py)
+    'PRAGMA auto_vacuum = INCREMENTAL',
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA cache_size = -8000',  # ~8 MB page cache
+    'PRAGMA temp_store = MEMORY',
+]
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS activities (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        description TEXT,
+        status TEXT CHECK(status IN ('Pending', 'Active', 'Completed')) NOT NULL DEFAULT 'Pending',
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        row_version INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    # Monotonic change counters, bumped by triggers (see activities_version_*)
+    '''
+    CREATE TABLE IF NOT EXISTS table_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    "INSERT OR IGNORE INTO table_versions (name, version) VALUES ('activities', 0)",
+    # Bulk imports skip titles that already exist (see activities_io.py)
+    'CREATE INDEX IF NOT EXISTS idx_activities_title ON activities (title)',
+    # Status filters and the archived listing, newest first
+    'CREATE INDEX IF NOT EXISTS idx_activities_status_updated ON activities (status, last_updated)',
+    '''
+    CREATE TABLE IF NOT EXISTS token_usage (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        model_name TEXT NOT NULL,
+        prompt_tokens INTEGER,
+        completion_tokens INTEGER,
+        total_tokens INTEGER,
+        api_call_count INTEGER DEFAULT 1,
+        success BOOLEAN,
+        error_message TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_token_usage_timestamp ON token_usage (timestamp)',
+    # Pre-aggregated token usage, maintained by the token_usage_rollup trigger
+    '''
+    CREATE TABLE IF NOT EXISTS token_usage_hourly (
+        hour TEXT NOT NULL,
+        model_name TEXT NOT NULL,
+        prompt_tokens INTEGER NOT NULL DEFAULT 0,
+        completion_tokens INTEGER NOT NULL DEFAULT 0,
+        total_tokens INTEGER NOT NULL DEFAULT 0,
+        call_count INTEGER NOT NULL DEFAULT 0,
+        success_count INTEGER NOT NULL DEFAULT 0,
+        failure_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, model_name)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS token_usage_daily (
+        day TEXT NOT NULL,
+        model_name TEXT NOT NULL,
+        prompt_tokens INTEGER NOT NULL DEFAULT 0,
+        completion_tokens INTEGER NOT NULL DEFAULT 0,
+        total_tokens INTEGER NOT NULL DEFAULT 0,
+        call_count INTEGER NOT NULL DEFAULT 0,
+        success_count INTEGER NOT NULL DEFAULT 0,
+        failure_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, model_name)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS token_usage_monthly (
+        month TEXT NOT NULL,
+        model_name TEXT NOT NULL,
+        prompt_tokens INTEGER NOT NULL DEFAULT 0,
+        completion_tokens INTEGER NOT NULL DEFAULT 0,
+        total_tokens INTEGER NOT NULL DEFAULT 0,
+        call_count INTEGER NOT NULL DEFAULT 0,
+        success_count INTEGER NOT NULL DEFAULT 0,
+        failure_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (month, model_name)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS git_watch_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    ''',
+]
+
+# Columns added after the first release; ALTERed into older databases
+COLUMNS = [
+    ('activities', 'row_version', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+# Created after COLUMNS, since they reference the added columns
+TRIGGERS = [
+    'CREATE INDEX IF NOT EXISTS idx_activities_row_version ON activities (row_version)',
+    '''
+    CREATE TRIGGER IF NOT EXISTS activities_version_insert AFTER INSERT ON activities
+    BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = 'activities';
+        UPDATE activities SET row_version = (SELECT version FROM table_versions WHERE name = 'activities')
+        WHERE id = NEW.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS activities_version_update
+    AFTER UPDATE OF title, description, status, last_updated ON activities
+    BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = 'activities';
+        UPDATE activities SET row_version = (SELECT version FROM table_versions WHERE name = 'activities')
+        WHERE id = NEW.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS activities_version_delete AFTER DELETE ON activities
+    BEGIN
+        UPDATE table_versions SET version = version + 1 WHERE name = 'activities';
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS token_usage_rollup AFTER INSERT ON token_usage
+    BEGIN
+        INSERT INTO token_usage_hourly (hour, model_name, prompt_tokens, completion_tokens,
+                                       total_tokens, call_count, success_count, failure_count)
+        VALUES (strftime('%Y-%m-%d %H:00', NEW.timestamp), NEW.model_name, IFNULL(NEW.prompt_tokens, 0),
+                IFNULL(NEW.completion_tokens, 0), IFNULL(NEW.total_tokens, 0), IFNULL(NEW.api_call_count, 1),
+                CASE WHEN NEW.success THEN IFNULL(NEW.api_call_count, 1) ELSE 0 END,
+                CASE WHEN NEW.success THEN 0 ELSE IFNULL(NEW.api_call_count, 1) END)
+        ON CONFLICT(hour, model_name) DO UPDATE SET
+            prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+            completion_tokens = completion_tokens + excluded.completion_tokens,
+            total_tokens = total_tokens + excluded.total_tokens,
+            call_count = call_count + excluded.call_count,
+            success_count = success_count + excluded.success_count,
+            failure_count = failure_count + excluded.failure_count;
+        INSERT INTO token_usage_daily (day, model_name, prompt_tokens, completion_tokens,
+                                       total_tokens, call_count, success_count, failure_count)
+        VALUES (date(NEW.timestamp), NEW.model_name, IFNULL(NEW.prompt_tokens, 0),
+                IFNULL(NEW.completion_tokens, 0), IFNULL(NEW.total_tokens, 0), IFNULL(NEW.api_call_count, 1),
+                CASE WHEN NEW.success THEN IFNULL(NEW.api_call_count, 1) ELSE 0 END,
+                CASE WHEN NEW.success THEN 0 ELSE IFNULL(NEW.api_call_count, 1) END)
+        ON CONFLICT(day, model_name) DO UPDATE SET
+            prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+            completion_tokens = completion_tokens + excluded.completion_tokens,
+            total_tokens = total_tokens + excluded.total_tokens,
+            call_count = call_count + excluded.call_count,
+            success_count = success_count + excluded.success_count,
+            failure_count = failure_count + excluded.failure_count;
+        INSERT INTO token_usage_monthly (month, model_name, prompt_tokens, completion_tokens,
+                                       total_tokens, call_count, success_count, failure_count)
+        VALUES (strftime('%Y-%m', NEW.timestamp), NEW.model_name, IFNULL(NEW.prompt_tokens, 0),
+                IFNULL(NEW.completion_tokens, 0), IFNULL(NEW.total_tokens, 0), IFNULL(NEW.api_call_count, 1),
+                CASE WHEN NEW.success THEN IFNULL(NEW.api_call_count, 1) ELSE 0 END,
+                CASE WHEN NEW.success THEN 0 ELSE IFNULL(NEW.api_call_count, 1) END)
+        ON CONFLICT(month, model_name) DO UPDATE SET
+            prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+            completion_tokens = completion_tokens + excluded.completion_tokens,
+            total_tokens = total_tokens + excluded.total_tokens,
+            call_count = call_count + excluded.call_count,
+            success_count = success_count + excluded.success_count,
+            failure_count = failure_count + excluded.failure_count;
+    END
+    ''',
+]
+
+
+# Full-text index over activity titles and descriptions (see activities_search.py).
+# External content: the text lives only in activities; the triggers keep the
+# index in step. Skipped when SQLite was built without FTS5.
+SEARCH_SCHEMA = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS activities_fts USING fts5(
+        title, description, content='activities', content_rowid='id'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS activities_fts_insert AFTER INSERT ON activities
+    BEGIN
+        INSERT INTO activities_fts (rowid, title, description) VALUES (NEW.id, NEW.title, NEW.description);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS activities_fts_delete AFTER DELETE ON activities
+    BEGIN
+        INSERT INTO activities_fts (activities_fts, rowid, title, description)
+        VALUES ('delete', OLD.id, OLD.title, OLD.description);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS activities_fts_update AFTER UPDATE OF title, description ON activities
+    BEGIN
+        INSERT INTO activities_fts (activities_fts, rowid, title, description)
+        VALUES ('delete', OLD.id, OLD.title, OLD.description);
+        INSERT INTO activities_fts (rowid, title, description) VALUES (NEW.id, NEW.title, NEW.description);
+    END
+    ''',
+]
+
+
+def _connect(path):
+    conn = sqlite3.connect(
+        path,
+        timeout=5.0,
+        check_same_thread=False,
+        cached_statements=CACHED_STATEMENTS,
+    )
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    """
+    Pool of long-lived SQLite connections.
+
+    A connection is checked out by exactly one thread at a time and handed
+    back afterwards, so the pragmas and the statement cache survive between
+    requests instead of being rebuilt on every call.
+
+    The idle connections sit in one shared LIFO queue rather than in
+    thread-local slots. The threaded Werkzeug server starts a new thread
+    for every request, and the ASGI server and the background jobs use
+    executor threads that come and go. Per-thread connections would be
+    opened per request and left open until their thread was collected.
+    LIFO hands the most recently used (warmest) connection to the next
+    caller, and at most `size` idle connections are kept.
+    """
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return _connect(self.path)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Checks out a connection; commits on success, rolls back on error."""
+        conn = self.acquire()
+        try:
+            with metrics.track('sqlite', 'transaction'):
+                yield conn
+                if conn.in_transaction:
+                    conn.commit()
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_PATH)
+    return _pool
+
+
+def connection():
+    """Shortcut for get_pool().connection()."""
+    return get_pool().connection()
+
+
+def init_db():
+    """Creates or upgrades the schema. Called once at startup, not per request."""
+    with connection() as conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+        for table, column, definition in COLUMNS:
+            existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+            if column not in existing:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        for statement in TRIGGERS:
+            conn.execute(statement)
+        _init_search(conn)
+
+
+def has_search_index(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'activities_fts'").fetchone()
+    return row is not None
+
+
+def rebuild_search_index(conn):
+    """Re-reads every activity into activities_fts."""
+    conn.execute("INSERT INTO activities_fts (activities_fts) VALUES ('rebuild')")
+
+
+def _init_search(conn):
+    existed = has_search_index(conn)
+    try:
+        for statement in SEARCH_SCHEMA:
+            conn.execute(statement)
+    except sqlite3.OperationalError as e:
+        if 'fts5' not in str(e):
+            raise
+        print("SQLite has no FTS5; activity search falls back to LIKE")
+        return
+    if not existed:
+        # Index activities written before the table existed
+        rebuild_search_index(conn)
+
+
+def table_version(conn, name):
+    """Current change counter for `name` (see table_versions)."""
+    row = conn.execute('SELECT version FROM table_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
@@ -0,0 +1,130 @@
+import json
+import queue
+import asyncio
+import threading
+
+# Seconds between keep-alive comments on an idle stream
+KEEPALIVE_INTERVAL = 15
+
+
+def _put_dropping_oldest(q, message, empty_error, full_error):
+    try:
+        q.put_nowait(message)
+    except full_error:
+        try:
+            q.get_nowait()
+            q.put_nowait(message)
+        except (empty_error, full_error):
+            pass
+
+
+class _Subscriber:
+    """Subscriber read by a blocking thread (WSGI stream)."""
+
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(maxsize=queue_size)
+
+    def put(self, message):
+        _put_dropping_oldest(self.queue, message, queue.Empty, queue.Full)
+
+
+class _AsyncSubscriber:
+    """Subscriber read from an asyncio loop (ASGI stream); publishers may be any thread."""
+
+    def __init__(self, queue_size, loop):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.loop = loop
+
+    def put(self, message):
+        try:
+            self.loop.call_soon_threadsafe(
+                _put_dropping_oldest, self.queue, message, asyncio.QueueEmpty, asyncio.QueueFull
+            )
+        except RuntimeError:
+            # Loop already closed; the stream is gone
+            pass
+
+
+class EventBus:
+    """
+    In-process publish/subscribe used by the server-sent events stream.
+
+    Every subscriber gets its own bounded queue. A subscriber that stops
+    reading loses its oldest events instead of blocking the publisher.
+    """
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._last = {}
+
+    def _add(self, subscriber):
+        with self._lock:
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def subscribe(self):
+        return self._add(_Subscriber(self.queue_size))
+
+    def subscribe_async(self):
+        return self._add(_AsyncSubscriber(self.queue_size, asyncio.get_running_loop()))
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def last(self, event):
+        """Most recently published payload for `event`, or None."""
+        return self._last.get(event)
+
+    def publish(self, event, data):
+        self._last[event] = data
+        message = format_sse(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def stream(self, initial=()):
+        """
+        Generator of SSE-formatted messages for one client.
+        `initial` is a list of (event, data) pairs sent right after connecting.
+        """
+        subscriber = self.subscribe()
+        try:
+            yield 'retry: 5000\n\n'
+            for event, data in initial:
+                yield format_sse(event, data)
+            while True:
+                try:
+                    yield subscriber.queue.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+        finally:
+            self.unsubscribe(subscriber)
+
+    async def stream_async(self, initial=()):
+        """Async generator version of stream() for ASGI servers."""
+        subscriber = self.subscribe_async()
+        try:
+            yield 'retry: 5000\n\n'
+            for event, data in initial:
+                yield format_sse(event, data)
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber.queue.get(), timeout=KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+        finally:
+            self.unsubscribe(subscriber)
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+bus = EventBus()
@@ -1,10 +1,347 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import re
+import json
 import time
-from token_monitor import monitor_gemini_usage
+import random
+import asyncio
+import threading
+import concurrent.futures
+from collections import OrderedDict
+from contextlib import contextmanager
+import token_monitor
+from token_monitor import monitor_gemini_usage, monitor_model_usage
+import metrics
 
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={api_key}"
+GEMINI_API_BASE = os.environ.get('GEMINI_API_BASE', "https://generativelanguage.googleapis.com/v1beta")
+GEMINI_API_URL = GEMINI_API_BASE + "/models/{model_name}:generateContent?key={api_key}"
+# Same request body; the response is server-sent events, one partial response per event
+GEMINI_STREAM_URL = GEMINI_API_BASE + "/models/{model_name}:streamGenerateContent?alt=sse&key={api_key}"
+
+# HTTP behaviour towards the Gemini API
+CONNECT_TIMEOUT = float(os.environ.get('BMO_GEMINI_CONNECT_TIMEOUT', 3))
+READ_TIMEOUT = float(os.environ.get('BMO_GEMINI_READ_TIMEOUT', 10))
+MAX_RETRIES = int(os.environ.get('BMO_GEMINI_MAX_RETRIES', 2))
+BACKOFF_FACTOR = float(os.environ.get('BMO_GEMINI_BACKOFF', 0.5))
+# Longest Retry-After we are willing to sleep for before giving up on a retry
+MAX_RETRY_AFTER = float(os.environ.get('BMO_GEMINI_MAX_RETRY_AFTER', 5))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Local Ollama server for the model router; unset leaves the router Gemini-only
+OLLAMA_URL = (os.environ.get('BMO_OLLAMA_URL') or '').rstrip('/') or None
+OLLAMA_MODEL = os.environ.get('BMO_OLLAMA_MODEL', 'llama3')
+# Local models on small hardware take a while to finish an answer
+OLLAMA_READ_TIMEOUT = float(os.environ.get('BMO_OLLAMA_READ_TIMEOUT', 30))
+# It is on this machine or the LAN: if it does not accept the connection at
+# once it is down, and the router should move on to Gemini
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get('BMO_OLLAMA_CONNECT_TIMEOUT', 0.5))
+
+# Model router (see ModelRouter)
+ROUTER_GEMINI_MODEL = os.environ.get('BMO_ROUTER_GEMINI_MODEL', 'gemini-1.5-flash')
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('BMO_GEMINI_MAX_CONCURRENCY', 8))
+OLLAMA_MAX_CONCURRENCY = int(os.environ.get('BMO_OLLAMA_MAX_CONCURRENCY', 1))
+# Gemini's latency is multiplied by this when ranking, so it only wins when clearly faster
+REMOTE_WEIGHT = float(os.environ.get('BMO_ROUTER_REMOTE_WEIGHT', 2.0))
+# Share of calls sent to a random backend to keep latency estimates fresh
+EXPLORE_RATE = float(os.environ.get('BMO_ROUTER_EXPLORE_RATE', 0.05))
+LATENCY_ALPHA = 0.2
+
+# Identical prompts within this many seconds reuse the previous answer
+CACHE_TTL = float(os.environ.get('BMO_GEMINI_CACHE_TTL', 300))
+CACHE_SIZE = int(os.environ.get('BMO_GEMINI_CACHE_SIZE', 256))
+
+
+class ResponseCache:
+    """
+    LRU cache with per-entry expiry, plus single-flight coalescing.
+
+    When several callers ask for the same key at once, only the first one
+    (the leader) runs the loader; the rest wait for its result or its
+    exception. Threads and coroutines share one table of in-flight loads,
+    each a concurrent.futures.Future: threads block on it, coroutines
+    await it. If the leader is cancelled or interrupted the future is
+    cancelled, and the waiters start over; one of them leads the retry.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def claim(self, key):
+        """
+        (True, value, None) on a hit. Otherwise (False, future, leader):
+        the leader must pass the future to finish() whatever happens, the
+        others wait for it (see wait() and wait_async()).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1], None
+            if entry:
+                del self._entries[key]
+
+            future = self._inflight.get(key)
+            if future:
+                self.coalesced += 1
+                return False, future, False
+            self.misses += 1
+            future = self._inflight[key] = concurrent.futures.Future()
+            return False, future, True
+
+    def finish(self, key, future, value=None, error=None):
+        """
+        Ends the leader's load: caches a non-empty value and hands it (or
+        `error`) to the waiters. An error that is not an Exception
+        (cancellation, GeneratorExit, KeyboardInterrupt) cancels the future
+        instead, so the waiters retry rather than fail.
+        """
+        if error is None and value:
+            self.put(key, value)
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        if error is None:
+            future.set_result(value)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            future.cancel()
+
+    @staticmethod
+    def wait(future):
+        """The leader's result, or None if it gave up and the caller should claim again."""
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            return None
+
+    @staticmethod
+    async def wait_async(future):
+        """wait() without blocking the event loop."""
+        try:
+            # Shielded: cancelling this waiter must not cancel the shared load
+            return await asyncio.shield(asyncio.wrap_future(future))
+        except asyncio.CancelledError:
+            if future.cancelled():
+                return None
+            raise
+
+    def get_or_load(self, key, loader):
+        while True:
+            hit, value, leader = self.claim(key)
+            if hit:
+                return value
+            future = value
+            if leader:
+                try:
+                    value = loader()
+                except BaseException as e:
+                    self.finish(key, future, error=e)
+                    raise
+                self.finish(key, future, value)
+                return value
+            value = self.wait(future)
+            if value is not None:
+                return value
+
+    async def get_or_load_async(self, key, loader):
+        """get_or_load for coroutines; waiting does not block the event loop."""
+        while True:
+            hit, value, leader = self.claim(key)
+            if hit:
+                return value
+            future = value
+            if leader:
+                try:
+                    value = await loader()
+                except BaseException as e:
+                    self.finish(key, future, error=e)
+                    raise
+                self.finish(key, future, value)
+                return value
+            value = await self.wait_async(future)
+            if value is not None:
+                return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced
+        }
+
+
+_response_cache = ResponseCache()
+
+
+def _normalize_prompt(prompt):
+    return re.sub(r'\s+', ' ', prompt).strip()
+
+
+def cache_stats():
+    """Hit / miss / coalesced counters of the response cache."""
+    return _response_cache.stats()
+
+
+class BoundedRetry(Retry):
+    """urllib3 Retry that honours Retry-After, but never sleeps longer than MAX_RETRY_AFTER."""
+
+    def sleep_for_retry(self, response=None):
+        retry_after = self.get_retry_after(response) if response is not None else None
+        if retry_after:
+            time.sleep(min(retry_after, MAX_RETRY_AFTER))
+            return True
+        return False
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Shared requests.Session with a connection pool and retry policy."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = BoundedRetry(
+                    total=MAX_RETRIES,
+                    connect=MAX_RETRIES,
+                    read=0,  # a read timeout is not retried; the upstream already took too long
+                    status=MAX_RETRIES,
+                    status_forcelist=RETRY_STATUSES,
+                    allowed_methods=frozenset(['POST']),
+                    backoff_factor=BACKOFF_FACTOR,
+                    respect_retry_after_header=True,
+                    raise_on_status=False
+                )
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+class GeminiUnavailable(Exception):
+    """Raised instead of calling out while the circuit breaker is open."""
+
+
+class BudgetExhausted(GeminiUnavailable):
+    """Raised instead of calling out once a token budget is used up."""
+
+
+class CircuitBreaker:
+    """
+    Fails fast once the upstream looks unhealthy.
+
+    Keeps the outcome of the last `window` calls. When at least `min_calls`
+    were made and the failure ratio reaches `threshold`, the circuit opens
+    and calls are rejected for `reset_timeout` seconds. After that a single
+    trial call is let through: success closes the circuit, failure opens it
+    again.
+    """
+
+    def __init__(self, window=20, threshold=0.5, min_calls=5, reset_timeout=30):
+        self.window = window
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self._outcomes = []
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record(self, success):
+        with self._lock:
+            if self._trial_in_flight:
+                self._trial_in_flight = False
+                if success:
+                    self._opened_at = None
+                    self._outcomes = []
+                else:
+                    self._opened_at = time.monotonic()
+                return
+
+            self._outcomes.append(success)
+            if len(self._outcomes) > self.window:
+                self._outcomes.pop(0)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.threshold:
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "recent_calls": len(self._outcomes),
+            "recent_failures": self._outcomes.count(False)
+        }
+
+
+breaker = CircuitBreaker(
+    window=int(os.environ.get('BMO_GEMINI_BREAKER_WINDOW', 20)),
+    threshold=float(os.environ.get('BMO_GEMINI_BREAKER_THRESHOLD', 0.5)),
+    reset_timeout=float(os.environ.get('BMO_GEMINI_BREAKER_RESET', 30))
+)
+
+
+def _is_upstream_failure(error):
+    """Network errors, timeouts, 429 and 5xx count against the breaker; 4xx do not."""
+    response = getattr(error, 'response', None)
+    if response is not None and hasattr(response, 'status_code'):
+        return response.status_code in RETRY_STATUSES
+    if isinstance(error, requests.RequestException):
+        return True
+    # httpx transport errors (async path)
+    return type(error).__module__.startswith('httpx')
+
+def _gemini_request(url_template, prompt, model_name):
+    """URL and JSON body shared by the generateContent and streamGenerateContent calls."""
+    if not GEMINI_API_KEY:
+        raise ValueError("GEMINI_API_KEY not found in environment variables.")
+    url = url_template.format(model_name=model_name, api_key=GEMINI_API_KEY)
+    return url, {"contents": [{"parts": [{"text": prompt}]}]}
 
 @monitor_gemini_usage()
 def _raw_gemini_call(prompt, model_name="gemini-1.5-flash"):
@@ -12,46 +349,645 @@ def _raw_gemini_call(prompt, model_name="gemini-1.5-flash"):
     Internal function to make the raw API call.
     Returns the JSON response (dict).
     """
-    if not GEMINI_API_KEY:
-        raise ValueError("GEMINI_API_KEY not found in environment variables.")
-
-    url = GEMINI_API_URL.format(model_name=model_name, api_key=GEMINI_API_KEY)
-    headers = {'Content-Type': 'application/json'}
-    data = {
-        "contents": [{"parts": [{"text": prompt}]}]
-    }
-    
-    response = requests.post(url, headers=headers, json=data)
+    url, data = _gemini_request(GEMINI_API_URL, prompt, model_name)
+    response = get_session().post(url, json=data, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
     response.raise_for_status()
     return response.json()
 
-def call_gemini(prompt, model_name="gemini-1.5-flash"):
+_async_client = None
+
+
+def get_async_client():
+    """Shared httpx.AsyncClient for the ASGI server; httpx is only needed there."""
+    global _async_client
+    if _async_client is None:
+        import httpx
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=4),
+            transport=httpx.AsyncHTTPTransport(retries=MAX_RETRIES)  # connect errors only
+        )
+    return _async_client
+
+
+def _retry_delay(response, attempt):
+    """Retry-After (capped) if the server sent one, otherwise exponential backoff."""
+    retry_after = response.headers.get('Retry-After')
+    if retry_after:
+        try:
+            return min(float(retry_after), MAX_RETRY_AFTER)
+        except ValueError:
+            pass
+    return BACKOFF_FACTOR * (2 ** attempt)
+
+
+async def _post_async(url, data):
     """
-    Public function to call Gemini and get text response.
+    POST over httpx with get_session()'s retry policy for statuses. Returns
+    the response unread, so it can be streamed; the caller must close it.
+    """
+    client = get_async_client()
+    for attempt in range(MAX_RETRIES + 1):
+        response = await client.send(client.build_request('POST', url, json=data), stream=True)
+        if response.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+            await response.aclose()
+            await asyncio.sleep(_retry_delay(response, attempt))
+            continue
+        if response.is_error:
+            await response.aclose()
+            response.raise_for_status()
+        return response
+
+
+@monitor_gemini_usage()
+async def _raw_gemini_call_async(prompt, model_name="gemini-1.5-flash"):
+    """_raw_gemini_call over httpx, with the same retry policy."""
+    response = await _post_async(*_gemini_request(GEMINI_API_URL, prompt, model_name))
+    try:
+        await response.aread()
+    finally:
+        await response.aclose()
+    return response.json()
+
+def _sse_payloads(lines):
+    """JSON objects from the data: lines of a server-sent events body."""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if line.startswith('data:'):
+            yield json.loads(line[5:])
+
+@monitor_gemini_usage()
+def _raw_gemini_stream(prompt, model_name="gemini-1.5-flash"):
+    """
+    streamGenerateContent: yields each partial response (dict) as it arrives.
+    The last one carries the usageMetadata for the whole call.
+    """
+    url, data = _gemini_request(GEMINI_STREAM_URL, prompt, model_name)
+    # READ_TIMEOUT applies between chunks here, not to the whole response
+    with get_session().post(url, json=data, stream=True,
+                            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)) as response:
+        response.raise_for_status()
+        yield from _sse_payloads(response.iter_lines())
+
+@monitor_gemini_usage()
+async def _raw_gemini_stream_async(prompt, model_name="gemini-1.5-flash"):
+    """_raw_gemini_stream over httpx; retries like _raw_gemini_call_async until the stream starts."""
+    response = await _post_async(*_gemini_request(GEMINI_STREAM_URL, prompt, model_name))
+    try:
+        async for line in response.aiter_lines():
+            for payload in _sse_payloads([line]):
+                yield payload
+    finally:
+        await response.aclose()
+
+def _admit(breaker, model_name, name):
+    """Raises instead of calling out when the budget is used up or the circuit is open."""
+    # Looked up on the module: multi-worker mode swaps in a shared view
+    reason = token_monitor.budget.check(model_name)
+    if reason:
+        raise BudgetExhausted(reason)
+    if not breaker.allow():
+        raise GeminiUnavailable(f"{name} circuit is open")
+
+@contextmanager
+def _recorded(breaker):
+    """
+    Records the outcome of the wrapped call on `breaker`. Only upstream
+    failures count against it; a stream the caller closed early counts as
+    a success.
     """
     try:
+        yield
+    except GeneratorExit:
+        breaker.record(True)
+        raise
+    except Exception as e:
+        breaker.record(not _is_upstream_failure(e))
+        raise
+    breaker.record(True)
+
+def _guarded_gemini_call(prompt, model_name):
+    """_raw_gemini_call behind the token budget and the circuit breaker."""
+    _admit(breaker, model_name, "Gemini")
+    with _recorded(breaker), metrics.track('gemini', 'generate_content'):
+        return _raw_gemini_call(prompt, model_name=model_name)
+
+async def _guarded_gemini_call_async(prompt, model_name):
+    _admit(breaker, model_name, "Gemini")
+    with _recorded(breaker), metrics.track('gemini', 'generate_content'):
+        return await _raw_gemini_call_async(prompt, model_name=model_name)
+
+def _guarded_gemini_stream(prompt, model_name):
+    """_raw_gemini_stream behind the budget and breaker; yields text pieces."""
+    _admit(breaker, model_name, "Gemini")
+    with _recorded(breaker), metrics.track('gemini', 'stream_generate_content'):
+        for chunk in _raw_gemini_stream(prompt, model_name=model_name):
+            text = _chunk_text(chunk)
+            if text:
+                yield text
+
+async def _guarded_gemini_stream_async(prompt, model_name):
+    _admit(breaker, model_name, "Gemini")
+    with _recorded(breaker), metrics.track('gemini', 'stream_generate_content'):
+        async for chunk in _raw_gemini_stream_async(prompt, model_name=model_name):
+            text = _chunk_text(chunk)
+            if text:
+                yield text
+
+def _chunk_text(chunk):
+    """Text of one streamed partial response; empty for usage-only or malformed chunks."""
+    try:
+        return ''.join(part.get('text', '') for part in chunk['candidates'][0]['content']['parts'])
+    except (KeyError, IndexError, TypeError):
+        return ''
+
+def _extract_text(result):
+    try:
+        candidates = result.get('candidates', [])
+        if candidates:
+            return candidates[0]['content']['parts'][0]['text']
+        else:
+            return "No response generated."
+    except (KeyError, IndexError):
+        return "Error parsing response structure."
+
+def call_gemini(prompt, model_name="gemini-1.5-flash", use_cache=True):
+    """
+    Public function to call Gemini and get text response.
+    Identical prompts are answered from the response cache, and concurrent
+    identical prompts share one HTTP call; only real calls are logged by
+    monitor_gemini_usage.
+    Raises GeminiUnavailable while the circuit breaker is open, so callers
+    can fall back to canned messages without waiting on the network.
+    """
+    def load():
         # Call the decorated function
-        result = _raw_gemini_call(prompt, model_name=model_name)
-        
-        # Extract response text
-        try:
-            candidates = result.get('candidates', [])
-            if candidates:
-                return candidates[0]['content']['parts'][0]['text']
-            else:
-                return "No response generated."
-        except (KeyError, IndexError):
-            return "Error parsing response structure."
-            
+        return _extract_text(_guarded_gemini_call(prompt, model_name))
+
+    try:
+        if not use_cache:
+            return load()
+        return _response_cache.get_or_load((model_name, _normalize_prompt(prompt)), load)
+    except GeminiUnavailable:
+        raise
     except Exception as e:
         print(f"Error calling Gemini API: {e}")
         return f"Error calling Gemini API: {e}"
 
-def call_ollama(prompt, model_name="llama3"):
+async def call_gemini_async(prompt, model_name="gemini-1.5-flash", use_cache=True):
+    """call_gemini for asyncio code; shares the cache, breaker and usage logging."""
+    async def load():
+        return _extract_text(await _guarded_gemini_call_async(prompt, model_name))
+
+    try:
+        if not use_cache:
+            return await load()
+        return await _response_cache.get_or_load_async((model_name, _normalize_prompt(prompt)), load)
+    except GeminiUnavailable:
+        raise
+    except Exception as e:
+        print(f"Error calling Gemini API: {e}")
+        return f"Error calling Gemini API: {e}"
+
+def _cached_stream(key, open_stream):
+    """
+    Streams open_stream() through the response cache. The first caller for
+    a key streams from the backend and caches the text once the stream
+    completes; concurrent callers for the same key wait for it and get the
+    whole text as one piece. A stream that fails or is closed early caches
+    nothing, and the waiters start over.
+    """
+    while True:
+        hit, value, leader = _response_cache.claim(key)
+        if hit:
+            yield value
+            return
+        future = value
+        if not leader:
+            value = _response_cache.wait(future)
+            if value is None:
+                continue
+            if value:
+                yield value
+            return
+        pieces = []
+        try:
+            for text in open_stream():
+                pieces.append(text)
+                yield text
+        except BaseException as e:
+            _response_cache.finish(key, future, error=e)
+            raise
+        _response_cache.finish(key, future, ''.join(pieces))
+        return
+
+async def _cached_stream_async(key, open_stream):
+    """_cached_stream for async generators."""
+    while True:
+        hit, value, leader = _response_cache.claim(key)
+        if hit:
+            yield value
+            return
+        future = value
+        if not leader:
+            value = await _response_cache.wait_async(future)
+            if value is None:
+                continue
+            if value:
+                yield value
+            return
+        pieces = []
+        try:
+            async for text in open_stream():
+                pieces.append(text)
+                yield text
+        except BaseException as e:
+            _response_cache.finish(key, future, error=e)
+            raise
+        _response_cache.finish(key, future, ''.join(pieces))
+        return
+
+def stream_gemini(prompt, model_name="gemini-1.5-flash", use_cache=True):
     """
-    Calls Ollama API (mock implementation).
-    Does NOT log token usage to the token_usage table.
+    Like call_gemini, but yields the answer in pieces as Gemini produces them.
+    A cached answer comes back as a single piece, and a completed stream
+    is cached for call_gemini too. Unlike call_gemini, errors are raised
+    (GeminiUnavailable before the first piece, anything else at any point)
+    so the caller can decide what to show.
     """
-    print(f"Calling Ollama with model {model_name}...")
-    # Simulate response
-    return f"Response from Ollama ({model_name}): {prompt}"
+    if not use_cache:
+        return _guarded_gemini_stream(prompt, model_name)
+    return _cached_stream((model_name, _normalize_prompt(prompt)),
+                          lambda: _guarded_gemini_stream(prompt, model_name))
+
+def stream_gemini_async(prompt, model_name="gemini-1.5-flash", use_cache=True):
+    """stream_gemini for asyncio code."""
+    if not use_cache:
+        return _guarded_gemini_stream_async(prompt, model_name)
+    return _cached_stream_async((model_name, _normalize_prompt(prompt)),
+                                lambda: _guarded_gemini_stream_async(prompt, model_name))
+
+def _ollama_payload(prompt, model_name, stream):
+    return {"model": model_name, "prompt": prompt, "stream": stream}
+
+_ollama_session = None
+
+
+def get_ollama_session():
+    """
+    requests.Session for the local Ollama server. Unlike get_session() it
+    never retries: a failed Ollama call falls back to Gemini through the
+    router, which beats backing off and trying the local server again.
+    """
+    global _ollama_session
+    if _ollama_session is None:
+        with _session_lock:
+            if _ollama_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OLLAMA_MAX_CONCURRENCY, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _ollama_session = session
+    return _ollama_session
+
+_ollama_async_client = None
+
+
+def get_ollama_async_client():
+    """get_ollama_session() for the ASGI server."""
+    global _ollama_async_client
+    if _ollama_async_client is None:
+        import httpx
+        _ollama_async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=OLLAMA_MAX_CONCURRENCY, max_keepalive_connections=1)
+        )
+    return _ollama_async_client
+
+
+async def close_async_clients():
+    """Closes the httpx clients that have been created; for server shutdown."""
+    global _async_client, _ollama_async_client
+    for client in (_async_client, _ollama_async_client):
+        if client is not None:
+            await client.aclose()
+    _async_client = _ollama_async_client = None
+
+@monitor_model_usage(OLLAMA_MODEL)
+def _raw_ollama_call(prompt, model_name=OLLAMA_MODEL):
+    """POST /api/generate on the local Ollama server; returns the JSON response (dict)."""
+    response = get_ollama_session().post(OLLAMA_URL + "/api/generate", json=_ollama_payload(prompt, model_name, False),
+                                         timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT))
+    response.raise_for_status()
+    return response.json()
+
+@monitor_model_usage(OLLAMA_MODEL)
+def _raw_ollama_stream(prompt, model_name=OLLAMA_MODEL):
+    """Streaming /api/generate: yields one dict per NDJSON line; the last has done=true and the counts."""
+    with get_ollama_session().post(OLLAMA_URL + "/api/generate", json=_ollama_payload(prompt, model_name, True),
+                                   stream=True, timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT)) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
+@monitor_model_usage(OLLAMA_MODEL)
+async def _raw_ollama_call_async(prompt, model_name=OLLAMA_MODEL):
+    response = await get_ollama_async_client().post(OLLAMA_URL + "/api/generate",
+                                                    json=_ollama_payload(prompt, model_name, False))
+    response.raise_for_status()
+    return response.json()
+
+@monitor_model_usage(OLLAMA_MODEL)
+async def _raw_ollama_stream_async(prompt, model_name=OLLAMA_MODEL):
+    async with get_ollama_async_client().stream('POST', OLLAMA_URL + "/api/generate",
+                                                json=_ollama_payload(prompt, model_name, True)) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line:
+                yield json.loads(line)
+
+def _ollama_text(result):
+    return result.get('response', '') if isinstance(result, dict) else ''
+
+
+class NoBackendAvailable(GeminiUnavailable):
+    """Raised by the router when every backend is busy, over budget, open or failing."""
+
+
+class Backend:
+    """
+    One model behind the router: its monitored call / stream functions,
+    circuit breaker and concurrency limit, plus live latency estimates
+    (exponentially weighted) for full calls and for the first streamed piece.
+    """
+
+    def __init__(self, name, model_name, call, call_async, stream, stream_async, result_text, chunk_text,
+                 breaker, max_concurrency, weight=1.0, metered=True):
+        self.name = name
+        self.model_name = model_name
+        self._call = call
+        self._call_async = call_async
+        self._stream = stream
+        self._stream_async = stream_async
+        self._result_text = result_text
+        self._chunk_text = chunk_text
+        self.breaker = breaker
+        self.max_concurrency = max_concurrency
+        self.weight = weight
+        self.metered = metered
+        self.latency = {"call": None, "first_piece": None}
+        self._inflight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self._inflight >= self.max_concurrency:
+                return False
+            self._inflight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._inflight -= 1
+
+    def _observe(self, kind, seconds):
+        with self._lock:
+            previous = self.latency[kind]
+            self.latency[kind] = seconds if previous is None else previous + LATENCY_ALPHA * (seconds - previous)
+
+    def estimate(self, kind):
+        """Expected seconds for `kind`, falling back to the other kind; None before the first call."""
+        other = "first_piece" if kind == "call" else "call"
+        return self.latency[kind] if self.latency[kind] is not None else self.latency[other]
+
+    def call(self, prompt):
+        _admit(self.breaker, self.model_name, self.name)
+        started = time.perf_counter()
+        with _recorded(self.breaker), metrics.track(self.name, 'generate_content'):
+            result = self._call(prompt, model_name=self.model_name)
+        self._observe("call", time.perf_counter() - started)
+        return self._result_text(result)
+
+    async def call_async(self, prompt):
+        _admit(self.breaker, self.model_name, self.name)
+        started = time.perf_counter()
+        with _recorded(self.breaker), metrics.track(self.name, 'generate_content'):
+            result = await self._call_async(prompt, model_name=self.model_name)
+        self._observe("call", time.perf_counter() - started)
+        return self._result_text(result)
+
+    def stream(self, prompt):
+        _admit(self.breaker, self.model_name, self.name)
+        started = time.perf_counter()
+        with _recorded(self.breaker), metrics.track(self.name, 'stream_generate_content'):
+            for chunk in self._stream(prompt, model_name=self.model_name):
+                text = self._chunk_text(chunk)
+                if text:
+                    if started is not None:
+                        self._observe("first_piece", time.perf_counter() - started)
+                        started = None
+                    yield text
+
+    async def stream_async(self, prompt):
+        _admit(self.breaker, self.model_name, self.name)
+        started = time.perf_counter()
+        with _recorded(self.breaker), metrics.track(self.name, 'stream_generate_content'):
+            async for chunk in self._stream_async(prompt, model_name=self.model_name):
+                text = self._chunk_text(chunk)
+                if text:
+                    if started is not None:
+                        self._observe("first_piece", time.perf_counter() - started)
+                        started = None
+                    yield text
+
+    def stats(self):
+        return {
+            "model": self.model_name,
+            "inflight": self._inflight,
+            "max_concurrency": self.max_concurrency,
+            "latency": {kind: None if value is None else round(value, 3) for kind, value in self.latency.items()},
+            "circuit": self.breaker.stats(),
+        }
+
+
+class ModelRouter:
+    """
+    Picks a backend per call from live measurements.
+
+    Backends that are over their token budget, have an open circuit or are
+    at their concurrency limit are skipped. The rest are ranked by
+    estimated latency, scaled by their weight (remote calls have to be
+    clearly faster to beat the local model), by their recent failure ratio
+    and, for metered backends, by how close the monthly budget is to its
+    limit. A backend with no measurements yet ranks first, so each gets
+    measured, and a small share of calls goes to a random backend to keep
+    the estimates current. If the chosen backend fails before producing
+    any text, the next one is tried.
+    """
+
+    def __init__(self, backends, explore_rate=EXPLORE_RATE):
+        self.backends = list(backends)
+        self.explore_rate = explore_rate
+
+    def available(self):
+        return bool(self.backends)
+
+    def _score(self, backend, kind, budget):
+        estimate = backend.estimate(kind)
+        if estimate is None:
+            return -1.0
+        circuit = backend.breaker.stats()
+        failure_ratio = circuit["recent_failures"] / circuit["recent_calls"] if circuit["recent_calls"] else 0.0
+        score = estimate * backend.weight * (1 + 2 * failure_ratio)
+        month = budget["windows"]["month"]
+        if backend.metered and month["limit"]:
+            usage = month["used"] / month["limit"]
+            if usage > token_monitor.WARN_RATIO:
+                # Gets steeper as the budget runs out
+                score *= 1 + 10 * (usage - token_monitor.WARN_RATIO) / (1 - token_monitor.WARN_RATIO)
+        return score
+
+    def candidates(self, kind):
+        """Eligible backends, best first."""
+        budget = token_monitor.budget.status()
+        eligible = [b for b in self.backends
+                    if b.breaker.state != "open" and not token_monitor.budget.check(b.model_name)]
+        if len(eligible) > 1 and random.random() < self.explore_rate:
+            random.shuffle(eligible)
+            return eligible
+        return sorted(eligible, key=lambda b: self._score(b, kind, budget))
+
+    def _no_backend(self, errors):
+        detail = "; ".join(f"{name}: {e}" for name, e in errors) or "all backends are busy or unavailable"
+        return NoBackendAvailable(f"No model backend available ({detail})")
+
+    def call(self, prompt):
+        errors = []
+        for backend in self.candidates("call"):
+            if not backend.try_acquire():
+                continue
+            try:
+                return backend.call(prompt)
+            except Exception as e:
+                errors.append((backend.name, e))
+            finally:
+                backend.release()
+        raise self._no_backend(errors)
+
+    async def call_async(self, prompt):
+        errors = []
+        for backend in self.candidates("call"):
+            if not backend.try_acquire():
+                continue
+            try:
+                return await backend.call_async(prompt)
+            except Exception as e:
+                errors.append((backend.name, e))
+            finally:
+                backend.release()
+        raise self._no_backend(errors)
+
+    def stream(self, prompt):
+        errors = []
+        for backend in self.candidates("first_piece"):
+            if not backend.try_acquire():
+                continue
+            try:
+                pieces = backend.stream(prompt)
+                try:
+                    first = next(pieces)
+                except StopIteration:
+                    return
+                except Exception as e:
+                    errors.append((backend.name, e))
+                    continue
+                # Text has been produced; from here on errors go to the caller
+                yield first
+                yield from pieces
+                return
+            finally:
+                backend.release()
+        raise self._no_backend(errors)
+
+    async def stream_async(self, prompt):
+        errors = []
+        for backend in self.candidates("first_piece"):
+            if not backend.try_acquire():
+                continue
+            try:
+                pieces = backend.stream_async(prompt)
+                try:
+                    first = await pieces.__anext__()
+                except StopAsyncIteration:
+                    return
+                except Exception as e:
+                    errors.append((backend.name, e))
+                    continue
+                yield first
+                async for text in pieces:
+                    yield text
+                return
+            finally:
+                backend.release()
+        raise self._no_backend(errors)
+
+    def stats(self):
+        return {backend.name: backend.stats() for backend in self.backends}
+
+
+ollama_breaker = CircuitBreaker(reset_timeout=float(os.environ.get('BMO_OLLAMA_BREAKER_RESET', 30)))
+
+
+def _build_router():
+    backends = []
+    if OLLAMA_URL:
+        backends.append(Backend(
+            'ollama', OLLAMA_MODEL, _raw_ollama_call, _raw_ollama_call_async,
+            _raw_ollama_stream, _raw_ollama_stream_async, _ollama_text, _ollama_text,
+            breaker=ollama_breaker, max_concurrency=OLLAMA_MAX_CONCURRENCY,
+            metered=OLLAMA_MODEL not in token_monitor.UNMETERED_MODELS))
+    if GEMINI_API_KEY:
+        backends.append(Backend(
+            'gemini', ROUTER_GEMINI_MODEL, _raw_gemini_call, _raw_gemini_call_async,
+            _raw_gemini_stream, _raw_gemini_stream_async, _extract_text, _chunk_text,
+            breaker=breaker, max_concurrency=GEMINI_MAX_CONCURRENCY, weight=REMOTE_WEIGHT))
+    return ModelRouter(backends)
+
+
+router = _build_router()
+
+
+def call_model(prompt, use_cache=True):
+    """
+    Answers `prompt` with whichever backend the router picks (see ModelRouter).
+    Cached like call_gemini. Raises GeminiUnavailable (NoBackendAvailable)
+    when no backend could answer, so callers can fall back to canned text.
+    """
+    if not use_cache:
+        return router.call(prompt)
+    return _response_cache.get_or_load(('router', _normalize_prompt(prompt)), lambda: router.call(prompt))
+
+async def call_model_async(prompt, use_cache=True):
+    if not use_cache:
+        return await router.call_async(prompt)
+    return await _response_cache.get_or_load_async(('router', _normalize_prompt(prompt)),
+                                                   lambda: router.call_async(prompt))
+
+def stream_model(prompt, use_cache=True):
+    """call_model, yielding the answer in pieces like stream_gemini."""
+    if not use_cache:
+        return router.stream(prompt)
+    return _cached_stream(('router', _normalize_prompt(prompt)), lambda: router.stream(prompt))
+
+def stream_model_async(prompt, use_cache=True):
+    if not use_cache:
+        return router.stream_async(prompt)
+    return _cached_stream_async(('router', _normalize_prompt(prompt)), lambda: router.stream_async(prompt))
+
+def call_ollama(prompt, model_name=OLLAMA_MODEL):
+    """Calls the local Ollama server directly, bypassing the router. Usage is logged like Gemini's."""
+    if not OLLAMA_URL:
+        raise ValueError("BMO_OLLAMA_URL is not set.")
+    return _ollama_text(_raw_ollama_call(prompt, model_name=model_name))
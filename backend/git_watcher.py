@@ -0,0 +1,258 @@
+import os
+import re
+import asyncio
+import datetime
+import subprocess
+import threading
+import metrics
+
+COMPLETE_RE = re.compile(r'#complete\s+(\d+)', re.IGNORECASE)
+
+# How many commits to look at the very first time (no SHA stored yet)
+INITIAL_SCAN_DEPTH = 10
+STATE_KEY = 'git_last_sha'
+
+
+class GitWatcher:
+    """
+    Watches the repository for new commits and applies #complete <id> markers.
+
+    The last processed commit SHA is persisted in the database, so only
+    commits added since then are examined. HEAD is resolved by reading the
+    files under .git directly, which means polling is cheap and git is only
+    forked when the ref actually moved.
+    """
+
+    def __init__(self, repo_path, connection, interval=5.0, on_complete=None):
+        self.repo_path = repo_path
+        self.git_dir = self._find_git_dir(repo_path)
+        self.connection = connection
+        self.interval = interval
+        self.on_complete = on_complete
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_mtimes = None
+
+    # --- ref resolution -------------------------------------------------
+
+    @staticmethod
+    def _find_git_dir(repo_path):
+        git_dir = os.path.join(repo_path, '.git')
+        if os.path.isfile(git_dir):
+            # Worktrees and submodules use a "gitdir: <path>" pointer file
+            with open(git_dir, 'r') as f:
+                content = f.read().strip()
+            if content.startswith('gitdir: '):
+                git_dir = os.path.join(repo_path, content[8:])
+        return git_dir
+
+    def _ref_files(self):
+        """Files whose change means HEAD may point somewhere else."""
+        files = [os.path.join(self.git_dir, 'HEAD'), os.path.join(self.git_dir, 'packed-refs')]
+        ref = self._head_ref()
+        if ref:
+            files.append(os.path.join(self.git_dir, ref))
+        return files
+
+    def _head_ref(self):
+        try:
+            with open(os.path.join(self.git_dir, 'HEAD'), 'r') as f:
+                head = f.read().strip()
+        except OSError:
+            return None
+        if head.startswith('ref: '):
+            return head[5:]
+        return None
+
+    def _refs_mtimes(self):
+        mtimes = []
+        for path in self._ref_files():
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def resolve_head(self):
+        """Returns the SHA HEAD points to, without forking git."""
+        try:
+            with open(os.path.join(self.git_dir, 'HEAD'), 'r') as f:
+                head = f.read().strip()
+        except OSError:
+            return None
+
+        if not head.startswith('ref: '):
+            return head or None
+
+        ref = head[5:]
+        try:
+            with open(os.path.join(self.git_dir, ref), 'r') as f:
+                return f.read().strip() or None
+        except OSError:
+            pass
+
+        # Ref may only live in packed-refs (after git gc)
+        try:
+            with open(os.path.join(self.git_dir, 'packed-refs'), 'r') as f:
+                for line in f:
+                    if line.startswith('#') or line.startswith('^'):
+                        continue
+                    parts = line.strip().split(' ', 1)
+                    if len(parts) == 2 and parts[1] == ref:
+                        return parts[0]
+        except OSError:
+            pass
+        return None
+
+    # --- state ----------------------------------------------------------
+
+    def _load_last_sha(self, conn):
+        row = conn.execute('SELECT value FROM git_watch_state WHERE key = ?', (STATE_KEY,)).fetchone()
+        return row[0] if row else None
+
+    def _save_last_sha(self, conn, sha):
+        conn.execute('''
+            INSERT INTO git_watch_state (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        ''', (STATE_KEY, sha))
+
+    # --- scanning -------------------------------------------------------
+
+    @staticmethod
+    def _log_args(last_sha, head_sha):
+        if last_sha:
+            return ['git', 'log', '--pretty=format:%B%x00', f'{last_sha}..{head_sha}']
+        return ['git', 'log', '-n', str(INITIAL_SCAN_DEPTH), '--pretty=format:%B%x00', head_sha]
+
+    def _commit_messages(self, last_sha, head_sha):
+        """Returns commit messages in last_sha..head_sha (or the initial window)."""
+        args = self._log_args(last_sha, head_sha)
+        try:
+            with metrics.track('subprocess', 'git_log'):
+                output = subprocess.check_output(args, cwd=self.repo_path, stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError:
+            if not last_sha:
+                raise
+            # Stored SHA no longer exists (history rewritten); rescan from scratch
+            return self._commit_messages(None, head_sha)
+        return output.decode('utf-8', errors='replace')
+
+    async def _commit_messages_async(self, last_sha, head_sha):
+        """_commit_messages using an asyncio subprocess."""
+        args = self._log_args(last_sha, head_sha)
+        with metrics.track('subprocess', 'git_log'):
+            proc = await asyncio.create_subprocess_exec(
+                *args, cwd=self.repo_path,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+            )
+            output, _ = await proc.communicate()
+        if proc.returncode != 0:
+            if not last_sha:
+                raise subprocess.CalledProcessError(proc.returncode, args, output)
+            return await self._commit_messages_async(None, head_sha)
+        return output.decode('utf-8', errors='replace')
+
+    def _refs_changed(self):
+        """
+        The current ref mtimes if any ref file moved since the last completed
+        poll, else None. The caller stores them in _last_mtimes only once the
+        new commits have been applied, so a failed poll is retried next time.
+        """
+        mtimes = self._refs_mtimes()
+        if self._last_mtimes is not None and mtimes == self._last_mtimes:
+            return None
+        return mtimes
+
+    def _read_last_sha(self):
+        with self.connection() as conn:
+            return self._load_last_sha(conn)
+
+    def _apply(self, output, head_sha):
+        """Marks activities from #complete markers in `output` and stores head_sha."""
+        ids = sorted({int(m) for m in COMPLETE_RE.findall(output)})
+
+        completed = []
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self.connection() as conn:
+            for activity_id in ids:
+                cursor = conn.execute('''
+                    UPDATE activities
+                    SET status = 'Completed', last_updated = ?
+                    WHERE id = ? AND status != 'Completed'
+                ''', (now, activity_id))
+                if cursor.rowcount:
+                    completed.append(activity_id)
+
+            self._save_last_sha(conn, head_sha)
+
+        if completed and self.on_complete:
+            self.on_complete(completed)
+        return completed
+
+    def poll(self, force=False):
+        """
+        Processes any commits added since the last run.
+        Returns the list of activity ids that were marked completed.
+        """
+        with self._lock:
+            mtimes = self._refs_changed()
+            if mtimes is None:
+                if not force:
+                    return []
+                mtimes = self._refs_mtimes()
+            completed = []
+            head_sha = self.resolve_head()
+            if head_sha:
+                last_sha = self._read_last_sha()
+                if last_sha != head_sha:
+                    completed = self._apply(self._commit_messages(last_sha, head_sha), head_sha)
+            self._last_mtimes = mtimes
+            return completed
+
+    async def poll_async(self):
+        """poll() for an asyncio loop: git runs as an asyncio subprocess, sqlite in the executor."""
+        mtimes = self._refs_changed()
+        if mtimes is None:
+            return []
+        completed = []
+        head_sha = self.resolve_head()
+        if head_sha:
+            loop = asyncio.get_running_loop()
+            last_sha = await loop.run_in_executor(None, self._read_last_sha)
+            if last_sha != head_sha:
+                output = await self._commit_messages_async(last_sha, head_sha)
+                completed = await loop.run_in_executor(None, self._apply, output, head_sha)
+        self._last_mtimes = mtimes
+        return completed
+
+    # --- background loop ------------------------------------------------
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Git automation error: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='git-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
+
+    async def run_async(self):
+        """Background loop for asyncio servers, replacing the thread."""
+        while True:
+            try:
+                await self.poll_async()
+            except Exception as e:
+                print(f"Git automation error: {e}")
+            await asyncio.sleep(self.interval)
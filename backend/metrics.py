@@ -0,0 +1,206 @@
+import time
+import bisect
+import threading
+import contextlib
+
+# Upper bounds in seconds; anything slower lands in the +Inf bucket
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram.
+
+    observe() is a bisect plus three additions under an uncontended lock,
+    so it is cheap enough to wrap every request and external call.
+    """
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count', 'errors', '_lock')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, error=False):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += seconds
+            self.count += 1
+            if error:
+                self.errors += 1
+
+    def read(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count, self.errors
+
+    def quantile(self, q, counts=None, count=None):
+        """Estimate by linear interpolation inside the bucket holding the q-th observation."""
+        if counts is None:
+            counts, _, count, _ = self.read()
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        for i, n in enumerate(counts):
+            if cumulative + n >= rank and n:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / n
+            cumulative += n
+        return self.buckets[-1]
+
+
+class Registry:
+    """Histograms keyed by (family, labels). Families are fixed: requests and dependencies."""
+
+    # family -> (metric name, label names, help text, key in snapshot())
+    FAMILIES = {
+        'request': ('bmo_request_duration_seconds', ('route', 'method', 'status'),
+                    'HTTP handler latency by route', 'requests'),
+        'dependency': ('bmo_dependency_duration_seconds', ('dependency', 'operation'),
+                       'Latency of calls to SQLite, subprocesses, CalDAV and Gemini', 'dependencies'),
+    }
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def histogram(self, family, labels):
+        key = (family, labels)
+        hist = self._histograms.get(key)
+        if hist is None:
+            with self._lock:
+                hist = self._histograms.setdefault(key, Histogram())
+        return hist
+
+    def items(self, family):
+        with self._lock:
+            entries = [(labels, hist) for (fam, labels), hist in self._histograms.items() if fam == family]
+        return sorted(entries, key=lambda entry: entry[0])
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+        self.started_at = time.time()
+
+
+registry = Registry()
+
+# phase -> seconds, set once per process (see app.create_app)
+startup = {}
+
+
+def observe_request(route, method, status, seconds):
+    registry.histogram('request', (route, method, str(status))).observe(seconds, error=status >= 500)
+
+
+def observe_dependency(dependency, operation, seconds, error=False):
+    registry.histogram('dependency', (dependency, operation)).observe(seconds, error=error)
+
+
+@contextlib.contextmanager
+def track(dependency, operation):
+    """Times the block as one call to `dependency`; an exception counts as an error."""
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except GeneratorExit:
+        # A streaming caller stopped reading; not the dependency's fault
+        raise
+    except BaseException:
+        error = True
+        raise
+    finally:
+        observe_dependency(dependency, operation, time.perf_counter() - start, error)
+
+
+def record_startup(phase, seconds):
+    startup[phase] = seconds
+
+
+@contextlib.contextmanager
+def startup_phase(phase):
+    """Times the block as one startup phase, whether or not it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup(phase, time.perf_counter() - start)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}'
+
+
+def render_prometheus():
+    """All histograms in the Prometheus text exposition format (0.0.4)."""
+    lines = []
+    for family, (metric, label_names, help_text, _) in Registry.FAMILIES.items():
+        entries = registry.items(family)
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} histogram')
+        errors = []
+        for labels, hist in entries:
+            counts, total, count, error_count = hist.read()
+            cumulative = 0
+            for bound, n in zip(hist.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                le_label = f'le="{le}"'
+                lines.append(f'{metric}_bucket{_format_labels(label_names, labels, le_label)} {cumulative}')
+            lines.append(f'{metric}_sum{_format_labels(label_names, labels)} {total}')
+            lines.append(f'{metric}_count{_format_labels(label_names, labels)} {count}')
+            errors.append((labels, error_count))
+        error_metric = metric.replace('_duration_seconds', '_errors_total')
+        lines.append(f'# HELP {error_metric} Failed calls (exceptions or 5xx responses)')
+        lines.append(f'# TYPE {error_metric} counter')
+        for labels, error_count in errors:
+            lines.append(f'{error_metric}{_format_labels(label_names, labels)} {error_count}')
+    lines.append('# HELP bmo_startup_seconds Time spent in each startup phase of this process')
+    lines.append('# TYPE bmo_startup_seconds gauge')
+    for phase, seconds in sorted(startup.items()):
+        lines.append(f'bmo_startup_seconds{_format_labels(("phase",), (phase,))} {seconds}')
+    return '\n'.join(lines) + '\n'
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def snapshot():
+    """Compact summary for the dashboard: counts, errors, mean and p50/p95/p99 in ms."""
+    result = {
+        "uptime_seconds": round(time.time() - registry.started_at, 1),
+        "startup_ms": {phase: _ms(seconds) for phase, seconds in startup.items()},
+    }
+    for family, (_, label_names, _, key) in Registry.FAMILIES.items():
+        rows = []
+        for labels, hist in registry.items(family):
+            counts, total, count, errors = hist.read()
+            row = dict(zip(label_names, labels))
+            row.update({
+                "count": count,
+                "errors": errors,
+                "avg_ms": _ms(total / count) if count else None,
+                "p50_ms": _ms(hist.quantile(0.5, counts, count)),
+                "p95_ms": _ms(hist.quantile(0.95, counts, count)),
+                "p99_ms": _ms(hist.quantile(0.99, counts, count)),
+            })
+            rows.append(row)
+        result[key] = rows
+    return result
@@ -1,61 +1,92 @@
-import sqlite3
-import json
+"""
+Imports and exports activities.
+
+    python migrate.py import tasks.json [--db PATH] [--keep-duplicates]
+    python migrate.py import activities.ndjson
+    python migrate.py export [--out activities.ndjson] [--status Completed] [--db PATH]
+
+Input is either the old tasks.json (a JSON array, with ToDo / In Progress /
+Done statuses) or NDJSON as produced by export. The whole import runs in
+one transaction and skips titles that are already in the database.
+"""
 import os
-import datetime
-
-DB_PATH = '/home/god/.openclaw/workspace/dashboard-v3/backend/bmo_dashboard.db'
-TASKS_JSON = '/home/god/.openclaw/workspace/dashboard-v3/tasks.json'
-
-def migrate():
-    print("Starting migration...")
-    
-    # Connect to (or create) the database
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Create the table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS activities (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        description TEXT,
-        status TEXT CHECK(status IN ('Pending', 'Active', 'Completed')) NOT NULL DEFAULT 'Pending',
-        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    # Map old statuses to new ones if necessary
-    status_map = {
-        "ToDo": "Pending",
-        "In Progress": "Active",
-        "Done": "Completed"
-    }
-
-    # Load tasks from JSON
-    if os.path.exists(TASKS_JSON):
-        with open(TASKS_JSON, 'r') as f:
-            tasks = json.load(f)
-            
-        for task in tasks:
-            # Check if task already exists by title to avoid duplicates during multiple runs
-            cursor.execute("SELECT id FROM activities WHERE title = ?", (task['title'],))
-            if cursor.fetchone():
-                print(f"Skipping duplicate: {task['title']}")
-                continue
-                
-            status = status_map.get(task['status'], 'Pending')
-            
-            cursor.execute('''
-            INSERT INTO activities (title, description, status, last_updated)
-            VALUES (?, ?, ?, ?)
-            ''', (task['title'], task['description'], status, task['last_updated']))
-            print(f"Migrated: {task['title']}")
-    else:
-        print("tasks.json not found, nothing to migrate.")
-
-    conn.commit()
-    conn.close()
-    print("Migration finished.")
+import sys
+import json
+import time
+import argparse
+
+
+def _records(path):
+    """(line_number, dict) pairs from a JSON array file or an NDJSON file."""
+    import activities_io
+    with open(path, 'r', encoding='utf-8') as f:
+        first = f.read(1)
+        while first and first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == '[':
+            # Legacy tasks.json; "line" is the position in the array
+            yield from enumerate(json.load(f), 1)
+        else:
+            yield from activities_io.parse_ndjson(f)
+
+
+def run_import(args):
+    import db
+    import activities_io
+    if not os.path.exists(args.file):
+        print(f"{args.file} not found, nothing to migrate.")
+        return 1
+
+    db.init_db()
+    started = time.perf_counter()
+    try:
+        with db.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            result = activities_io.import_activities(conn, _records(args.file),
+                                                     skip_existing=not args.keep_duplicates)
+    except activities_io.InvalidRecord as e:
+        print(f"Import aborted, nothing was written: {e}")
+        return 1
+    print(f"Imported {result['inserted']} activities, skipped {result['skipped']} existing titles "
+          f"in {time.perf_counter() - started:.2f}s.")
+    return 0
+
+
+def run_export(args):
+    import db
+    import activities_io
+    out = open(args.out, 'w', encoding='utf-8') if args.out else sys.stdout
+    try:
+        with db.connection() as conn:
+            for chunk in activities_io.export_activities(conn, status=args.status):
+                out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import or export dashboard activities.")
+    parser.add_argument('--db', help="Database file (default: BMO_DB_PATH or backend/bmo_dashboard.db)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_import = sub.add_parser('import', help="Load a tasks.json or NDJSON file")
+    p_import.add_argument('file')
+    p_import.add_argument('--keep-duplicates', action='store_true',
+                          help="Insert records whose title already exists")
+    p_export = sub.add_parser('export', help="Write all activities as NDJSON")
+    p_export.add_argument('--out', help="Output file (default: stdout)")
+    p_export.add_argument('--status', choices=['Pending', 'Active', 'Completed'])
+    args = parser.parse_args(argv)
+
+    if args.db:
+        # db reads BMO_DB_PATH at import time
+        os.environ['BMO_DB_PATH'] = os.path.abspath(args.db)
+    if args.command == 'import':
+        return run_import(args)
+    return run_export(args)
+
 
 if __name__ == "__main__":
-    migrate()
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+Per-process CPU and memory, for GET /api/processes.
+
+One background thread walks the process table every `interval` seconds
+and keeps per-PID state between ticks. CPU percent is worked out from the
+change in each process's CPU time over the tick, the way top does it: 100
+is one full core. On Linux a process costs one read of /proc/<pid>/stat
+per tick, which holds CPU time, RSS and the start time that tells a reused
+PID apart; elsewhere psutil.process_iter() is used, which keeps its
+Process handles between calls. Names and command lines are only read
+(once per process) for the top `top` processes by CPU and by RSS, which
+are picked with a heap. Any process that has been in either list within
+the last `history` ticks gets a short history of samples.
+
+Every tick also reports its own cost: wall time, the CPU time of the
+sampler thread, and how many handles were opened and dropped.
+"""
+import os
+import time
+import heapq
+import threading
+from collections import deque
+import metrics
+
+# Processes that left the top lists keep their history for this many ticks
+DEFAULT_HISTORY = 60
+PROCFS = os.path.exists('/proc/self/stat')
+
+
+def _procfs_rows():
+    """(pid, start time, CPU seconds, RSS bytes) per process, one /proc/<pid>/stat read each."""
+    clock_ticks = os.sysconf('SC_CLK_TCK')
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat', 'rb') as f:
+                data = f.read()
+        except OSError:
+            # Exited since the listing, or not ours to read
+            continue
+        # The command name in parentheses may itself contain spaces and ')'
+        fields = data[data.rindex(b')') + 2:].split()
+        # utime, stime, starttime and rss are fields 14, 15, 22 and 24 of stat(5)
+        yield (int(name), int(fields[19]), (int(fields[11]) + int(fields[12])) / clock_ticks,
+               int(fields[21]) * page_size)
+
+
+def _psutil_rows():
+    """_procfs_rows() for platforms without procfs."""
+    import psutil
+    for proc in psutil.process_iter(['create_time', 'cpu_times', 'memory_info']):
+        info = proc.info
+        # Attributes we may not read come back as None
+        if info['cpu_times'] is None or info['memory_info'] is None:
+            continue
+        yield (proc.pid, info['create_time'], info['cpu_times'].user + info['cpu_times'].system,
+               info['memory_info'].rss)
+
+
+class _Tracked:
+    """What the sampler remembers about one process between ticks."""
+
+    __slots__ = ('start', 'cpu_time', 'name', 'cmdline', 'history', 'last_top')
+
+    def __init__(self, start, cpu_time):
+        self.start = start
+        self.cpu_time = cpu_time
+        self.name = None
+        self.cmdline = None
+        self.history = None
+        self.last_top = None
+
+
+class ProcessSampler:
+    """Top processes by CPU and RSS, sampled on a fixed interval in one thread."""
+
+    def __init__(self, interval=5.0, top=10, history=DEFAULT_HISTORY):
+        self.interval = interval
+        self.top = top
+        self.history = history
+        self._tracked = {}
+        self._tick = 0
+        self._prev_time = None
+        self._latest = None
+        self._stop = threading.Event()
+        # sample() runs on the sampler thread and, before the first tick, on request threads
+        self._sample_lock = threading.Lock()
+        self._thread = None
+
+    def _describe(self, pid, entry):
+        if entry.name is None:
+            import psutil
+            try:
+                proc = psutil.Process(pid)
+                entry.name = proc.name()
+                entry.cmdline = ' '.join(proc.cmdline())[:200]
+            except Exception:
+                entry.name, entry.cmdline = '?', ''
+        return entry.name, entry.cmdline
+
+    def _row(self, pid, cpu, rss):
+        entry = self._tracked[pid]
+        name, cmdline = self._describe(pid, entry)
+        return {"pid": pid, "name": name, "cmdline": cmdline, "cpu": round(cpu, 1), "rss": rss}
+
+    def sample(self):
+        with self._sample_lock:
+            return self._sample()
+
+    def _sample(self):
+        started = time.perf_counter()
+        started_cpu = time.thread_time()
+        now = time.time()
+        elapsed = now - self._prev_time if self._prev_time else None
+        opened = dropped = 0
+
+        with metrics.track('process', 'sample'):
+            # (pid, cpu percent, rss) for every process we could read
+            rows = []
+            seen = set()
+            for pid, start, cpu_time, rss in (_procfs_rows() if PROCFS else _psutil_rows()):
+                seen.add(pid)
+                entry = self._tracked.get(pid)
+                if entry is None or entry.start != start:
+                    # New process, or a new one that got a finished process's PID
+                    self._tracked[pid] = _Tracked(start, cpu_time)
+                    opened += 1
+                    rows.append((pid, 0.0, rss))
+                    continue
+                cpu = (cpu_time - entry.cpu_time) / elapsed * 100 if elapsed else 0.0
+                entry.cpu_time = cpu_time
+                rows.append((pid, cpu, rss))
+            for pid in [pid for pid in self._tracked if pid not in seen]:
+                del self._tracked[pid]
+                dropped += 1
+
+        self._tick += 1
+        self._prev_time = now
+        top_cpu = heapq.nlargest(self.top, rows, key=lambda row: row[1])
+        top_rss = heapq.nlargest(self.top, rows, key=lambda row: row[2])
+
+        for pid, _, _ in top_cpu + top_rss:
+            entry = self._tracked[pid]
+            entry.last_top = self._tick
+            if entry.history is None:
+                entry.history = deque(maxlen=self.history)
+        top_cpu = [self._row(*row) for row in top_cpu]
+        top_rss = [self._row(*row) for row in top_rss]
+
+        history = {}
+        for pid, cpu, rss in rows:
+            entry = self._tracked[pid]
+            if entry.history is None:
+                continue
+            if self._tick - entry.last_top > self.history:
+                entry.history = None
+                continue
+            entry.history.append((now, round(cpu, 1), rss))
+            history[str(pid)] = {"name": entry.name, "points": list(entry.history)}
+
+        self._latest = {
+            "sampled_at": now,
+            "interval": self.interval,
+            "count": len(rows),
+            "top_cpu": top_cpu,
+            "top_rss": top_rss,
+            "history": history,
+            "sampler": {
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                "cpu_ms": round((time.thread_time() - started_cpu) * 1000, 2),
+                "tracked": len(self._tracked),
+                "opened": opened,
+                "dropped": dropped,
+            },
+        }
+        return self._latest
+
+    def latest(self):
+        """Most recent sample; takes one synchronously if the thread has not run yet."""
+        if self._latest is None:
+            with self._sample_lock:
+                # The sampler thread may have taken it while we waited
+                if self._latest is None:
+                    return self._sample()
+        return self._latest
+
+    def state(self):
+        """The latest sample or None, for publishing to other processes."""
+        return self._latest
+
+    def _run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Process sampler error: {e}")
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='process-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
@@ -0,0 +1,216 @@
+import os
+import json
+import asyncio
+import signal
+import time
+import shlex
+import datetime
+import threading
+import subprocess
+import metrics
+
+DEFAULT_COMMAND = 'openclaw cron list --json'
+
+
+def format_relative(next_run_ms, now_ms):
+    """'in 5m' / 'in 3h' / 'Mon 14:00' relative to now_ms."""
+    # Calculate relative time or format absolute time
+    diff_ms = next_run_ms - now_ms
+
+    if diff_ms < 0:
+        return "soon"
+    elif diff_ms < 3600000: # < 1h
+        return f"in {int(diff_ms / 60000)}m"
+    elif diff_ms < 86400000: # < 24h
+        return f"in {int(diff_ms / 3600000)}h"
+    else:
+        dt = datetime.datetime.fromtimestamp(next_run_ms / 1000)
+        return dt.strftime('%a %H:%M')
+
+
+def format_jobs(jobs, fetched_at, now=None):
+    """Cached jobs as served by /api/schedule, with times relative to now."""
+    now = time.time() if now is None else now
+    now_ms = now * 1000
+    age = round(now - fetched_at, 1)
+    return [{
+        "name": job['name'],
+        "time": format_relative(job['next_run_ms'], now_ms),
+        "status": "Enabled" if job['enabled'] else "Disabled",
+        "next_run_ms": job['next_run_ms'],
+        "age": age
+    } for job in jobs]
+
+
+def schedule_payload(jobs, fetched_at, last_error, now=None):
+    """
+    Body of /api/schedule: the formatted jobs (none before the first
+    successful run), seconds since that run, and the last error if any.
+    """
+    now = time.time() if now is None else now
+    return {
+        "jobs": format_jobs(jobs, fetched_at, now) if jobs is not None else [],
+        "age": round(now - fetched_at, 1) if fetched_at is not None else None,
+        "last_error": last_error,
+    }
+
+
+class ScheduleCache:
+    """
+    Keeps the OpenClaw cron job list in memory.
+
+    A background thread runs the CLI every `interval` seconds with a hard
+    timeout. The parsed jobs keep their absolute nextRunAtMs, and the
+    relative "in Xm" strings are computed when the cache is read. If a run
+    fails, the last good result is kept and reported with its age.
+    """
+
+    def __init__(self, command=DEFAULT_COMMAND, timeout=10, interval=60, on_refresh=None):
+        self.command = shlex.split(command) if isinstance(command, str) else list(command)
+        self.timeout = timeout
+        self.interval = interval
+        self.on_refresh = on_refresh
+        self._jobs = None
+        self._fetched_at = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run_command(self):
+        with metrics.track('subprocess', 'openclaw_cron'):
+            # Own process group, so a timeout also kills anything the CLI spawned
+            proc = subprocess.Popen(
+                self.command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                start_new_session=True
+            )
+            try:
+                output, _ = proc.communicate(timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.communicate()
+                raise
+            if proc.returncode != 0:
+                raise subprocess.CalledProcessError(proc.returncode, self.command, output)
+        return self._parse(output)
+
+    async def _run_command_async(self):
+        """_run_command using an asyncio subprocess."""
+        with metrics.track('subprocess', 'openclaw_cron'):
+            proc = await asyncio.create_subprocess_exec(
+                *self.command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.STDOUT,
+                start_new_session=True
+            )
+            try:
+                output, _ = await asyncio.wait_for(proc.communicate(), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                os.killpg(proc.pid, signal.SIGKILL)
+                await proc.communicate()
+                raise subprocess.TimeoutExpired(self.command, self.timeout)
+            if proc.returncode != 0:
+                raise subprocess.CalledProcessError(proc.returncode, self.command, output)
+        return self._parse(output)
+
+    @staticmethod
+    def _parse(output):
+        data = json.loads(output.decode('utf-8'))
+        jobs = []
+        for job in data.get('jobs', []):
+            next_run_ms = job.get('state', {}).get('nextRunAtMs')
+            if not next_run_ms:
+                continue
+            jobs.append({
+                "name": job.get('name', 'Unnamed Job'),
+                "enabled": bool(job.get('enabled')),
+                "next_run_ms": next_run_ms
+            })
+        # Sort by next run
+        jobs.sort(key=lambda x: x['next_run_ms'])
+        return jobs
+
+    def _record_error(self, error):
+        if isinstance(error, subprocess.TimeoutExpired):
+            self.last_error = f"Timed out after {self.timeout}s"
+        else:
+            self.last_error = str(error)
+
+    def _store(self, jobs):
+        self._jobs = jobs
+        self._fetched_at = time.time()
+        self.last_error = None
+
+    def refresh(self):
+        """Runs the CLI once. Keeps the previous jobs if it fails or times out."""
+        with self._lock:
+            try:
+                jobs = self._run_command()
+            except Exception as e:
+                self._record_error(e)
+                raise
+            self._store(jobs)
+        if self.on_refresh:
+            self.on_refresh(self)
+        return jobs
+
+    async def refresh_async(self):
+        """refresh() for an asyncio loop."""
+        try:
+            jobs = await self._run_command_async()
+        except Exception as e:
+            self._record_error(e)
+            raise
+        self._store(jobs)
+        if self.on_refresh:
+            self.on_refresh(self)
+        return jobs
+
+    def age(self):
+        """Seconds since the last successful refresh, or None."""
+        if self._fetched_at is None:
+            return None
+        return time.time() - self._fetched_at
+
+    def get(self):
+        """
+        Cached schedule formatted for the dashboard. Never runs the CLI: until
+        the background refresh first succeeds there are no jobs, just its error.
+        """
+        return schedule_payload(self._jobs, self._fetched_at, self.last_error)
+
+    def state(self):
+        """Raw jobs and fetch time, for publishing to other processes."""
+        return {"jobs": self._jobs, "fetched_at": self._fetched_at, "error": self.last_error}
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Schedule error: {e}")
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='schedule-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.timeout + 1)
+
+    async def run_async(self):
+        """Background loop for asyncio servers, replacing the thread."""
+        while True:
+            try:
+                await self.refresh_async()
+            except Exception as e:
+                print(f"Schedule error: {e}")
+            await asyncio.sleep(self.interval)
@@ -0,0 +1,498 @@
+"""
+State shared between the processes of the multi-worker server.
+
+In multi-worker mode (BMO_SERVER=multi in start_server.sh) one collector
+process runs every background job: the stats and process samplers,
+schedule refresh, calendar sync, git watcher and token retention. It
+publishes what the HTTP workers need into a single memory-mapped file,
+normally in /dev/shm. Workers map the same file read-only and serve
+/api/stats, /api/processes, /api/schedule, /api/calendar and the budget
+checks from it without locks or syscalls.
+
+The file holds two regions, each guarded by a sequence counter (a seqlock):
+
+  * doc: a JSON document with the latest stats, top processes, schedule,
+    calendar events, activities version, token usage counters and budget status;
+  * history: the stats RingBuffer as raw bytes, for /api/stats/history.
+
+The collector makes a region's counter odd, rewrites the data, then makes
+it even again. A reader copies the data between two reads of the counter
+and retries if the counter was odd or moved. There is only ever one
+writer: the collector holds an exclusive flock on <path>.lock.
+
+Layout (little endian):
+
+    0    magic b'BMOSNAP1', doc region size, history region size
+    64   doc region:     seq, length, data[doc size]
+    ...  history region: seq, length, data[history size]
+"""
+import os
+import json
+import time
+import mmap
+import fcntl
+import struct
+import threading
+import db
+import token_monitor
+from calendar_cache import upcoming
+from schedule_cache import schedule_payload
+from stats_sampler import RingBuffer, downsample
+
+SNAPSHOT_PATH = os.environ.get('BMO_SNAPSHOT_PATH', '/dev/shm/bmo-dashboard.snapshot')
+# Room for the JSON document; the history region is sized from the ring buffer
+DOC_SIZE = int(os.environ.get('BMO_SNAPSHOT_DOC_SIZE', 1024 * 1024))
+# Seconds between collector publishes, and between worker checks for changes
+PUBLISH_INTERVAL = float(os.environ.get('BMO_SNAPSHOT_INTERVAL', 1))
+POLL_INTERVAL = float(os.environ.get('BMO_SNAPSHOT_POLL', 0.5))
+# Workers answer 503 once the collector has not published for this long
+STALE_AFTER = float(os.environ.get('BMO_SNAPSHOT_STALE_AFTER', 30))
+
+MAGIC = b'BMOSNAP1'
+HEADER = struct.Struct('<8sQQ')
+HEADER_SIZE = 64
+REGION = struct.Struct('<QQ')
+SEQ = struct.Struct('<Q')
+READ_ATTEMPTS = 1000
+
+
+class SnapshotUnavailable(RuntimeError):
+    """No usable snapshot: the collector is not running, or has stopped publishing."""
+
+
+def _layout(doc_size, history_size):
+    doc_offset = HEADER_SIZE
+    history_offset = doc_offset + REGION.size + doc_size
+    return doc_offset, history_offset, history_offset + REGION.size + history_size
+
+
+class SnapshotWriter:
+    """The collector's side of the snapshot file."""
+
+    def __init__(self, path=SNAPSHOT_PATH, doc_size=DOC_SIZE, history_size=0):
+        self.path = path
+        self.doc_size = doc_size
+        self.history_size = history_size
+        self._doc_offset, self._history_offset, size = _layout(doc_size, history_size)
+
+        self._lock_fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self._lock_fd)
+            raise RuntimeError(f"Another collector is publishing to {path}")
+
+        if not self._reusable(size):
+            # Workers may still map the old file; give them a new inode rather than shrinking it
+            tmp = f'{path}.{os.getpid()}.tmp'
+            fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+            os.ftruncate(fd, size)
+            os.pwrite(fd, HEADER.pack(MAGIC, doc_size, history_size), 0)
+            os.close(fd)
+            os.replace(tmp, path)
+
+        self._fd = os.open(path, os.O_RDWR)
+        self._map = mmap.mmap(self._fd, size)
+        for offset in (self._doc_offset, self._history_offset):
+            # A collector that died mid-write leaves an odd counter; start over from empty
+            seq = SEQ.unpack_from(self._map, offset)[0]
+            REGION.pack_into(self._map, offset, seq + 2 - seq % 2, 0)
+
+    def _reusable(self, size):
+        try:
+            with open(self.path, 'rb') as f:
+                header = f.read(HEADER.size)
+                f.seek(0, os.SEEK_END)
+                actual = f.tell()
+        except FileNotFoundError:
+            return False
+        return actual == size and header == HEADER.pack(MAGIC, self.doc_size, self.history_size)
+
+    def _write(self, offset, capacity, data):
+        if len(data) > capacity:
+            raise ValueError(f"Snapshot region too small: {len(data)} > {capacity} bytes")
+        seq = SEQ.unpack_from(self._map, offset)[0]
+        SEQ.pack_into(self._map, offset, seq + 1)
+        start = offset + REGION.size
+        self._map[start:start + len(data)] = data
+        REGION.pack_into(self._map, offset, seq + 2, len(data))
+
+    def write_doc(self, doc):
+        self._write(self._doc_offset, self.doc_size,
+                    json.dumps(doc, separators=(',', ':')).encode('utf-8'))
+
+    def write_history(self, data):
+        self._write(self._history_offset, self.history_size, data)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+        os.close(self._lock_fd)
+
+
+class SnapshotReader:
+    """
+    A worker's read-only view of the snapshot file.
+
+    The parsed document and ring buffer are cached per sequence number, so
+    repeated reads of an unchanged snapshot cost one 8-byte compare.
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH, stale_after=STALE_AFTER):
+        self.path = path
+        self.stale_after = stale_after
+        # (mmap, inode, {region: (offset, size)}), swapped as one value so
+        # request threads never see a mix of an old and a new mapping
+        self._mapping = None
+        self._doc = (None, None)
+        self._history = (None, None)
+
+    def _open(self):
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            raise SnapshotUnavailable(f"{self.path} does not exist; is the collector running?")
+        try:
+            st = os.fstat(fd)
+            if st.st_size < HEADER_SIZE:
+                raise SnapshotUnavailable(f"{self.path} is not initialised yet")
+            mapped = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        magic, doc_size, history_size = HEADER.unpack_from(mapped)
+        doc_offset, history_offset, size = _layout(doc_size, history_size)
+        if magic != MAGIC or len(mapped) < size:
+            mapped.close()
+            raise SnapshotUnavailable(f"{self.path} is not a dashboard snapshot")
+        self._doc = (None, None)
+        self._history = (None, None)
+        self._mapping = (mapped, st.st_ino,
+                         {'doc': (doc_offset, doc_size), 'history': (history_offset, history_size)})
+        return self._mapping
+
+    def reopen_if_replaced(self):
+        """Maps the file again if a restarted collector replaced it."""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return
+        mapping = self._mapping
+        if mapping is not None and inode != mapping[1]:
+            # Not closed here: a request thread may still be copying from it
+            self._mapping = None
+
+    def _region(self, region):
+        mapped, _, regions = self._mapping or self._open()
+        return mapped, regions[region]
+
+    def _seq(self, region):
+        mapped, (offset, _) = self._region(region)
+        return SEQ.unpack_from(mapped, offset)[0]
+
+    def _read(self, region):
+        mapped, (offset, capacity) = self._region(region)
+        for _ in range(READ_ATTEMPTS):
+            seq, length = REGION.unpack_from(mapped, offset)
+            if seq % 2 == 0:
+                start = offset + REGION.size
+                data = mapped[start:start + min(length, capacity)]
+                if SEQ.unpack_from(mapped, offset)[0] == seq:
+                    return seq, data
+            time.sleep(0)
+        raise SnapshotUnavailable("Snapshot is being rewritten too often to read")
+
+    def doc(self):
+        """The latest published document. Raises SnapshotUnavailable if there is none or it is stale."""
+        seq = self._seq('doc')
+        cached_seq, doc = self._doc
+        if seq != cached_seq:
+            seq, data = self._read('doc')
+            if not data:
+                raise SnapshotUnavailable("The collector has not published yet")
+            doc = json.loads(data)
+            self._doc = (seq, doc)
+        if time.time() - doc['published_at'] > self.stale_after:
+            raise SnapshotUnavailable(f"The collector (pid {doc['pid']}) stopped publishing")
+        return doc
+
+    def history(self, fields):
+        seq = self._seq('history')
+        cached_seq, ring = self._history
+        if seq != cached_seq:
+            seq, data = self._read('history')
+            if not data:
+                raise SnapshotUnavailable("No stats history has been published yet")
+            ring = RingBuffer.from_bytes(data, fields)
+            self._history = (seq, ring)
+        return ring
+
+
+class SnapshotPublisher:
+    """
+    Runs in the collector: copies the state of the local services into the
+    snapshot every `interval` seconds, and the stats history after every sample.
+    Also picks up token usage rows written by the workers, so the budget
+    counters cover every process.
+    """
+
+    def __init__(self, writer, stats_sampler, schedule_cache, calendar_cache,
+                 budget, interval=PUBLISH_INTERVAL, process_sampler=None):
+        self.writer = writer
+        self.stats_sampler = stats_sampler
+        self.process_sampler = process_sampler
+        self.schedule_cache = schedule_cache
+        self.calendar_cache = calendar_cache
+        self.budget = budget
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._stats = None
+        self._token_seq = 0
+        self._token_models = {}
+        with db.connection() as conn:
+            self._last_token_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM token_usage').fetchone()[0]
+        self._stop = threading.Event()
+        self._threads = []
+
+    def on_stats(self, stats):
+        """Sampler listener: publishes the new sample along with the history."""
+        self._stats = stats
+        self.writer.write_history(self.stats_sampler.history.to_bytes())
+        self.publish()
+
+    def _poll_token_usage(self, conn):
+        rows = conn.execute('''
+            SELECT id, timestamp, model_name, total_tokens, api_call_count
+            FROM token_usage WHERE id > ? ORDER BY id
+        ''', (self._last_token_id,)).fetchall()
+        if not rows:
+            return
+        for row_id, timestamp, model_name, tokens, calls in rows:
+            at = time.mktime(time.strptime(timestamp, '%Y-%m-%d %H:%M:%S'))
+            self.budget.record(model_name, tokens, at)
+            model = self._token_models.setdefault(model_name, {"tokens": 0, "calls": 0})
+            model["tokens"] += tokens
+            model["calls"] += calls
+        self._last_token_id = rows[-1][0]
+        self._token_seq += 1
+
+    def publish(self):
+        with self._lock:
+            with db.connection() as conn:
+                activities_version = db.table_version(conn, 'activities')
+                self._poll_token_usage(conn)
+            self.writer.write_doc({
+                "pid": os.getpid(),
+                "published_at": time.time(),
+                "stats": self._stats,
+                "boot_time": self.stats_sampler.boot_time,
+                "interval": self.stats_sampler.interval,
+                "fields": self.stats_sampler.fields,
+                "processes": self.process_sampler.state() if self.process_sampler else None,
+                "schedule": self.schedule_cache.state(),
+                "calendar": dict(self.calendar_cache.state(), days=self.calendar_cache.days),
+                "activities_version": activities_version,
+                # Cumulative since the collector started; workers push the differences
+                "token_usage": {"seq": self._token_seq, "models": self._token_models},
+                "budget": self.budget.status(),
+            })
+
+    def _run(self):
+        while True:
+            try:
+                self.publish()
+            except Exception as e:
+                print(f"Snapshot publish error: {e}")
+            if self._stop.wait(self.interval):
+                break
+
+    def _run_calendar(self):
+        # Nothing reads the calendar in this process, so keep it fresh here
+        while True:
+            try:
+                self.calendar_cache.refresh()
+            except Exception as e:
+                print(f"Calendar refresh error: {e}")
+            if self._stop.wait(self.calendar_cache.ttl):
+                break
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        self.stats_sampler.add_listener(self.on_stats)
+        for target, name in ((self._run, 'snapshot-publisher'), (self._run_calendar, 'snapshot-calendar')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=self.interval + 1)
+        self._threads = []
+
+
+class StatsView:
+    """Worker stand-in for StatsSampler, backed by the snapshot."""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def latest(self):
+        stats = self.reader.doc()['stats']
+        if stats is None:
+            raise SnapshotUnavailable("The collector has not sampled stats yet")
+        return stats
+
+    def uptime_seconds(self):
+        return time.time() - self.reader.doc()['boot_time']
+
+    @property
+    def interval(self):
+        return self.reader.doc()['interval']
+
+    @property
+    def fields(self):
+        return self.reader.doc()['fields']
+
+    def series(self, window, step):
+        return downsample(self.reader.history(self.fields), self.interval, window, step)
+
+
+class ProcessView:
+    """Worker stand-in for ProcessSampler, backed by the snapshot."""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def latest(self):
+        processes = self.reader.doc()['processes']
+        if processes is None:
+            raise SnapshotUnavailable("The collector has not sampled processes yet")
+        return processes
+
+
+class ScheduleView:
+    """Worker stand-in for ScheduleCache, backed by the snapshot."""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def state(self):
+        return self.reader.doc()['schedule']
+
+    def age(self):
+        fetched_at = self.state()['fetched_at']
+        return None if fetched_at is None else time.time() - fetched_at
+
+    def get(self):
+        state = self.state()
+        return schedule_payload(state['jobs'], state['fetched_at'], state['error'])
+
+
+class CalendarView:
+    """Worker stand-in for CalendarCache, backed by the snapshot."""
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def error(self):
+        error = self.reader.doc()['calendar']['error']
+        return ' '.join(error.split()) if error else None
+
+    def get_events(self, limit=10):
+        state = self.reader.doc()['calendar']
+        if state['events'] is None:
+            # Not synced yet, or the collector's sync failed (see error())
+            return []
+        return upcoming(state['events'], state['days'], limit)
+
+
+class BudgetView:
+    """
+    Worker stand-in for token_monitor.TokenBudget, backed by the snapshot.
+
+    record() is a no-op: the worker's rows reach the collector through the
+    database, so its own calls count towards the budget after the next
+    writer flush and publish (about a second).
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+
+    def record(self, model_name, tokens, now=None):
+        pass
+
+    def check(self, model_name, now=None):
+        return token_monitor.check_status(self.status(), model_name)
+
+    def status(self, now=None):
+        return self.reader.doc()['budget']
+
+
+class SnapshotWatcher:
+    """
+    Runs in each worker: turns snapshot changes into events on the local
+    bus, so /api/stream behaves as it does in a single process.
+    """
+
+    def __init__(self, reader, bus, interval=POLL_INTERVAL):
+        self.reader = reader
+        self.bus = bus
+        self.interval = interval
+        self._seen = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def poll(self):
+        self.reader.reopen_if_replaced()
+        doc = self.reader.doc()
+        seen, self._seen = self._seen, doc
+        stats = doc['stats']
+        if stats and (seen is None or seen['stats'] is None or stats['sampled_at'] != seen['stats']['sampled_at']):
+            # Always published: bus.last('stats') seeds new streams
+            self.bus.publish('stats', stats)
+        if seen is None or not self.bus.subscriber_count():
+            return
+        if doc['activities_version'] != seen['activities_version']:
+            self.bus.publish('activities', {"version": doc['activities_version']})
+        schedule = doc['schedule']
+        if schedule['jobs'] is not None and schedule['fetched_at'] != seen['schedule']['fetched_at']:
+            self.bus.publish('schedule', schedule_payload(schedule['jobs'], schedule['fetched_at'],
+                                                          schedule['error']))
+        usage, previous = doc['token_usage'], seen['token_usage']
+        if usage['seq'] != previous['seq']:
+            if doc['pid'] != seen['pid']:
+                # Collector restarted; its counters start from zero again
+                previous = {"models": {}}
+            models = {}
+            for name, totals in usage['models'].items():
+                before = previous['models'].get(name, {"tokens": 0, "calls": 0})
+                if totals != before:
+                    models[name] = {"tokens": totals["tokens"] - before["tokens"],
+                                    "calls": totals["calls"] - before["calls"]}
+            if models:
+                self.bus.publish('token-usage', {"models": models})
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except SnapshotUnavailable:
+                pass
+            except Exception as e:
+                print(f"Snapshot watcher error: {e}")
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='snapshot-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
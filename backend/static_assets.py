@@ -0,0 +1,212 @@
+"""
+Serves the built frontend (frontend/dist) from an in-memory index.
+
+The index is built once: every file is read, hashed for its ETag and
+compressed with gzip and, if the brotli package is installed, brotli.
+Compressed variants are saved next to the originals (app.js.gz,
+app.js.br) and reused by later starts while they are newer than the
+source, so only the first start after a frontend build pays for them.
+Requests are answered from memory with no filesystem access:
+
+  * the variant is picked from Accept-Encoding (br, then gzip, then identity);
+  * Vite's content-hashed files under assets/ are cached for a year as
+    immutable; everything else (index.html above all) is revalidated with
+    its ETag on every load;
+  * Range requests get 206 partial responses of the uncompressed file.
+
+The first lookup builds the index if nobody has yet, so the app can
+build it in the background after startup. After a frontend rebuild the
+index notices the new index.html within CHECK_INTERVAL seconds and
+reloads itself in a background thread, serving the previous files until
+the new ones are ready.
+"""
+import os
+import re
+import gzip
+import time
+import hashlib
+import mimetypes
+import threading
+from flask import Response
+
+# Seconds between checks of index.html for a new frontend build
+CHECK_INTERVAL = float(os.environ.get('BMO_STATIC_CHECK_INTERVAL', 2))
+# Smaller files are not worth compressing
+MIN_COMPRESS_SIZE = 512
+
+INDEX_FILE = 'index.html'
+# Vite output names: assets/index-B3x_9aZq.js
+HASHED_NAME = re.compile(r'^assets/.+-[A-Za-z0-9_-]{8,}\.[a-z0-9]+$')
+COMPRESSIBLE = re.compile(r'^(text/|application/(javascript|json|xml|manifest\+json|wasm)|image/svg\+xml)')
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+# Encodings in order of preference, with the suffix of their saved variant
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def _compress(encoding, data):
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    return _brotli().compress(data, quality=11)
+
+
+class Asset:
+    def __init__(self, path, data, content_type, cache_control):
+        self.path = path
+        self.content_type = content_type
+        self.cache_control = cache_control
+        digest = hashlib.blake2b(data, digest_size=12).hexdigest()
+        self.etag = digest
+        # encoding -> (body, etag); each representation needs its own strong ETag
+        self.variants = {'identity': (data, digest)}
+
+    def add_variant(self, encoding, data):
+        self.variants[encoding] = (data, f'{self.etag}-{encoding}')
+
+
+class StaticIndex:
+    """Path -> Asset for everything under `root`, with the SPA fallback to index.html."""
+
+    def __init__(self, root, check_interval=CHECK_INTERVAL):
+        self.root = root
+        self.check_interval = check_interval
+        self._assets = {}
+        self._index_mtime = None
+        self._checked_at = 0.0
+        self._built = False
+        self._lock = threading.Lock()
+        # Held for a whole build, so two never run at once
+        self._build_lock = threading.Lock()
+
+    def _load_variant(self, path, data, encoding, suffix):
+        variant_path = path + suffix
+        try:
+            if os.path.getmtime(variant_path) >= os.path.getmtime(path):
+                with open(variant_path, 'rb') as f:
+                    return f.read()
+        except OSError:
+            pass
+        compressed = _compress(encoding, data)
+        # Best effort: a read-only dist/ just means compressing again next start
+        tmp = f'{variant_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(compressed)
+            os.replace(tmp, variant_path)
+        except OSError:
+            pass
+        return compressed
+
+    def _load(self, rel_path):
+        path = os.path.join(self.root, rel_path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        content_type = mimetypes.guess_type(rel_path)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type += '; charset=utf-8'
+        cache_control = IMMUTABLE if HASHED_NAME.match(rel_path) else REVALIDATE
+        asset = Asset(rel_path, data, content_type, cache_control)
+        if len(data) >= MIN_COMPRESS_SIZE and COMPRESSIBLE.match(content_type):
+            for encoding, suffix in ENCODINGS:
+                if encoding == 'br' and _brotli() is None:
+                    continue
+                compressed = self._load_variant(path, data, encoding, suffix)
+                if len(compressed) < len(data):
+                    asset.add_variant(encoding, compressed)
+        return asset
+
+    def build(self):
+        """(Re)reads every file under root. Returns the number of assets."""
+        with self._build_lock:
+            return self._build()
+
+    def _build(self):
+        # Taken first: if index.html changes during the build, the next check rebuilds again
+        index_mtime = self._current_index_mtime()
+        assets = {}
+        suffixes = tuple(suffix for _, suffix in ENCODINGS) + ('.tmp',)
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(suffixes):
+                    continue
+                rel_path = os.path.relpath(os.path.join(dirpath, name), self.root).replace(os.sep, '/')
+                assets[rel_path] = self._load(rel_path)
+        with self._lock:
+            self._assets = assets
+            self._index_mtime = index_mtime
+            self._checked_at = time.monotonic()
+            self._built = True
+        return len(assets)
+
+    def ensure_built(self):
+        """Builds the index unless it already was; concurrent callers wait for one build."""
+        if self._built:
+            return
+        with self._build_lock:
+            if not self._built:
+                self._build()
+
+    def _current_index_mtime(self):
+        try:
+            return os.path.getmtime(os.path.join(self.root, INDEX_FILE))
+        except OSError:
+            return None
+
+    def _reload_if_rebuilt(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        if self._current_index_mtime() != self._index_mtime:
+            # Requests keep getting the current assets until the new ones are ready
+            threading.Thread(target=self._rebuild, name='static-rebuild', daemon=True).start()
+
+    def _rebuild(self):
+        # Already rebuilding; if that build missed this change, a later check catches it
+        if not self._build_lock.acquire(blocking=False):
+            return
+        try:
+            if self._current_index_mtime() != self._index_mtime:
+                self._build()
+        except Exception as e:
+            print(f"Static index rebuild error: {e}")
+        finally:
+            self._build_lock.release()
+
+    def lookup(self, path):
+        """The asset for a request path; unknown paths get index.html, or None without a build."""
+        self.ensure_built()
+        self._reload_if_rebuilt()
+        assets = self._assets
+        return assets.get(path) or assets.get(INDEX_FILE)
+
+    def response(self, path, request):
+        asset = self.lookup(path)
+        if asset is None:
+            return Response("Frontend not built", status=404, mimetype='text/plain')
+
+        encoding = 'identity'
+        # Ranges are served from the uncompressed file so offsets mean the same to every client
+        if 'Range' not in request.headers:
+            for candidate, _ in ENCODINGS:
+                if candidate in asset.variants and request.accept_encodings[candidate]:
+                    encoding = candidate
+                    break
+        body, etag = asset.variants[encoding]
+
+        response = Response(body, content_type=asset.content_type)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = asset.cache_control
+        response.headers['Vary'] = 'Accept-Encoding'
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        # Handles If-None-Match (304) and Range (206 / 416)
+        return response.make_conditional(request, accept_ranges=True, complete_length=len(body))
@@ -0,0 +1,241 @@
+import time
+import array
+import struct
+import datetime
+import threading
+
+# Check for common VPN/Tunnel interfaces
+VPN_IFACES = ['tun0', 'wg0', 'wireguard']
+
+# Per-sample numeric fields kept in the ring buffer
+FIELDS = ['time', 'cpu', 'ram', 'disk'] + [
+    f'{iface}_{direction}' for iface in VPN_IFACES for direction in ('rx_rate', 'tx_rate')
+]
+
+
+class RingBuffer:
+    """
+    Fixed-size history of samples, one preallocated array('d') per field.
+
+    Appending overwrites the oldest sample once the buffer is full, so
+    memory stays constant no matter how long the sampler runs.
+    """
+
+    # capacity, next, count; followed by the columns in `fields` order
+    _HEADER = struct.Struct('<QQQ')
+
+    def __init__(self, capacity, fields=FIELDS):
+        self.capacity = capacity
+        self.fields = list(fields)
+        self._columns = {name: array.array('d', bytes(8 * capacity)) for name in self.fields}
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, sample):
+        with self._lock:
+            i = self._next
+            for name in self.fields:
+                self._columns[name][i] = sample.get(name, 0.0)
+            self._next = (i + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def to_bytes(self):
+        """Header plus raw column data, for sharing with other processes."""
+        with self._lock:
+            parts = [self._HEADER.pack(self.capacity, self._next, self._count)]
+            parts.extend(self._columns[name].tobytes() for name in self.fields)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data, fields=FIELDS):
+        capacity, next_index, count = cls._HEADER.unpack_from(data)
+        ring = cls.__new__(cls)
+        ring.capacity = capacity
+        ring.fields = list(fields)
+        ring._columns = {}
+        offset = cls._HEADER.size
+        for name in ring.fields:
+            column = array.array('d')
+            column.frombytes(data[offset:offset + 8 * capacity])
+            ring._columns[name] = column
+            offset += 8 * capacity
+        ring._next = next_index
+        ring._count = count
+        ring._lock = threading.Lock()
+        return ring
+
+    def snapshot(self, since=None):
+        """Returns {field: [values]} oldest first, optionally only time >= since."""
+        with self._lock:
+            count = self._count
+            start = (self._next - count) % self.capacity
+            order = [(start + k) % self.capacity for k in range(count)]
+            times = self._columns['time']
+            if since is not None:
+                order = [i for i in order if times[i] >= since]
+            return {name: [self._columns[name][i] for i in order] for name in self.fields}
+
+
+def downsample(history, interval, window, step, now=None):
+    """
+    Downsamples the last `window` seconds of `history` into buckets of `step`
+    seconds, averaging every field. Returns a list of dicts, oldest first.
+    """
+    step = max(step, interval)
+    now = time.time() if now is None else now
+    data = history.snapshot(since=now - window)
+
+    buckets = {}
+    for k, t in enumerate(data['time']):
+        key = int((t - (now - window)) // step)
+        bucket = buckets.setdefault(key, {name: 0.0 for name in history.fields} | {'n': 0})
+        for name in history.fields:
+            bucket[name] += data[name][k]
+        bucket['n'] += 1
+
+    points = []
+    for key in sorted(buckets):
+        bucket = buckets[key]
+        n = bucket.pop('n')
+        point = {name: round(value / n, 2) for name, value in bucket.items()}
+        points.append(point)
+    return points
+
+
+class StatsSampler:
+    """
+    Collects host metrics on a fixed interval in a single background thread.
+
+    /api/stats reads the latest sample, so every dashboard sees the same
+    numbers and cpu_percent is always measured over one full interval.
+    VPN counters are turned into byte rates between consecutive samples.
+    """
+
+    def __init__(self, interval=5.0, retention=86400, disk_path='/'):
+        self.interval = interval
+        self.disk_path = disk_path
+        self.history = RingBuffer(int(retention / interval))
+        self._latest = None
+        self._prev_net = None
+        self._prev_time = None
+        # psutil is imported by the first sample, not when the app is imported
+        self._boot_time = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+        # sample() runs on the sampler thread and, before the first tick, on request threads
+        self._sample_lock = threading.Lock()
+
+    def add_listener(self, callback):
+        """Registers callback(stats) to be called after every sample."""
+        self._listeners.append(callback)
+
+    def sample(self):
+        with self._sample_lock:
+            return self._sample()
+
+    def _sample(self):
+        import psutil
+        now = time.time()
+        net_io = psutil.net_io_counters(pernic=True)
+        elapsed = now - self._prev_time if self._prev_time else None
+
+        vpn_stats = {}
+        row = {
+            'time': now,
+            'cpu': psutil.cpu_percent(interval=None),
+            'ram': psutil.virtual_memory().percent,
+            'disk': psutil.disk_usage(self.disk_path).percent,
+        }
+        for iface in VPN_IFACES:
+            if iface not in net_io:
+                continue
+            counters = net_io[iface]
+            rx_rate = tx_rate = 0.0
+            prev = self._prev_net.get(iface) if self._prev_net else None
+            if prev and elapsed:
+                # Counters reset when the tunnel is re-created; treat as no traffic
+                rx_rate = max(counters.bytes_recv - prev.bytes_recv, 0) / elapsed
+                tx_rate = max(counters.bytes_sent - prev.bytes_sent, 0) / elapsed
+            row[f'{iface}_rx_rate'] = rx_rate
+            row[f'{iface}_tx_rate'] = tx_rate
+            vpn_stats[iface] = {
+                "bytes_sent": counters.bytes_sent,
+                "bytes_recv": counters.bytes_recv,
+                "rx_rate": round(rx_rate, 1),
+                "tx_rate": round(tx_rate, 1),
+            }
+
+        self._prev_net = net_io
+        self._prev_time = now
+        self.history.append(row)
+
+        uptime_seconds = now - self.boot_time
+        self._latest = {
+            "cpu": row['cpu'],
+            "ram": row['ram'],
+            "disk": row['disk'],
+            "uptime": str(datetime.timedelta(seconds=int(uptime_seconds))),
+            "uptime_seconds": int(uptime_seconds),
+            "vpn": vpn_stats,
+            "sampled_at": now,
+        }
+        for callback in self._listeners:
+            try:
+                callback(self._latest)
+            except Exception as e:
+                print(f"Stats listener error: {e}")
+        return self._latest
+
+    def latest(self):
+        """Most recent sample; takes one synchronously if the thread has not run yet."""
+        if self._latest is None:
+            with self._sample_lock:
+                # The sampler thread may have taken it while we waited
+                if self._latest is None:
+                    return self._sample()
+        return self._latest
+
+    def uptime_seconds(self):
+        return time.time() - self.boot_time
+
+    @property
+    def fields(self):
+        return self.history.fields
+
+    @property
+    def boot_time(self):
+        if self._boot_time is None:
+            import psutil
+            self._boot_time = psutil.boot_time()
+        return self._boot_time
+
+    def series(self, window, step):
+        """See downsample()."""
+        return downsample(self.history, self.interval, window, step)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Stats sampler error: {e}")
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        import psutil
+        # Prime cpu_percent so the first real sample covers a full interval
+        psutil.cpu_percent(interval=None)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='stats-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
@@ -0,0 +1,45 @@
+import os
+import sys
+import tempfile
+import threading
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# Modules read this at import time. Always replaced, never defaulted, so the
+# tests stay off the checked-in database even when it is set in the shell
+os.environ['BMO_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='bmo-tests-'), 'import.db')
+
+import db
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A fresh, initialized database for one test."""
+    monkeypatch.setattr(db, 'DB_PATH', str(tmp_path / 'test.db'))
+    monkeypatch.setattr(db, '_pool', None)
+    db.init_db()
+    yield db
+    db.get_pool().close_all()
+
+
+def _race(callable_, threads=16):
+    barrier = threading.Barrier(threads)
+    results = []
+
+    def run():
+        barrier.wait()
+        results.append(callable_())
+
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+@pytest.fixture
+def race():
+    """race(callable_, threads=16): calls callable_ from that many threads at once; returns the results."""
+    return _race
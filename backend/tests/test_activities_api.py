@@ -0,0 +1,40 @@
+import datetime
+import pytest
+import app as app_module
+
+
+@pytest.fixture
+def client(database, monkeypatch):
+    # Skip create_app(): no background jobs for these requests
+    monkeypatch.setattr(app_module, '_started', True)
+    return app_module.app.test_client()
+
+
+def _add(database, title, status, last_updated):
+    with database.connection() as conn:
+        return conn.execute('INSERT INTO activities (title, status, last_updated) VALUES (?, ?, ?)',
+                            (title, status, last_updated)).lastrowid
+
+
+def test_delta_reports_the_archive_cutoff(database, client, monkeypatch):
+    _add(database, 'Done today', 'Completed', datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    response = client.get('/api/activities')
+    [row] = response.get_json()
+    version = int(response.headers['X-Activities-Version'])
+
+    # Two days later the row has aged out of the listing without changing
+    monkeypatch.setattr(app_module, 'ACTIVITY_ARCHIVE_DAYS', -2)
+    assert client.get('/api/activities').get_json() == []
+    data = client.get(f'/api/activities?since={version}').get_json()
+    assert data['activities'] == []
+    # ...so the client drops it by the cutoff
+    assert data['cutoff'] == app_module._archive_cutoff()
+    assert row['last_updated'] < data['cutoff']
+
+
+def test_delta_returns_changed_rows(database, client):
+    version = int(client.get('/api/activities').headers['X-Activities-Version'])
+    added = _add(database, 'New', 'Pending', '2999-01-01 00:00:00')
+    data = client.get(f'/api/activities?since={version}').get_json()
+    assert [row['id'] for row in data['activities']] == [added]
+    assert data['version'] > version
@@ -0,0 +1,141 @@
+import time
+import threading
+import pytest
+from bench import fakes
+from calendar_cache import CalendarCache
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def client():
+    return fakes.FakeDAVClient(calendars=2, events=4, latency=0)
+
+
+@pytest.fixture
+def cache(client):
+    cache = CalendarCache('unused.json', ttl=300, client_factory=lambda: client)
+    yield cache
+    cache._executor.shutdown(wait=True)
+
+
+def _titles(events):
+    return sorted(event['title'] for event in events)
+
+
+def test_unchanged_ctag_skips_refetch(cache, client):
+    cache.refresh()
+    assert [calendar.fetches for calendar in client.calendars] == [1, 1]
+
+    cache.refresh()
+    assert [calendar.fetches for calendar in client.calendars] == [1, 1]
+
+    client.calendars[1].ctag = 'ctag-2'
+    cache.refresh()
+    assert [calendar.fetches for calendar in client.calendars] == [1, 2]
+
+
+def test_unchanged_sync_token_skips_refetch(cache, client):
+    for calendar in client.calendars:
+        calendar.ctag = None
+        calendar.sync_token = 'token-1'
+    cache.refresh()
+    cache.refresh()
+    assert [calendar.fetches for calendar in client.calendars] == [1, 1]
+
+    client.calendars[0].sync_token = 'token-2'
+    cache.refresh()
+    assert [calendar.fetches for calendar in client.calendars] == [2, 1]
+
+
+def test_missing_tag_always_refetches(cache, client):
+    for calendar in client.calendars:
+        calendar.ctag = None
+    cache.refresh()
+    cache.refresh()
+    assert [calendar.fetches for calendar in client.calendars] == [2, 2]
+
+
+def test_stale_data_is_served_while_refreshing(cache, client):
+    old = cache.get_events()
+    calendar = client.calendars[0]
+    calendar.events = 2
+    calendar.ctag = 'ctag-2'
+    calendar.gate.clear()
+    cache.ttl = 0
+
+    # The refresh is stuck on the gate, yet the caller gets the old events at once
+    started = time.monotonic()
+    assert cache.get_events() == old
+    assert time.monotonic() - started < 1
+    _wait_for(lambda: calendar.fetches == 2)
+    assert cache.get_events() == old
+
+    calendar.gate.set()
+    cache.ttl = 300
+    _wait_for(lambda: not cache._refreshing)
+    assert len(cache.get_events()) == len(old) - 2
+
+
+def test_failed_refresh_keeps_previous_events(cache, client):
+    old = cache.get_events()
+    calendar = client.calendars[0]
+    calendar.ctag = 'ctag-2'
+    calendar.error = ConnectionError('server down')
+
+    with pytest.raises(ConnectionError):
+        cache.refresh()
+    assert _titles(cache.get_events()) == _titles(old)
+
+    # Same through the background path, which records the error instead of raising
+    cache.ttl = 0
+    assert _titles(cache.get_events()) == _titles(old)
+    _wait_for(lambda: cache._error is not None)
+    _wait_for(lambda: not cache._refreshing)
+    cache.ttl = 300
+    assert _titles(cache.get_events()) == _titles(old)
+
+    calendar.error = None
+    cache.refresh()
+    assert cache._error is None
+
+
+def test_concurrent_cold_reads_share_one_sync(cache, client):
+    for calendar in client.calendars:
+        calendar.gate.clear()
+    results = []
+    readers = [threading.Thread(target=lambda: results.append(cache.get_events()), daemon=True) for _ in range(8)]
+    for reader in readers:
+        reader.start()
+    try:
+        _wait_for(lambda: all(calendar.fetches == 1 for calendar in client.calendars))
+    finally:
+        for calendar in client.calendars:
+            calendar.gate.set()
+    for reader in readers:
+        reader.join()
+
+    assert [calendar.fetches for calendar in client.calendars] == [1, 1]
+    assert len(results) == 8 and all(result == results[0] for result in results)
+    assert len(results[0]) == 8
+
+
+def test_failed_cold_sync_is_retried_in_the_background(cache, client):
+    client.calendars[0].error = ConnectionError('server down')
+    assert cache.get_events() == []
+    assert cache.error() == 'server down'
+
+    # Later callers get the error without syncing again themselves
+    assert cache.get_events() == []
+    assert client.calendars[0].fetches == 1
+
+    client.calendars[0].error = None
+    cache.retry_interval = 0
+    assert cache.get_events() == []
+    _wait_for(lambda: cache.error() is None and not cache._refreshing)
+    assert len(cache.get_events()) == 8
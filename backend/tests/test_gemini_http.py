@@ -0,0 +1,184 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+import pytest
+import requests
+import gemini_service
+import token_monitor
+
+OK = (200, {}, {"candidates": [{"content": {"parts": [{"text": "hi"}]}}]}, 0)
+
+
+class Upstream:
+    """
+    Local stand-in for the Gemini API. Answers each request with the next
+    scripted (status, headers, body, delay); the last one repeats.
+    """
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.requests = 0
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                upstream.requests += 1
+                status, headers, body, delay = upstream.script[0]
+                if len(upstream.script) > 1:
+                    upstream.script.pop(0)
+                time.sleep(delay)
+                data = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    # The client gave up waiting
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}/models/{{model_name}}:generateContent?key={{api_key}}'
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Points gemini_service at an Upstream, with fresh clients and no backoff."""
+    servers = []
+
+    def start(*script):
+        server = Upstream(*script)
+        servers.append(server)
+        monkeypatch.setattr(gemini_service, 'GEMINI_API_URL', server.url)
+        return server
+
+    monkeypatch.setattr(gemini_service, 'GEMINI_API_KEY', 'test-key')
+    monkeypatch.setattr(gemini_service, 'BACKOFF_FACTOR', 0)
+    monkeypatch.setattr(gemini_service, '_session', None)
+    monkeypatch.setattr(gemini_service, '_async_client', None)
+    monkeypatch.setattr(token_monitor, 'log_token_usage', lambda *args, **kwargs: None)
+    yield start
+    for server in servers:
+        server.close()
+
+
+def _call_async():
+    async def main():
+        try:
+            return await gemini_service._raw_gemini_call_async('hello')
+        finally:
+            await gemini_service.get_async_client().aclose()
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize('call', [lambda: gemini_service._raw_gemini_call('hello'), _call_async],
+                         ids=['sync', 'async'])
+@pytest.mark.parametrize('status', [429, 503])
+def test_overload_statuses_are_retried(upstream, call, status):
+    server = upstream((status, {}, {}, 0), OK)
+    assert gemini_service._extract_text(call()) == 'hi'
+    assert server.requests == 2
+
+
+@pytest.mark.parametrize('call', [lambda: gemini_service._raw_gemini_call('hello'), _call_async],
+                         ids=['sync', 'async'])
+def test_retries_are_bounded(upstream, monkeypatch, call):
+    monkeypatch.setattr(gemini_service, 'MAX_RETRIES', 1)
+    server = upstream((503, {}, {}, 0))
+    with pytest.raises(Exception) as error:
+        call()
+    assert error.value.response.status_code == 503
+    assert server.requests == 2
+
+
+@pytest.mark.parametrize('call', [lambda: gemini_service._raw_gemini_call('hello'), _call_async],
+                         ids=['sync', 'async'])
+def test_retry_after_is_honoured(upstream, call):
+    server = upstream((429, {'Retry-After': '1'}, {}, 0), OK)
+    started = time.monotonic()
+    call()
+    assert time.monotonic() - started >= 1
+    assert server.requests == 2
+
+
+@pytest.mark.parametrize('call', [lambda: gemini_service._raw_gemini_call('hello'), _call_async],
+                         ids=['sync', 'async'])
+def test_retry_after_is_capped(upstream, monkeypatch, call):
+    monkeypatch.setattr(gemini_service, 'MAX_RETRY_AFTER', 0.1)
+    server = upstream((503, {'Retry-After': '120'}, {}, 0), OK)
+    started = time.monotonic()
+    call()
+    assert time.monotonic() - started < 2
+    assert server.requests == 2
+
+
+@pytest.mark.parametrize('call', [lambda: gemini_service._raw_gemini_call('hello'), _call_async],
+                         ids=['sync', 'async'])
+def test_read_timeout_is_not_retried(upstream, monkeypatch, call):
+    monkeypatch.setattr(gemini_service, 'READ_TIMEOUT', 0.2)
+    server = upstream((200, {}, {}, 1))
+    with pytest.raises((requests.ConnectionError, httpx.ReadTimeout)):
+        call()
+    assert server.requests == 1
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = gemini_service.CircuitBreaker(window=4, threshold=0.5, min_calls=2, reset_timeout=0.3)
+    monkeypatch.setattr(gemini_service, 'breaker', breaker)
+    monkeypatch.setattr(gemini_service, 'MAX_RETRIES', 0)
+    return breaker
+
+
+def test_breaker_opens_after_failures_and_half_opens_after_cooldown(upstream, breaker):
+    server = upstream((500, {}, {}, 0), (500, {}, {}, 0), OK)
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            gemini_service._guarded_gemini_call('hello', 'gemini-1.5-flash')
+    assert breaker.state == 'open'
+
+    # Rejected without reaching the upstream
+    with pytest.raises(gemini_service.GeminiUnavailable):
+        gemini_service._guarded_gemini_call('hello', 'gemini-1.5-flash')
+    assert server.requests == 2
+
+    time.sleep(0.3)
+    assert breaker.state == 'half-open'
+    assert gemini_service._extract_text(gemini_service._guarded_gemini_call('hello', 'gemini-1.5-flash')) == 'hi'
+    assert breaker.state == 'closed'
+    assert server.requests == 3
+
+
+def test_failed_trial_reopens_the_breaker(upstream, breaker):
+    server = upstream((503, {}, {}, 0))
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            gemini_service._guarded_gemini_call('hello', 'gemini-1.5-flash')
+    time.sleep(0.3)
+    with pytest.raises(requests.HTTPError):
+        gemini_service._guarded_gemini_call('hello', 'gemini-1.5-flash')
+    assert breaker.state == 'open'
+    assert server.requests == 3
+
+
+def test_client_errors_do_not_open_the_breaker(upstream, breaker):
+    upstream((400, {}, {}, 0))
+    for _ in range(4):
+        with pytest.raises(requests.HTTPError):
+            gemini_service._guarded_gemini_call('hello', 'gemini-1.5-flash')
+    assert breaker.state == 'closed'
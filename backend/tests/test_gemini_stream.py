@@ -0,0 +1,199 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from bench import fakes
+import gemini_service
+import token_monitor
+
+MODEL = 'gemini-1.5-flash'
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def _point_at(monkeypatch, base_url):
+    monkeypatch.setattr(gemini_service, 'GEMINI_API_URL',
+                        base_url + '/models/{model_name}:generateContent?key={api_key}')
+    monkeypatch.setattr(gemini_service, 'GEMINI_STREAM_URL',
+                        base_url + '/models/{model_name}:streamGenerateContent?alt=sse&key={api_key}')
+
+
+@pytest.fixture
+def usage(monkeypatch):
+    """Fresh cache, breaker and clients; collects what would be logged to token_usage."""
+    logged = []
+    monkeypatch.setattr(gemini_service, 'GEMINI_API_KEY', 'test-key')
+    monkeypatch.setattr(gemini_service, '_response_cache', gemini_service.ResponseCache())
+    monkeypatch.setattr(gemini_service, 'breaker', gemini_service.CircuitBreaker())
+    monkeypatch.setattr(gemini_service, '_session', None)
+    monkeypatch.setattr(gemini_service, '_async_client', None)
+    monkeypatch.setattr(token_monitor, 'log_token_usage', lambda *args, **kwargs: logged.append(args))
+    return logged
+
+
+@pytest.fixture
+def gemini(usage, monkeypatch):
+    fake = fakes.FakeGemini(latency=0.01, chunk_delay=0.02).start()
+    _point_at(monkeypatch, fake.base_url)
+    yield fake
+    fake.stop()
+
+
+def _run(coroutine):
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await gemini_service.get_async_client().aclose()
+    return asyncio.run(main())
+
+
+async def _collect(pieces):
+    return [piece async for piece in pieces]
+
+
+class _SplitSSE:
+    """Serves one SSE answer in chunked encoding, cut every `size` bytes regardless of event boundaries."""
+
+    def __init__(self, size=7):
+        events = [{"candidates": [{"content": {"parts": [{"text": word}]}}]} for word in ('a ', 'b ', 'c')]
+        events[-1]["usageMetadata"] = fakes.FakeGemini.USAGE
+        body = ': keep-alive\r\n\r\n' + ''.join(f'data: {json.dumps(event)}\r\n\r\n' for event in events)
+        body = body.encode()
+        pieces = [body[i:i + size] for i in range(0, len(body), size)]
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for piece in pieces:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(piece), piece))
+                    self.wfile.flush()
+                self.wfile.write(b'0\r\n\r\n')
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+        self.base_url = f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def split_sse(usage, monkeypatch):
+    server = _SplitSSE()
+    _point_at(monkeypatch, server.base_url)
+    yield server
+    server.stop()
+
+
+def test_sse_events_split_across_chunks(split_sse, usage):
+    assert list(gemini_service.stream_gemini('hello', use_cache=False)) == ['a ', 'b ', 'c']
+    assert usage == [(MODEL, 48, 12, True)]
+
+
+def test_sse_events_split_across_chunks_async(split_sse, usage):
+    assert _run(_collect(gemini_service.stream_gemini_async('hello', use_cache=False))) == ['a ', 'b ', 'c']
+    assert usage == [(MODEL, 48, 12, True)]
+
+
+def test_usage_logged_once_per_stream(gemini, usage):
+    assert ''.join(gemini_service.stream_gemini('hello')) == gemini.TEXT
+    assert usage == [(MODEL, 48, 12, True)]
+
+    # Answered from the cache, by either entry point
+    assert list(gemini_service.stream_gemini('hello')) == [gemini.TEXT]
+    assert gemini_service.call_gemini('hello') == gemini.TEXT
+    assert gemini.calls == 1
+    assert len(usage) == 1
+
+
+def test_concurrent_identical_streams_share_one_call(gemini, usage):
+    results = []
+    barrier = threading.Barrier(6)
+
+    def read():
+        barrier.wait()
+        results.append(''.join(gemini_service.stream_gemini('hello')))
+
+    workers = [threading.Thread(target=read) for _ in range(6)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert results == [gemini.TEXT] * 6
+    assert gemini.calls == 1
+    assert usage == [(MODEL, 48, 12, True)]
+
+
+def test_concurrent_identical_streams_share_one_call_async(gemini, usage):
+    async def main():
+        return await asyncio.gather(*[_collect(gemini_service.stream_gemini_async('hello')) for _ in range(6)])
+
+    results = _run(main())
+    assert [''.join(pieces) for pieces in results] == [gemini.TEXT] * 6
+    assert gemini.calls == 1
+    assert usage == [(MODEL, 48, 12, True)]
+
+
+def test_cache_is_filled_only_when_the_stream_completes(gemini):
+    key = (MODEL, 'hello')
+    cache = gemini_service._response_cache
+    pieces = gemini_service.stream_gemini('hello')
+    next(pieces)
+    assert key in cache._inflight
+    for _ in pieces:
+        assert key not in cache._entries
+    assert cache._entries[key][1] == gemini.TEXT
+
+
+def test_client_disconnect_mid_stream(gemini, usage):
+    cache = gemini_service._response_cache
+    pieces = gemini_service.stream_gemini('hello')
+    assert next(pieces) == 'BMO '
+
+    # Another request for the same prompt is waiting on this stream
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(''.join(gemini_service.stream_gemini('hello'))))
+    waiter.start()
+    _wait_for(lambda: cache.stats()['coalesced'] >= 1)
+    pieces.close()
+
+    # Logged once, as a success, and not cached
+    assert usage == [(MODEL, 0, 0, True)]
+    assert gemini_service.breaker.state == 'closed'
+    # The waiter did not hang: it made its own call and got the whole answer
+    waiter.join(timeout=5)
+    assert results == [gemini.TEXT]
+    assert gemini.calls == 2
+    assert len(usage) == 2
+    assert cache._inflight == {}
+
+
+def test_client_disconnect_mid_stream_async(gemini, usage):
+    async def main():
+        pieces = gemini_service.stream_gemini_async('hello')
+        assert await pieces.__anext__() == 'BMO '
+        await pieces.aclose()
+
+    _run(main())
+    assert usage == [(MODEL, 0, 0, True)]
+    assert gemini_service._response_cache._inflight == {}
+    assert (MODEL, 'hello') not in gemini_service._response_cache._entries
@@ -0,0 +1,64 @@
+import asyncio
+import sqlite3
+import pytest
+from bench import fakes
+from git_watcher import GitWatcher
+
+
+def _add_activity(database, title):
+    with database.connection() as conn:
+        return conn.execute("INSERT INTO activities (title, status) VALUES (?, 'Pending')",
+                            (title,)).lastrowid
+
+
+def _status(database, activity_id):
+    with database.connection() as conn:
+        return conn.execute('SELECT status FROM activities WHERE id = ?', (activity_id,)).fetchone()[0]
+
+
+@pytest.fixture
+def watcher(database, tmp_path):
+    return GitWatcher(fakes.make_fake_repo(str(tmp_path / 'repo')), database.connection)
+
+
+def test_applies_complete_markers(database, watcher, monkeypatch):
+    activity_id = _add_activity(database, 'Ship it')
+    monkeypatch.setattr(watcher, '_commit_messages', lambda last, head: f'Done #complete {activity_id}\n\x00')
+
+    assert watcher.poll() == [activity_id]
+    assert _status(database, activity_id) == 'Completed'
+    # Refs have not moved since
+    assert watcher.poll() == []
+
+
+def test_failed_poll_is_retried_without_a_ref_change(database, watcher, monkeypatch):
+    activity_id = _add_activity(database, 'Ship it')
+
+    def locked(last, head):
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(watcher, '_commit_messages', locked)
+    with pytest.raises(sqlite3.OperationalError):
+        watcher.poll()
+    assert _status(database, activity_id) == 'Pending'
+
+    monkeypatch.setattr(watcher, '_commit_messages', lambda last, head: f'Done #complete {activity_id}\n\x00')
+    assert watcher.poll() == [activity_id]
+    assert _status(database, activity_id) == 'Completed'
+
+
+def test_failed_async_poll_is_retried(database, watcher, monkeypatch):
+    activity_id = _add_activity(database, 'Ship it')
+
+    async def locked(last, head):
+        raise sqlite3.OperationalError('database is locked')
+
+    async def messages(last, head):
+        return f'Done #complete {activity_id}\n\x00'
+
+    monkeypatch.setattr(watcher, '_commit_messages_async', locked)
+    with pytest.raises(sqlite3.OperationalError):
+        asyncio.run(watcher.poll_async())
+
+    monkeypatch.setattr(watcher, '_commit_messages_async', messages)
+    assert asyncio.run(watcher.poll_async()) == [activity_id]
@@ -0,0 +1,104 @@
+import asyncio
+import socket
+import time
+import pytest
+from bench import fakes
+import gemini_service
+import token_monitor
+
+
+def _dead_url():
+    """A local port nobody is listening on."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return f'http://127.0.0.1:{sock.getsockname()[1]}'
+
+
+@pytest.fixture
+def ollama():
+    fake = fakes.FakeOllama(latency=0.01, chunk_delay=0.01).start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def gemini():
+    fake = fakes.FakeGemini(latency=0.05, chunk_delay=0.01).start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def router(ollama, gemini, monkeypatch):
+    """The router as _build_router() makes it, against the fakes, with fresh breakers."""
+    monkeypatch.setattr(gemini_service, 'OLLAMA_URL', ollama.base_url)
+    monkeypatch.setattr(gemini_service, 'GEMINI_API_KEY', 'test-key')
+    monkeypatch.setattr(gemini_service, 'GEMINI_API_URL',
+                        gemini.base_url + '/models/{model_name}:generateContent?key={api_key}')
+    monkeypatch.setattr(gemini_service, 'GEMINI_STREAM_URL',
+                        gemini.base_url + '/models/{model_name}:streamGenerateContent?alt=sse&key={api_key}')
+    monkeypatch.setattr(gemini_service, 'ollama_breaker',
+                        gemini_service.CircuitBreaker(window=4, threshold=0.5, min_calls=2, reset_timeout=0.3))
+    monkeypatch.setattr(gemini_service, 'breaker', gemini_service.CircuitBreaker())
+    for name in ('_session', '_ollama_session', '_async_client', '_ollama_async_client'):
+        monkeypatch.setattr(gemini_service, name, None)
+    monkeypatch.setattr(token_monitor, 'log_token_usage', lambda *args, **kwargs: None)
+    router = gemini_service._build_router()
+    router.explore_rate = 0
+    return router
+
+
+def test_prefers_the_local_model(router, ollama, gemini):
+    # Each backend answers once to get measured
+    assert {router.call('hello'), router.call('hello')} == {ollama.TEXT, gemini.TEXT}
+    for _ in range(3):
+        assert router.call('hello') == ollama.TEXT
+    assert ''.join(router.stream('hello')).strip() == ollama.TEXT
+    assert (ollama.calls, gemini.calls) == (5, 1)
+
+
+def test_falls_back_at_once_when_ollama_is_down(router, gemini, monkeypatch):
+    monkeypatch.setattr(gemini_service, 'OLLAMA_URL', _dead_url())
+    started = time.monotonic()
+    assert router.call('hello') == gemini.TEXT
+    # No retries and backoff against the local server before moving on
+    assert time.monotonic() - started < 0.5
+    assert ''.join(router.stream('hello')) == gemini.TEXT
+    assert gemini.calls == 2
+
+
+def test_falls_back_at_once_when_ollama_is_down_async(router, gemini, monkeypatch):
+    monkeypatch.setattr(gemini_service, 'OLLAMA_URL', _dead_url())
+
+    async def main():
+        try:
+            started = time.monotonic()
+            text = await router.call_async('hello')
+            elapsed = time.monotonic() - started
+            pieces = [piece async for piece in router.stream_async('hello')]
+            return text, elapsed, ''.join(pieces)
+        finally:
+            await gemini_service.close_async_clients()
+
+    text, elapsed, streamed = asyncio.run(main())
+    assert text == streamed == gemini.TEXT
+    assert elapsed < 0.5
+
+
+def test_skips_ollama_while_its_circuit_is_open_and_recovers(router, ollama, gemini, monkeypatch):
+    live_url = gemini_service.OLLAMA_URL
+    monkeypatch.setattr(gemini_service, 'OLLAMA_URL', _dead_url())
+    for _ in range(2):
+        assert router.call('hello') == gemini.TEXT
+    assert gemini_service.ollama_breaker.state == 'open'
+
+    # Back up, but not tried until the cooldown is over
+    monkeypatch.setattr(gemini_service, 'OLLAMA_URL', live_url)
+    assert router.call('hello') == gemini.TEXT
+    assert ollama.calls == 0
+
+    time.sleep(0.3)
+    assert router.call('hello') == ollama.TEXT
+    assert gemini_service.ollama_breaker.state == 'closed'
+    assert router.call('hello') == ollama.TEXT
+    assert (ollama.calls, gemini.calls) == (2, 3)
@@ -0,0 +1,16 @@
+import os
+from process_sampler import ProcessSampler
+
+
+def test_concurrent_first_reads_take_one_sample(race):
+    sampler = ProcessSampler(interval=60, top=3)
+    results = race(sampler.latest)
+    assert sampler._tick == 1
+    assert all(result is results[0] for result in results)
+
+
+def test_concurrent_samples_do_not_interleave(race):
+    sampler = ProcessSampler(interval=60, top=3)
+    race(sampler.sample, threads=8)
+    assert sampler._tick == 8
+    assert os.getpid() in sampler._tracked
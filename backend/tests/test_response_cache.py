@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+import pytest
+from gemini_service import ResponseCache
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+class Interrupted(BaseException):
+    """Stands in for KeyboardInterrupt / GeneratorExit in a leader."""
+
+
+def test_concurrent_loads_share_one_call():
+    cache = ResponseCache()
+    calls = []
+    release = threading.Event()
+
+    def load():
+        calls.append(1)
+        release.wait()
+        return 'answer'
+
+    results = []
+    workers = [threading.Thread(target=lambda: results.append(cache.get_or_load('k', load))) for _ in range(8)]
+    for worker in workers:
+        worker.start()
+    _wait_for(lambda: cache.stats()['coalesced'] >= 7)
+    release.set()
+    for worker in workers:
+        worker.join()
+
+    assert results == ['answer'] * 8
+    assert len(calls) == 1
+    assert cache._inflight == {}
+    assert cache.get_or_load('k', lambda: 'other') == 'answer'
+
+
+def test_leader_error_reaches_waiters_and_is_not_cached():
+    cache = ResponseCache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait()
+        raise ConnectionError('down')
+
+    errors = []
+
+    def lead():
+        try:
+            cache.get_or_load('k', fail)
+        except ConnectionError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    started.wait()
+    waiter = threading.Thread(target=lead)
+    waiter.start()
+    _wait_for(lambda: cache.stats()['coalesced'] >= 1)
+    release.set()
+    leader.join()
+    waiter.join()
+
+    assert len(errors) == 2
+    assert cache._inflight == {}
+    assert cache.get_or_load('k', lambda: 'answer') == 'answer'
+
+
+def test_interrupted_sync_leader_hands_over_to_a_waiter():
+    cache = ResponseCache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def interrupted():
+        started.set()
+        release.wait()
+        raise Interrupted()
+
+    def lead():
+        with pytest.raises(Interrupted):
+            cache.get_or_load('k', interrupted)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    started.wait()
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(cache.get_or_load('k', lambda: 'retried')))
+    waiter.start()
+    _wait_for(lambda: cache.stats()['coalesced'] >= 1)
+    release.set()
+    leader.join()
+    waiter.join(timeout=5)
+
+    assert results == ['retried']
+    assert cache._inflight == {}
+
+
+def test_cancelled_async_leader_does_not_strand_waiters():
+    cache = ResponseCache()
+
+    async def main():
+        started = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(60)
+
+        async def fast():
+            return 'retried'
+
+        leader = asyncio.create_task(cache.get_or_load_async('k', slow))
+        await started.wait()
+        waiter = asyncio.create_task(cache.get_or_load_async('k', fast))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.wait_for(waiter, 5)
+
+    assert asyncio.run(main()) == 'retried'
+    assert cache._inflight == {}
+    assert cache.stats()['coalesced'] == 1
+
+
+def test_cancelled_async_waiter_leaves_the_load_running():
+    cache = ResponseCache()
+
+    async def main():
+        release = asyncio.Event()
+
+        async def load():
+            await release.wait()
+            return 'answer'
+
+        leader = asyncio.create_task(cache.get_or_load_async('k', load))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_load_async('k', load))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        release.set()
+        return await leader
+
+    assert asyncio.run(main()) == 'answer'
+    assert cache._inflight == {}
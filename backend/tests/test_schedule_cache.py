@@ -0,0 +1,50 @@
+import pytest
+from bench import fakes
+from schedule_cache import ScheduleCache
+
+
+@pytest.fixture
+def openclaw(tmp_path):
+    return fakes.write_fake_openclaw(str(tmp_path), jobs=3, latency=0)
+
+
+def test_get_never_runs_the_cli(monkeypatch):
+    cache = ScheduleCache(['/nonexistent/openclaw'])
+    calls = []
+    monkeypatch.setattr(cache, '_run_command', lambda: calls.append(1))
+
+    assert cache.get() == {"jobs": [], "age": None, "last_error": None}
+    assert calls == []
+
+
+def test_failed_first_refresh_is_reported_without_jobs():
+    cache = ScheduleCache(['/nonexistent/openclaw'])
+    with pytest.raises(OSError):
+        cache.refresh()
+
+    payload = cache.get()
+    assert payload["jobs"] == [] and payload["age"] is None
+    assert 'nonexistent' in payload["last_error"]
+
+
+def test_failed_refresh_keeps_previous_jobs(openclaw, tmp_path):
+    cache = ScheduleCache([openclaw])
+    cache.refresh()
+    jobs = cache.get()["jobs"]
+    assert [job["name"] for job in jobs] == ['job-1', 'job-2', 'job-3']
+
+    cache.command = [str(tmp_path / 'missing')]
+    with pytest.raises(OSError):
+        cache.refresh()
+    payload = cache.get()
+    assert [job["name"] for job in payload["jobs"]] == ['job-1', 'job-2', 'job-3']
+    assert payload["age"] is not None
+    assert payload["last_error"]
+
+
+def test_timeout_is_reported(tmp_path):
+    slow = fakes.write_fake_openclaw(str(tmp_path), latency=5)
+    cache = ScheduleCache([slow], timeout=0.2)
+    with pytest.raises(Exception):
+        cache.refresh()
+    assert cache.get()["last_error"] == "Timed out after 0.2s"
@@ -0,0 +1,59 @@
+import os
+import threading
+import time
+from static_assets import StaticIndex
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _write(root, rel_path, text, mtime):
+    path = os.path.join(root, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+    os.utime(path, (mtime, mtime))
+
+
+def _body(asset):
+    return asset.variants['identity'][0]
+
+
+def test_rebuild_runs_once_in_the_background(tmp_path):
+    root = str(tmp_path)
+    _write(root, 'index.html', '<html>v1</html>', 1000)
+    _write(root, 'assets/app-1a2b3c4d.js', 'console.log(1)', 1000)
+    index = StaticIndex(root, check_interval=0)
+    assert _body(index.lookup('/')) == b'<html>v1</html>'
+
+    # Hold the rebuild on its first file
+    release = threading.Event()
+    builds = []
+    load = index._load
+
+    def slow_load(rel_path):
+        release.wait()
+        return load(rel_path)
+
+    build = index._build
+
+    def counted_build():
+        builds.append(1)
+        return build()
+
+    index._load = slow_load
+    index._build = counted_build
+    _write(root, 'index.html', '<html>v2</html>', 2000)
+
+    # Every lookup notices the change, none waits for it or starts a second build
+    for _ in range(5):
+        assert _body(index.lookup('/')) == b'<html>v1</html>'
+    _wait_for(lambda: index._build_lock.locked())
+    release.set()
+    _wait_for(lambda: _body(index.lookup('/')) == b'<html>v2</html>')
+    _wait_for(lambda: not index._build_lock.locked())
+    assert builds == [1]
@@ -0,0 +1,16 @@
+from stats_sampler import RingBuffer, StatsSampler
+
+
+def test_ring_buffer_overwrites_oldest():
+    buffer = RingBuffer(3, fields=['time', 'cpu'])
+    for i in range(5):
+        buffer.append({'time': float(i), 'cpu': float(i * 10)})
+    assert len(buffer) == 3
+    assert buffer.snapshot() == {'time': [2.0, 3.0, 4.0], 'cpu': [20.0, 30.0, 40.0]}
+
+
+def test_concurrent_first_reads_take_one_sample(race):
+    sampler = StatsSampler(interval=60)
+    results = race(sampler.latest)
+    assert len(sampler.history) == 1
+    assert all(result is results[0] for result in results)
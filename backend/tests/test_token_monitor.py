@@ -0,0 +1,129 @@
+import datetime
+import pytest
+import app as app_module
+import token_monitor
+from token_monitor import SlidingWindow, TokenBudget
+
+NOW = datetime.datetime(2026, 3, 15, 12, 0).timestamp()
+
+
+def test_sliding_window_expires_by_bucket():
+    window = SlidingWindow(60, 1)
+    window.add(5, NOW + 0.5)
+    window.add(7, NOW + 30)
+    assert window.value(NOW + 59.9) == 12
+    assert window.value(NOW + 60) == 7
+    assert window.value(NOW + 90) == 0
+
+    # Far ahead: every bucket is cleared, not just the first lap
+    window.add(3, NOW + 100)
+    assert window.value(NOW + 100000) == 0
+
+
+def test_sliding_window_drops_late_adds_outside_the_span():
+    window = SlidingWindow(60, 1)
+    window.add(1, NOW + 100)
+    window.add(10, NOW + 40)  # 60 s before the newest bucket
+    window.add(20, NOW + 41)
+    assert window.value(NOW + 100) == 21
+    assert window.value(NOW + 101) == 1
+
+
+def test_day_window_counts_whole_minutes():
+    window = SlidingWindow(86400, 60)
+    window.add(100, NOW + 59)
+    assert window.value(NOW + 86399) == 100
+    assert window.value(NOW + 86400) == 0
+
+
+def test_check_blocks_once_the_budget_is_used_up():
+    budget = TokenBudget(limits={"minute": 0, "day": 1000, "month": 0}, model_limits={}, unmetered=())
+    budget.record('gemini-1.5-flash', 999, now=NOW)
+    assert budget.check('gemini-1.5-flash', now=NOW) is None
+    # At the limit there is nothing left for another call
+    budget.record('gemini-1.5-flash', 1, now=NOW)
+    assert budget.check('gemini-1.5-flash', now=NOW) == "day token budget of 1000 exhausted"
+    assert budget.check('gemini-1.5-flash', now=NOW + 86400) is None
+
+
+def test_check_with_unlimited_windows_never_blocks():
+    budget = TokenBudget(limits={"minute": 0, "day": 0, "month": 0}, model_limits={}, unmetered=())
+    budget.record('gemini-1.5-flash', 10 ** 9, now=NOW)
+    assert budget.check('gemini-1.5-flash', now=NOW) is None
+
+
+def test_check_per_model_limits_and_unmetered_models():
+    budget = TokenBudget(limits={"minute": 0, "day": 0, "month": 100},
+                         model_limits={"gemini-1.5-pro": {"minute": 50}}, unmetered={"llama3"})
+    budget.record('llama3', 500, now=NOW)
+    assert budget.check('gemini-1.5-flash', now=NOW) is None
+    assert budget.check('llama3', now=NOW) is None
+
+    budget.record('gemini-1.5-pro', 50, now=NOW)
+    assert budget.check('gemini-1.5-pro', now=NOW) == "minute token budget of 50 for gemini-1.5-pro exhausted"
+    assert budget.check('gemini-1.5-flash', now=NOW) is None
+    assert budget.check('gemini-1.5-pro', now=NOW + 60) is None
+
+    budget.record('gemini-1.5-flash', 50, now=NOW)
+    assert budget.check('llama3', now=NOW) == "month token budget of 100 exhausted"
+
+
+def test_status_reports_unlimited_as_zero():
+    budget = TokenBudget(limits={"minute": 0, "day": 1000, "month": 0},
+                         model_limits={"gemini-1.5-pro": {"day": 500}}, unmetered=())
+    budget.record('gemini-1.5-pro', 30, now=NOW)
+    status = budget.status(now=NOW)
+    assert status["month"] == '2026-03'
+    assert status["windows"] == {
+        "minute": {"used": 30, "limit": 0},
+        "day": {"used": 30, "limit": 1000},
+        "month": {"used": 30, "limit": 0},
+    }
+    assert status["models"]["gemini-1.5-pro"] == {
+        "minute": {"used": 30, "limit": 0},
+        "day": {"used": 30, "limit": 500},
+        "month": {"used": 30, "limit": 0},
+    }
+
+
+def test_check_status_agrees_with_check():
+    budget = TokenBudget(limits={"minute": 0, "day": 0, "month": 100},
+                         model_limits={"gemini-1.5-pro": {"day": 40}}, unmetered=())
+    for tokens in (0, 39, 1, 60):
+        budget.record('gemini-1.5-pro', tokens, now=NOW)
+        status = budget.status(now=NOW)
+        for model in ('gemini-1.5-pro', 'gemini-1.5-flash'):
+            assert token_monitor.check_status(status, model) == budget.check(model, now=NOW)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app_module, '_started', True)
+    return app_module.app.test_client()
+
+
+def _status(client, monkeypatch, limit, used):
+    budget = TokenBudget(limits={"minute": 0, "day": 0, "month": limit}, model_limits={}, unmetered=())
+    budget.record('gemini-1.5-flash', used)
+    monkeypatch.setattr(token_monitor, 'budget', budget)
+    return client.get('/api/token-usage/status').get_json()
+
+
+@pytest.mark.parametrize('used, expected', [
+    (800, "OK"),
+    (801, "Approaching Limit"),
+    (1000, "Approaching Limit"),
+    (1001, "Limit Exceeded"),
+])
+def test_status_endpoint_thresholds(client, monkeypatch, used, expected):
+    data = _status(client, monkeypatch, 1000, used)
+    assert data["status"] == expected
+    assert (data["used"], data["limit"]) == (used, 1000)
+    assert data["percentage"] == round(used / 10, 2)
+
+
+def test_status_endpoint_without_a_monthly_limit(client, monkeypatch):
+    data = _status(client, monkeypatch, 0, 5000)
+    assert data["status"] == "OK"
+    assert (data["used"], data["limit"], data["percentage"]) == (5000, 0, 0)
+    assert data["windows"]["month"] == {"used": 5000, "limit": 0}
@@ -0,0 +1,99 @@
+import datetime
+import glob
+import gzip
+import json
+import os
+import pytest
+import token_retention
+from test_token_rollups import ROWS, insert_usage, rollups
+
+# 20 days of retention on this date keeps only the 2026-02-14 row of ROWS
+NOW = datetime.datetime(2026, 3, 1, 12, 30)
+DAYS = 20
+
+
+def _archived(archive_dir):
+    rows = []
+    for path in sorted(glob.glob(os.path.join(archive_dir, 'token_usage-*.jsonl.gz'))):
+        with gzip.open(path, 'rt') as f:
+            rows.extend(json.loads(line) for line in f)
+    return rows
+
+
+@pytest.fixture
+def archive_dir(tmp_path):
+    return str(tmp_path / 'archive')
+
+
+def _raw(database):
+    with database.connection() as conn:
+        return [dict(row) for row in conn.execute('SELECT * FROM token_usage ORDER BY id')]
+
+
+def test_prunes_by_day_and_keeps_the_rollups(database, archive_dir):
+    with database.connection() as conn:
+        insert_usage(conn, ROWS)
+        expected = rollups(conn)
+    before = _raw(database)
+
+    result = token_retention.apply_retention(DAYS, archive_dir, now=NOW)
+
+    assert result['cutoff'] == '2026-02-09 12:00:00'
+    assert result['days'] == ['2026-01-31', '2026-02-01']
+    assert result['deleted'] == 5
+    assert result['repaired'] == 0
+    assert [row['timestamp'] for row in _raw(database)] == ['2026-02-14 12:30:00']
+    with database.connection() as conn:
+        assert rollups(conn) == expected
+
+    # The archive holds exactly the deleted rows, one file per day
+    assert sorted(os.listdir(archive_dir)) == ['token_usage-2026-01-31.jsonl.gz', 'token_usage-2026-02-01.jsonl.gz']
+    assert _archived(archive_dir) == before[:5]
+
+    # Nothing left to do
+    assert token_retention.apply_retention(DAYS, archive_dir, now=NOW)['deleted'] == 0
+    assert len(_archived(archive_dir)) == 5
+
+
+def test_cutoff_never_splits_an_hour(database, archive_dir):
+    with database.connection() as conn:
+        insert_usage(conn, ROWS)
+    # 23:10 and 23:50 share an hour; a cutoff at 23:40 must keep both
+    result = token_retention.apply_retention(1, archive_dir, now=datetime.datetime(2026, 2, 1, 23, 40))
+    assert result['cutoff'] == '2026-01-31 23:00:00'
+    assert result['deleted'] == 0
+    assert len(_raw(database)) == len(ROWS)
+
+
+def test_rollup_mismatch_is_repaired_before_deleting(database, archive_dir):
+    with database.connection() as conn:
+        insert_usage(conn, ROWS)
+        expected = rollups(conn)
+        conn.execute('''
+            UPDATE token_usage_hourly SET prompt_tokens = 0, call_count = 0
+            WHERE hour = '2026-01-31 23:00' AND model_name = 'gemini-1.5-flash'
+        ''')
+        conn.execute("DELETE FROM token_usage_hourly WHERE hour = '2026-02-01 09:00'")
+
+    result = token_retention.apply_retention(DAYS, archive_dir, now=NOW)
+
+    assert result['repaired'] >= 1
+    assert result['deleted'] == 5
+    # Only the raw rows could have restored these, and they are gone now
+    with database.connection() as conn:
+        assert rollups(conn) == expected
+
+
+def test_without_an_archive_dir_rows_are_only_deleted(database, archive_dir):
+    with database.connection() as conn:
+        insert_usage(conn, ROWS)
+    result = token_retention.apply_retention(DAYS, None, now=NOW)
+    assert result['deleted'] == 5
+    assert not os.path.exists(archive_dir)
+
+
+def test_zero_days_keeps_everything(database, archive_dir):
+    with database.connection() as conn:
+        insert_usage(conn, ROWS)
+    assert token_retention.apply_retention(0, archive_dir, now=NOW)['deleted'] == 0
+    assert len(_raw(database)) == len(ROWS)
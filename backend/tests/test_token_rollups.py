@@ -0,0 +1,83 @@
+import pytest
+import token_rollups
+
+# (timestamp, model, prompt, completion, total, api_call_count, success)
+ROWS = [
+    ('2026-01-31 23:10:00', 'gemini-1.5-flash', 10, 5, 15, 1, 1),
+    ('2026-01-31 23:50:00', 'gemini-1.5-flash', 20, 8, 28, 1, 0),
+    ('2026-01-31 23:55:00', 'llama3', 7, 3, 10, 1, 1),
+    ('2026-02-01 00:05:00', 'gemini-1.5-flash', 30, 12, 42, 2, 1),
+    ('2026-02-01 09:00:00', 'gemini-1.5-flash', None, None, None, None, 0),
+    ('2026-02-14 12:30:00', 'llama3', 100, 40, 140, 1, 1),
+]
+
+TABLES = {'token_usage_hourly': 'hour', 'token_usage_daily': 'day', 'token_usage_monthly': 'month'}
+
+
+def insert_usage(conn, rows):
+    conn.executemany('''
+        INSERT INTO token_usage (timestamp, model_name, prompt_tokens, completion_tokens,
+                                 total_tokens, api_call_count, success)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+
+def rollups(conn):
+    """Every rollup table as {(period, model): (prompt, completion, total, calls, successes, failures)}."""
+    return {
+        table: {(row[0], row[1]): tuple(row[2:]) for row in conn.execute(f'''
+            SELECT {period}, model_name, prompt_tokens, completion_tokens, total_tokens,
+                   call_count, success_count, failure_count
+            FROM {table}
+        ''')}
+        for table, period in TABLES.items()
+    }
+
+
+@pytest.fixture
+def conn(database):
+    with database.connection() as conn:
+        yield conn
+
+
+def test_trigger_totals_match_a_backfill(conn):
+    insert_usage(conn, ROWS)
+    by_trigger = rollups(conn)
+    assert by_trigger['token_usage_monthly'] == {
+        ('2026-01', 'gemini-1.5-flash'): (30, 13, 43, 2, 1, 1),
+        ('2026-01', 'llama3'): (7, 3, 10, 1, 1, 0),
+        ('2026-02', 'gemini-1.5-flash'): (30, 12, 42, 3, 2, 1),
+        ('2026-02', 'llama3'): (100, 40, 140, 1, 1, 0),
+    }
+
+    assert token_rollups.backfill(conn) == len(by_trigger['token_usage_hourly'])
+    assert rollups(conn) == by_trigger
+
+
+def test_backfill_since_keeps_earlier_hours(conn):
+    insert_usage(conn, ROWS)
+    expected = rollups(conn)
+    # Raw rows of January are gone, as after retention; their summaries must stay
+    conn.execute("DELETE FROM token_usage WHERE timestamp < '2026-02-01'")
+    token_rollups.backfill(conn, since='2026-02-01 00:00:00')
+    assert rollups(conn) == expected
+
+
+def test_backfill_if_empty_runs_once(conn):
+    insert_usage(conn, ROWS)
+    expected = rollups(conn)
+    for table in TABLES:
+        conn.execute(f'DELETE FROM {table}')
+
+    assert token_rollups.backfill_if_empty(conn) > 0
+    assert rollups(conn) == expected
+    # Rollups exist now: a second startup must not count the rows again
+    assert token_rollups.backfill_if_empty(conn) == 0
+    assert rollups(conn) == expected
+
+
+def test_backfill_if_empty_leaves_trigger_rollups_alone(conn):
+    insert_usage(conn, ROWS)
+    expected = rollups(conn)
+    assert token_rollups.backfill_if_empty(conn) == 0
+    assert rollups(conn) == expected
@@ -1,59 +1,454 @@
-import sqlite3
 import os
+import json
+import time
+import queue
+import atexit
 import datetime
+import inspect
 import functools
+import threading
+import db
 
-# Handle different DB paths depending on where it's run from
-DB_PATH = os.path.join(os.path.dirname(__file__), 'bmo_dashboard.db')
+INSERT_SQL = '''
+    INSERT INTO token_usage (
+        timestamp, model_name, prompt_tokens, completion_tokens, 
+        total_tokens, api_call_count, success, error_message
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Background writer tuning
+QUEUE_SIZE = int(os.environ.get('BMO_TOKEN_QUEUE_SIZE', 10000))
+BATCH_SIZE = int(os.environ.get('BMO_TOKEN_BATCH_SIZE', 200))
+FLUSH_INTERVAL = float(os.environ.get('BMO_TOKEN_FLUSH_INTERVAL', 1.0))
+# Error messages are stored inline per row; stack traces and HTML error pages get cut
+MAX_ERROR_LENGTH = int(os.environ.get('BMO_TOKEN_MAX_ERROR_LENGTH', 500))
+
+# Token budgets; 0 means unlimited. Per-model limits as JSON, e.g.
+# BMO_TOKEN_MODEL_LIMITS='{"gemini-1.5-pro": {"day": 200000}}'
+TOKEN_LIMITS = {
+    "minute": int(os.environ.get('BMO_TOKEN_LIMIT_MINUTE', 0)),
+    "day": int(os.environ.get('BMO_TOKEN_LIMIT_DAY', 0)),
+    "month": int(os.environ.get('BMO_TOKEN_LIMIT_MONTH', 1000000)),
+}
+MODEL_TOKEN_LIMITS = json.loads(os.environ.get('BMO_TOKEN_MODEL_LIMITS', '{}'))
+# Share of a limit at which status reports "Approaching Limit"
+WARN_RATIO = 0.8
+# Models whose tokens cost nothing (local Ollama models): tracked per model,
+# but left out of the overall limits
+UNMETERED_MODELS = {
+    name.strip() for name in
+    os.environ.get('BMO_TOKEN_UNMETERED_MODELS', os.environ.get('BMO_OLLAMA_MODEL', 'llama3')).split(',')
+    if name.strip()
+}
+
+_STOP = object()
+
+
+class UsageWriter:
+    """
+    Writes token usage records from a bounded in-process queue.
+
+    Callers only enqueue; a worker thread drains the queue and inserts rows
+    with executemany in one transaction whenever BATCH_SIZE records are
+    waiting or FLUSH_INTERVAL seconds have passed. If the queue is full the
+    record is dropped and counted instead of blocking the caller.
+    """
+
+    def __init__(self, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Registers callback(batch) to run after each successfully written batch."""
+        self._listeners.append(callback)
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='token-usage-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, record):
+        """Enqueues a record. Returns False if it had to be dropped."""
+        self.start()
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def flush(self):
+        """Blocks until everything enqueued so far has been written."""
+        self._queue.join()
+
+    def stop(self):
+        """Writes out whatever is still queued and stops the worker."""
+        if not self._thread or not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
+
+    def _write(self, batch):
+        try:
+            with db.connection() as conn:
+                conn.executemany(INSERT_SQL, batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"Failed to log token usage: {e}")
+            return
+        for callback in self._listeners:
+            try:
+                callback(batch)
+            except Exception as e:
+                print(f"Token usage listener error: {e}")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                    self._queue.task_done()
+                else:
+                    batch.append(item)
+                if stopping or len(batch) >= self.batch_size:
+                    break
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write(batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+        # Anything enqueued after the stop marker still gets written
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+            self._queue.task_done()
+        if leftover:
+            self._write(leftover)
+
+
+writer = UsageWriter()
+atexit.register(writer.stop)
+
+
+class SlidingWindow:
+    """
+    Sum over the last `span` seconds, kept in span/resolution ring buckets.
+    The running total is adjusted as buckets expire, so reads are O(1).
+    """
+
+    def __init__(self, span, resolution):
+        self.resolution = resolution
+        self.size = int(span // resolution)
+        self._counts = [0] * self.size
+        self._head = None
+        self.total = 0
+
+    def _advance(self, slot):
+        if self._head is None:
+            self._head = slot
+            return
+        if slot <= self._head:
+            return
+        for s in range(self._head + 1, self._head + 1 + min(slot - self._head, self.size)):
+            i = s % self.size
+            self.total -= self._counts[i]
+            self._counts[i] = 0
+        self._head = slot
+
+    def add(self, amount, now):
+        slot = int(now // self.resolution)
+        if self._head is not None and slot <= self._head - self.size:
+            return  # already outside the window
+        self._advance(slot)
+        self._counts[slot % self.size] += amount
+        self.total += amount
+
+    def value(self, now):
+        self._advance(int(now // self.resolution))
+        return self.total
+
+
+class _Usage:
+    """Minute and day sliding windows plus the calendar-month total, for one scope."""
+
+    def __init__(self):
+        self.minute = SlidingWindow(60, 1)
+        self.day = SlidingWindow(86400, 60)
+        self.month_key = None
+        self.month_total = 0
+
+    def add(self, tokens, now, month_key):
+        self.minute.add(tokens, now)
+        self.day.add(tokens, now)
+        if month_key == self.month_key:
+            self.month_total += tokens
+        elif self.month_key is None or month_key > self.month_key:
+            self.month_key = month_key
+            self.month_total = tokens
+
+    def values(self, now, month_key):
+        return {
+            "minute": self.minute.value(now),
+            "day": self.day.value(now),
+            "month": self.month_total if self.month_key == month_key else 0,
+        }
+
+
+class TokenBudget:
+    """
+    In-memory token counters used to enforce budgets before calling out.
+
+    Every logged call updates an overall and a per-model counter set:
+    a sliding 60 s window, a sliding 24 h window and the calendar month
+    (the billing period). load() seeds them from the database at startup,
+    so check() and status() never touch SQLite.
+    """
+
+    def __init__(self, limits=None, model_limits=None, unmetered=None):
+        self.limits = dict(TOKEN_LIMITS if limits is None else limits)
+        self.model_limits = dict(MODEL_TOKEN_LIMITS if model_limits is None else model_limits)
+        self.unmetered = set(UNMETERED_MODELS if unmetered is None else unmetered)
+        self._lock = threading.Lock()
+        self._total = _Usage()
+        self._models = {}
+
+    @staticmethod
+    def _month_key(now):
+        return datetime.datetime.fromtimestamp(now).strftime('%Y-%m')
+
+    def _add(self, model_name, tokens, now, month_key):
+        if model_name not in self.unmetered:
+            self._total.add(tokens, now, month_key)
+        usage = self._models.get(model_name)
+        if usage is None:
+            usage = self._models[model_name] = _Usage()
+        usage.add(tokens, now, month_key)
+
+    def record(self, model_name, tokens, now=None):
+        if not tokens:
+            return
+        now = time.time() if now is None else now
+        with self._lock:
+            self._add(model_name, tokens, now, self._month_key(now))
+
+    def load(self, conn, now=None):
+        """Rebuilds the counters from token_usage (last 24 h) and the monthly rollup."""
+        now = time.time() if now is None else now
+        month_key = self._month_key(now)
+        since = datetime.datetime.fromtimestamp(now - 86400).strftime('%Y-%m-%d %H:%M:%S')
+        minutes = conn.execute('''
+            SELECT strftime('%Y-%m-%d %H:%M:00', timestamp) AS ts, model_name, SUM(total_tokens)
+            FROM token_usage
+            WHERE timestamp >= ?
+            GROUP BY ts, model_name
+        ''', (since,)).fetchall()
+        months = conn.execute('''
+            SELECT model_name, total_tokens FROM token_usage_monthly WHERE month = ?
+        ''', (month_key,)).fetchall()
+
+        total = _Usage()
+        models = {}
+        def counters(model_name):
+            model = models.setdefault(model_name, _Usage())
+            return (model,) if model_name in self.unmetered else (total, model)
+
+        for ts, model_name, tokens in minutes:
+            at = datetime.datetime.strptime(ts, '%Y-%m-%d %H:%M:%S').timestamp()
+            for usage in counters(model_name):
+                usage.minute.add(tokens or 0, at)
+                usage.day.add(tokens or 0, at)
+        for model_name, tokens in months:
+            for usage in counters(model_name):
+                usage.month_key = month_key
+                usage.month_total += tokens or 0
+        with self._lock:
+            self._total = total
+            self._models = models
+
+    def _exhausted(self, values, limits):
+        for window in ('minute', 'day', 'month'):
+            limit = limits.get(window) or 0
+            if limit and values[window] >= limit:
+                return window, limit
+        return None
+
+    def check(self, model_name, now=None):
+        """None if a call may go out, else a reason string naming the exhausted budget."""
+        now = time.time() if now is None else now
+        month_key = self._month_key(now)
+        with self._lock:
+            hit = self._exhausted(self._total.values(now, month_key), self.limits)
+            if hit:
+                return f"{hit[0]} token budget of {hit[1]} exhausted"
+            usage = self._models.get(model_name)
+            limits = self.model_limits.get(model_name)
+            if usage and limits:
+                hit = self._exhausted(usage.values(now, month_key), limits)
+                if hit:
+                    return f"{hit[0]} token budget of {hit[1]} for {model_name} exhausted"
+        return None
+
+    def status(self, now=None):
+        """Current usage and limits for every window, overall and per model; a limit of 0 is unlimited."""
+        now = time.time() if now is None else now
+        month_key = self._month_key(now)
+        with self._lock:
+            windows = self._total.values(now, month_key)
+            models = {name: usage.values(now, month_key) for name, usage in self._models.items()}
+        return {
+            "month": month_key,
+            "windows": {w: {"used": used, "limit": self.limits.get(w) or 0} for w, used in windows.items()},
+            "models": {
+                name: {w: {"used": used, "limit": (self.model_limits.get(name) or {}).get(w) or 0}
+                       for w, used in values.items()}
+                for name, values in models.items()
+            },
+        }
+
+
+def check_status(status, model_name):
+    """TokenBudget.check() against a status() dict, e.g. one published by another process."""
+    for window, values in status["windows"].items():
+        if values["limit"] and values["used"] >= values["limit"]:
+            return f"{window} token budget of {values['limit']} exhausted"
+    for window, values in (status["models"].get(model_name) or {}).items():
+        if values["limit"] and values["used"] >= values["limit"]:
+            return f"{window} token budget of {values['limit']} for {model_name} exhausted"
+    return None
+
+
+budget = TokenBudget()
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
 
 def log_token_usage(model_name, prompt_tokens, completion_tokens, success, error_message=None):
-    """Logs token usage to the database."""
-    try:
-        conn = get_db_connection()
-        total_tokens = prompt_tokens + completion_tokens
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
-        # Ensure table exists (just in case)
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS token_usage (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                model_name TEXT NOT NULL,
-                prompt_tokens INTEGER,
-                completion_tokens INTEGER,
-                total_tokens INTEGER,
-                api_call_count INTEGER DEFAULT 1,
-                success BOOLEAN,
-                error_message TEXT
-            )
-        ''')
-        
-        conn.execute('''
-            INSERT INTO token_usage (
-                timestamp, model_name, prompt_tokens, completion_tokens, 
-                total_tokens, api_call_count, success, error_message
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            timestamp, model_name, prompt_tokens, completion_tokens, 
-            total_tokens, 1, success, error_message
-        ))
-        conn.commit()
-        conn.close()
-        print(f"Logged token usage: {total_tokens} tokens for {model_name}")
-    except Exception as e:
-        print(f"Failed to log token usage: {e}")
-
-def monitor_gemini_usage(model_name_arg="gemini-1.5-flash"):
+    """Queues a token usage record; the background writer persists it."""
+    total_tokens = prompt_tokens + completion_tokens
+    timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if error_message and len(error_message) > MAX_ERROR_LENGTH:
+        error_message = error_message[:MAX_ERROR_LENGTH]
+    record = (
+        timestamp, model_name, prompt_tokens, completion_tokens,
+        total_tokens, 1, success, error_message
+    )
+    budget.record(model_name, total_tokens)
+    writer.submit(record)
+
+def _has_usage(chunk):
+    # Gemini: usageMetadata; Ollama /api/generate: eval counts on the final object
+    return isinstance(chunk, dict) and ('usageMetadata' in chunk or 'eval_count' in chunk)
+
+def _usage_counts(chunk):
+    """(prompt_tokens, completion_tokens) from a Gemini or Ollama response."""
+    chunk = chunk or {}
+    if 'usageMetadata' in chunk:
+        usage = chunk['usageMetadata']
+        return usage.get('promptTokenCount', 0), usage.get('candidatesTokenCount', 0)
+    return chunk.get('prompt_eval_count', 0), chunk.get('eval_count', 0)
+
+def _log_result(model, result):
+    # If result is a dict, attempt to extract usage
+    if isinstance(result, dict):
+        log_token_usage(model, *_usage_counts(result), True)
+
+def monitor_model_usage(model_name_arg="gemini-1.5-flash"):
     """
-    Decorator to monitor Gemini API usage.
+    Decorator to monitor model API usage (Gemini or Ollama).
     Expects the decorated function to return the full API response (dict).
+    Works on both plain and async functions, and on (async) generators of
+    streamed response chunks, which are logged once the stream ends using
+    the usage of the last chunk that carried one.
     """
     def decorator(func):
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_stream_wrapper(*args, **kwargs):
+                model = kwargs.get('model_name', model_name_arg)
+                last_usage = None
+                failed = False
+                try:
+                    async for chunk in func(*args, **kwargs):
+                        if _has_usage(chunk):
+                            last_usage = chunk
+                        yield chunk
+                except Exception as e:
+                    failed = True
+                    log_token_usage(model, *_usage_counts(last_usage), False, str(e))
+                    raise e
+                finally:
+                    # Also reached when the consumer stops early; tokens so far are billed
+                    if not failed:
+                        log_token_usage(model, *_usage_counts(last_usage), True)
+            return async_stream_wrapper
+
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def stream_wrapper(*args, **kwargs):
+                model = kwargs.get('model_name', model_name_arg)
+                last_usage = None
+                failed = False
+                try:
+                    for chunk in func(*args, **kwargs):
+                        if _has_usage(chunk):
+                            last_usage = chunk
+                        yield chunk
+                except Exception as e:
+                    failed = True
+                    log_token_usage(model, *_usage_counts(last_usage), False, str(e))
+                    raise e
+                finally:
+                    if not failed:
+                        log_token_usage(model, *_usage_counts(last_usage), True)
+            return stream_wrapper
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                model = kwargs.get('model_name', model_name_arg)
+                try:
+                    result = await func(*args, **kwargs)
+                    _log_result(model, result)
+                    return result
+                except Exception as e:
+                    log_token_usage(model, 0, 0, False, str(e))
+                    raise e
+            return async_wrapper
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
             # Determine model name from args or kwargs if possible, otherwise use default
@@ -61,15 +456,7 @@ def monitor_gemini_usage(model_name_arg="gemini-1.5-flash"):
             
             try:
                 result = func(*args, **kwargs)
-                
-                # If result is a dict, attempt to extract usage
-                if isinstance(result, dict):
-                    usage = result.get('usageMetadata', {})
-                    prompt_tokens = usage.get('promptTokenCount', 0)
-                    completion_tokens = usage.get('candidatesTokenCount', 0)
-                    
-                    log_token_usage(model, prompt_tokens, completion_tokens, True)
-                
+                _log_result(model, result)
                 return result
             except Exception as e:
                 # Log failure
@@ -78,3 +465,6 @@ def monitor_gemini_usage(model_name_arg="gemini-1.5-flash"):
                 raise e # Re-raise exception
         return wrapper
     return decorator
+
+# Older name, from when Gemini was the only backend
+monitor_gemini_usage = monitor_model_usage
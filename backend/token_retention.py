@@ -0,0 +1,230 @@
+"""
+Retention for raw token_usage rows.
+
+Every Gemini call adds a raw row, but the dashboard only reads the hourly,
+daily and monthly rollups. Raw rows older than the retention window are
+therefore compacted away, one day at a time:
+
+  1. the day's hourly rollup rows are checked against the raw rows (and
+     rebuilt from them if they disagree), so the per-hour per-model
+     totals, call counts and success/failure counts stay exact;
+  2. the raw rows are appended to a gzipped JSONL file per day in the
+     archive directory, and fsynced;
+  3. the raw rows are deleted.
+
+Cutoffs fall on hour boundaries, so an hour is never split between the
+archive and the table. If the process dies between steps 2 and 3, the next
+run archives the same rows again; each line carries the row id, so
+readers can drop duplicates.
+
+Freed pages are returned to the filesystem with PRAGMA incremental_vacuum.
+That needs auto_vacuum=INCREMENTAL, which new databases get from db.PRAGMAS.
+Older files have to be converted once with a full VACUUM:
+
+    python token_retention.py run [--days N] [--archive-dir DIR]
+    python token_retention.py vacuum [--full]
+"""
+import os
+import sys
+import gzip
+import json
+import argparse
+import datetime
+import threading
+import db
+import metrics
+import token_rollups
+
+# Raw rows older than this many days are archived and deleted; 0 keeps them forever
+RETENTION_DAYS = int(os.environ.get('BMO_TOKEN_RETENTION_DAYS', 30))
+ARCHIVE_DIR = os.environ.get('BMO_TOKEN_ARCHIVE_DIR', os.path.join(os.path.dirname(__file__), 'archive'))
+# Seconds between background retention runs
+RETENTION_INTERVAL = float(os.environ.get('BMO_TOKEN_RETENTION_INTERVAL', 3600))
+# Pages released per incremental_vacuum call (4 KB each by default)
+VACUUM_PAGES = int(os.environ.get('BMO_VACUUM_PAGES', 2000))
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def retention_cutoff(days, now=None):
+    """Start of the hour `days` ago; raw rows before it are pruned."""
+    now = now or datetime.datetime.now()
+    cutoff = (now - datetime.timedelta(days=days)).replace(minute=0, second=0, microsecond=0)
+    return cutoff.strftime(TIMESTAMP_FORMAT)
+
+
+def _rollup_matches(conn, start, end):
+    """True if token_usage_hourly agrees with the raw rows in [start, end)."""
+    raw = conn.execute(f'''
+        SELECT strftime('%Y-%m-%d %H:00', timestamp) AS hour, model_name, {token_rollups.ROLLUP_COLUMNS}
+        FROM token_usage
+        WHERE timestamp >= ? AND timestamp < ?
+        GROUP BY hour, model_name
+    ''', (start, end)).fetchall()
+    if not raw:
+        return True
+    hours = sorted({row[0] for row in raw})
+    rolled = conn.execute('''
+        SELECT hour, model_name, prompt_tokens, completion_tokens, total_tokens,
+               call_count, success_count, failure_count
+        FROM token_usage_hourly
+        WHERE hour >= ? AND hour <= ?
+    ''', (hours[0], hours[-1])).fetchall()
+    expected = {(row[0], row[1]): tuple(row[2:]) for row in raw}
+    actual = {(row[0], row[1]): tuple(row[2:]) for row in rolled if row[0] in set(hours)}
+    return expected == actual
+
+
+def _archive_rows(archive_dir, day, rows):
+    """Appends rows to <archive_dir>/token_usage-<day>.jsonl.gz as a new gzip member."""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f'token_usage-{day}.jsonl.gz')
+    with open(path, 'ab') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='ab') as archive:
+            for row in rows:
+                archive.write(json.dumps(dict(row), separators=(',', ':')).encode('utf-8') + b'\n')
+        raw.flush()
+        os.fsync(raw.fileno())
+    return path
+
+
+def _prune_oldest_day(cutoff, archive_dir):
+    """
+    Archives and deletes raw rows from the oldest remaining day, up to `cutoff`.
+    Returns (day, rows_deleted, repaired), or None when nothing is older than cutoff.
+    """
+    with db.connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        oldest = conn.execute('SELECT MIN(timestamp) FROM token_usage').fetchone()[0]
+        if oldest is None or oldest >= cutoff:
+            return None
+
+        day = oldest[:10]
+        next_day = (datetime.datetime.strptime(day, '%Y-%m-%d') + datetime.timedelta(days=1))
+        end = min(next_day.strftime(TIMESTAMP_FORMAT), cutoff)
+
+        repaired = not _rollup_matches(conn, oldest, end)
+        if repaired:
+            # Rollups drifted from the raw rows; rebuild from this day on before dropping them
+            token_rollups.backfill(conn, since=oldest)
+
+        rows = conn.execute('SELECT * FROM token_usage WHERE timestamp < ? ORDER BY id', (end,)).fetchall()
+        if archive_dir:
+            _archive_rows(archive_dir, day, rows)
+        conn.execute('DELETE FROM token_usage WHERE timestamp < ?', (end,))
+        return day, len(rows), repaired
+
+
+def incremental_vacuum(pages=VACUUM_PAGES):
+    """Releases up to `pages` free pages. Returns the count, or None if auto_vacuum is not incremental."""
+    with db.connection() as conn:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            return None
+        before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        # execute() stops after the first page; executescript() steps the pragma to completion
+        conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+        after = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return before - after
+
+
+def full_vacuum():
+    """Rewrites the whole file; also switches an older database to incremental auto_vacuum."""
+    with db.connection() as conn:
+        conn.execute('VACUUM')
+        return conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+
+
+def apply_retention(days=RETENTION_DAYS, archive_dir=ARCHIVE_DIR, vacuum_pages=VACUUM_PAGES, now=None):
+    """Prunes raw rows older than `days`, then vacuums. Returns a summary dict."""
+    result = {"cutoff": None, "days": [], "deleted": 0, "repaired": 0, "vacuumed_pages": None}
+    if days <= 0:
+        return result
+    cutoff = retention_cutoff(days, now)
+    result["cutoff"] = cutoff
+    with metrics.track('sqlite', 'token_retention'):
+        while True:
+            pruned = _prune_oldest_day(cutoff, archive_dir)
+            if pruned is None:
+                break
+            day, deleted, repaired = pruned
+            result["days"].append(day)
+            result["deleted"] += deleted
+            result["repaired"] += int(repaired)
+        if result["deleted"]:
+            result["vacuumed_pages"] = incremental_vacuum(vacuum_pages)
+    return result
+
+
+class RetentionJob:
+    """Runs apply_retention() every `interval` seconds in a background thread."""
+
+    def __init__(self, days=RETENTION_DAYS, archive_dir=ARCHIVE_DIR, interval=RETENTION_INTERVAL,
+                 vacuum_pages=VACUUM_PAGES):
+        self.days = days
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+        self.last_result = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        self.last_result = apply_retention(self.days, self.archive_dir, self.vacuum_pages)
+        return self.last_result
+
+    def _run(self):
+        while True:
+            try:
+                result = self.run_once()
+                if result["deleted"]:
+                    print(f"Token retention: archived {result['deleted']} rows before {result['cutoff']}")
+            except Exception as e:
+                print(f"Token retention error: {e}")
+            if self._stop.wait(self.interval):
+                break
+
+    def start(self):
+        if self.days <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='token-retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old raw token usage rows and vacuum the database.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_run = sub.add_parser('run', help="Archive and delete raw rows past the retention window")
+    p_run.add_argument('--days', type=int, default=RETENTION_DAYS)
+    p_run.add_argument('--archive-dir', default=ARCHIVE_DIR,
+                       help="Where the gzipped JSONL files go; empty string to skip archiving")
+    p_vacuum = sub.add_parser('vacuum', help="Release free pages back to the filesystem")
+    p_vacuum.add_argument('--full', action='store_true',
+                          help="Full VACUUM; converts older databases to incremental auto_vacuum")
+    args = parser.parse_args(argv)
+
+    db.init_db()
+    if args.command == 'run':
+        result = apply_retention(args.days, args.archive_dir or None)
+        print(f"Deleted {result['deleted']} raw rows before {result['cutoff']} "
+              f"({len(result['days'])} days, {result['repaired']} rollup repairs).")
+    elif args.full:
+        mode = full_vacuum()
+        print(f"Vacuumed; auto_vacuum is now {mode}.")
+    else:
+        freed = incremental_vacuum()
+        if freed is None:
+            print("auto_vacuum is not incremental; run 'vacuum --full' once to convert.")
+        else:
+            print(f"Released {freed} pages.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Maintenance for the token_usage rollup tables.
+
+New rows are aggregated by the token_usage_rollup trigger as they are
+inserted. This script rebuilds the rollups for rows that were already in
+the database before the trigger existed:
+
+    python token_rollups.py backfill [--since "YYYY-MM-DD HH:MM:SS"]
+"""
+import sys
+import argparse
+import db
+
+ROLLUP_COLUMNS = '''
+    SUM(IFNULL(prompt_tokens, 0)),
+    SUM(IFNULL(completion_tokens, 0)),
+    SUM(IFNULL(total_tokens, 0)),
+    SUM(IFNULL(api_call_count, 1)),
+    SUM(CASE WHEN success THEN IFNULL(api_call_count, 1) ELSE 0 END),
+    SUM(CASE WHEN success THEN 0 ELSE IFNULL(api_call_count, 1) END)
+'''
+
+SUMMARY_COLUMNS = '''
+    SUM(prompt_tokens), SUM(completion_tokens), SUM(total_tokens),
+    SUM(call_count), SUM(success_count), SUM(failure_count)
+'''
+
+
+def backfill(conn, since=None):
+    """
+    Recomputes the hourly rollup from raw rows at or after `since` (default:
+    the oldest raw row), then rebuilds the daily and monthly rollups from the
+    hourly one. Hours before `since` are left alone, so summaries whose raw
+    rows have already been pruned are preserved.
+    Returns the number of hourly rows written.
+    """
+    if since is None:
+        since = conn.execute('SELECT MIN(timestamp) FROM token_usage').fetchone()[0]
+        if since is None:
+            return 0
+    since_hour = conn.execute("SELECT strftime('%Y-%m-%d %H:00', ?)", (since,)).fetchone()[0]
+
+    conn.execute('DELETE FROM token_usage_hourly WHERE hour >= ?', (since_hour,))
+    cursor = conn.execute(f'''
+        INSERT INTO token_usage_hourly (hour, model_name, prompt_tokens, completion_tokens,
+                                        total_tokens, call_count, success_count, failure_count)
+        SELECT strftime('%Y-%m-%d %H:00', timestamp) AS hour, model_name, {ROLLUP_COLUMNS}
+        FROM token_usage
+        WHERE timestamp >= ?
+        GROUP BY hour, model_name
+    ''', (since_hour,))
+    written = cursor.rowcount
+
+    conn.execute('DELETE FROM token_usage_daily')
+    conn.execute(f'''
+        INSERT INTO token_usage_daily (day, model_name, prompt_tokens, completion_tokens,
+                                       total_tokens, call_count, success_count, failure_count)
+        SELECT substr(hour, 1, 10) AS day, model_name, {SUMMARY_COLUMNS}
+        FROM token_usage_hourly
+        GROUP BY day, model_name
+    ''')
+
+    conn.execute('DELETE FROM token_usage_monthly')
+    conn.execute(f'''
+        INSERT INTO token_usage_monthly (month, model_name, prompt_tokens, completion_tokens,
+                                         total_tokens, call_count, success_count, failure_count)
+        SELECT substr(hour, 1, 7) AS month, model_name, {SUMMARY_COLUMNS}
+        FROM token_usage_hourly
+        GROUP BY month, model_name
+    ''')
+    return written
+
+
+def backfill_if_empty(conn):
+    """Runs a full backfill when raw rows exist but the rollups were never built."""
+    has_rollups = conn.execute('SELECT 1 FROM token_usage_hourly LIMIT 1').fetchone()
+    has_raw = conn.execute('SELECT 1 FROM token_usage LIMIT 1').fetchone()
+    if has_raw and not has_rollups:
+        return backfill(conn)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain token usage rollup tables.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_backfill = sub.add_parser('backfill', help="Rebuild rollups from raw token_usage rows")
+    p_backfill.add_argument('--since', help="Only recompute hours from this timestamp on")
+    args = parser.parse_args(argv)
+
+    db.init_db()
+    if args.command == 'backfill':
+        with db.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            written = backfill(conn, since=args.since)
+        print(f"Backfilled {written} hourly rollup rows.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
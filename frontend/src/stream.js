@@ -0,0 +1,41 @@
+import { ref } from 'vue'
+
+// True while the server-sent events stream is open; components poll when false
+export const streamConnected = ref(false)
+
+const handlers = {}
+let source = null
+
+export const onStreamEvent = (name, handler) => {
+  if (!handlers[name]) {
+    handlers[name] = []
+    if (source) attach(name)
+  }
+  handlers[name].push(handler)
+}
+
+const attach = (name) => {
+  source.addEventListener(name, (event) => {
+    let data
+    try {
+      data = JSON.parse(event.data)
+    } catch (e) {
+      console.error(`Bad ${name} event`, e)
+      return
+    }
+    handlers[name].forEach(handler => handler(data))
+  })
+}
+
+export const connectStream = () => {
+  if (source || typeof EventSource === 'undefined') return
+  source = new EventSource('/api/stream')
+  Object.keys(handlers).forEach(attach)
+  source.onopen = () => {
+    streamConnected.value = true
+  }
+  // EventSource reconnects on its own; until it does, callers fall back to polling
+  source.onerror = () => {
+    streamConnected.value = false
+  }
+}
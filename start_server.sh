@@ -1,3 +1,20 @@
 #!/bin/bash
 export GEMINI_API_KEY=dummy_key_for_testing
-python3 /home/god/.openclaw/workspace/dashboard-v3/backend/app.py
+cd /home/god/.openclaw/workspace/dashboard-v3/backend
+# BMO_SERVER=asgi runs the async server (needs requirements-asgi.txt)
+if [ "$BMO_SERVER" = "asgi" ]; then
+    exec python3 -m uvicorn asgi:app --host 0.0.0.0 --port 5001
+fi
+# BMO_SERVER=multi runs one collector for the background jobs plus
+# BMO_WORKERS async HTTP workers (default: one per CPU) reading its snapshot
+if [ "$BMO_SERVER" = "multi" ]; then
+    export BMO_SNAPSHOT_PATH=${BMO_SNAPSHOT_PATH:-/dev/shm/bmo-dashboard.snapshot}
+    python3 collector.py &
+    COLLECTOR=$!
+    trap 'kill $COLLECTOR 2>/dev/null' EXIT
+    until [ -s "$BMO_SNAPSHOT_PATH" ] || ! kill -0 $COLLECTOR 2>/dev/null; do sleep 0.2; done
+    BMO_ROLE=worker python3 -m uvicorn asgi:app --host 0.0.0.0 --port 5001 \
+        --workers "${BMO_WORKERS:-$(nproc)}"
+    exit $?
+fi
+python3 app.py